@@ -0,0 +1,256 @@
+# batch_isochron.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+''' batch_isochron.py - Compute the isochrons for many stations and departure
+    times on a date, storing them in the isochron cache or in compressed
+    files.'''
+
+import os
+import sys
+import io
+import argparse
+import datetime
+import gzip
+import csv
+import time
+
+import psycopg2
+
+import nrcif.routing.service
+from nrcif.routing.batch import IsochronBatch, select_origins, select_near
+
+from nrcif.fields import time_to_minutes
+
+
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
+
+def read_time(time_argument):
+    '''Convert the time_argument string to a time object'''
+
+    return datetime.datetime.strptime(time_argument, '%H:%M').time()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("DATE", help="The timetable date in the format "
+                                 "'2015-01-01'",
+                    type=read_date)
+parser.add_argument("TIME", help="Departure times in the format '15:45'",
+                    type=read_time, nargs="+")
+
+parser_origins = parser.add_argument_group("origin stations")
+parser_origins.add_argument("--station", help="A TIPLOC code, 3-alpha code or "
+                                              "station name (may be repeated)",
+                            action="append", default=[])
+parser_origins.add_argument("--max-cate", help="Use all the stations with a "
+                                               "CATE interchange type up to "
+                                               "this value",
+                            action="store", type=int, default=None)
+parser_origins.add_argument("--near", help="Use all the stations within a "
+                                           "distance of a station, given as "
+                                           "the station and the distance in "
+                                           "km",
+                            nargs=2, metavar=("STATION", "KM"), default=None)
+
+parser_output = parser.add_argument_group("output options")
+parser_output.add_argument("--table", help="Store the isochrons in the "
+                                           "util.isochron_cache table",
+                           action="store_true", default=False)
+parser_output.add_argument("--output-dir", help="Write each isochron to a "
+                                                "gzipped CSV file in this "
+                                                "directory",
+                           action="store", default=None)
+parser_output.add_argument("--raster-dir", help="Store a raster of each "
+                                                "isochron in this directory",
+                           action="store", default=None)
+parser_output.add_argument("--workers", help="Number of worker processes "
+                                             "(default one per CPU)",
+                           action="store", type=int, default=None)
+parser_output.add_argument("--batch-size", help="Number of isochrons to "
+                                                "store in the table at once "
+                                                "(default 100)",
+                           action="store", type=int, default=100)
+
+parser_db = parser.add_argument_group("database arguments")
+parser_db.add_argument("--database",
+                       help="PostgreSQL database to use (default ukraildata)",
+                       action="store", default="ukraildata")
+parser_db.add_argument("--user", help="PostgreSQL user for upload",
+                       action="store",
+                       default=os.environ.get("USER", "postgres"))
+parser_db.add_argument("--password", help="PostgreSQL user password",
+                       action="store", default="")
+parser_db.add_argument("--host", help="PostgreSQL host (if using TCP/IP)",
+                       action="store", default=None)
+parser_db.add_argument("--port", help="PostgreSQL port (if required)",
+                       action="store", type=int, default=5432)
+args = parser.parse_args()
+
+if not args.station and args.max_cate is None and args.near is None:
+    parser.error("Give the origin stations with --station, --max-cate or "
+                 "--near")
+if not args.table and not args.output_dir and not args.raster_dir:
+    parser.error("Give an output with --table, --output-dir or --raster-dir")
+
+if args.host:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password,
+                                  host=args.host,
+                                  port=args.port)
+else:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password)
+
+copy_sql = '''COPY util.isochron_cache (station, timetable_date, depart,
+    generation, location, delay, latitude, longitude) FROM STDIN;'''
+
+
+def store_isochrons(cur, buffer):
+    '''Replace any cached isochrons for the stations and departures in the
+    buffer, which holds (station, departure, rows) tuples'''
+
+    cur.execute('''DELETE FROM util.isochron_cache
+        WHERE timetable_date = %s
+            AND (station, depart) IN (SELECT * FROM unnest(%s::char(7)[],
+                                                  %s::time[]));''',
+                (args.DATE, [x[0] for x in buffer], [x[1] for x in buffer]))
+
+    data = io.StringIO()
+    for station, depart, rows in buffer:
+        for row in rows:
+            data.write("\t".join(str(x) for x in
+                                 (station, args.DATE, depart, generation) +
+                                 row))
+            data.write("\n")
+    data.seek(0)
+    cur.copy_expert(copy_sql, data)
+
+
+def write_isochron(station, depart, rows):
+    '''Write an isochron to a gzipped CSV file'''
+
+    filename = "{}_{}_{}.csv.gz".format(station.strip(),
+                                        args.DATE.isoformat(),
+                                        depart.strftime('%H%M'))
+    with gzip.open(os.path.join(args.output_dir, filename), "wt",
+                   newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("location", "delay", "latitude", "longitude"))
+        for location, delay, lat, lon in rows:
+            writer.writerow((location.strip(), delay, lat, lon))
+
+with connection.cursor() as cur:
+
+    print("Loading timetable for {}".format(args.DATE), flush=True)
+    start = time.perf_counter()
+    timetable = nrcif.routing.service.load_timetables(cur, args.DATE,
+                                                      1)[args.DATE]
+    print("Loaded {} connections in {:.1f}s"
+          .format(len(timetable), time.perf_counter() - start))
+
+    origins = []
+    for station in args.station:
+        location_id = timetable.find_station(station)
+        if location_id is None:
+            print("Station {} cannot be identified".format(station))
+            sys.exit(1)
+        origins.append(location_id)
+    if args.max_cate is not None:
+        origins.extend(select_origins(timetable, args.max_cate))
+    if args.near is not None:
+        location_id = timetable.find_station(args.near[0])
+        if location_id is None:
+            print("Station {} cannot be identified".format(args.near[0]))
+            sys.exit(1)
+        try:
+            origins.extend(select_near(timetable, location_id,
+                                       float(args.near[1]) * 1000.0))
+        except ValueError as err:
+            print(err)
+            sys.exit(1)
+    origins = sorted(set(origins))
+
+    if args.table:
+        cur.execute("SELECT pg_is_in_recovery();")
+        if cur.fetchone()[0]:
+            print("The isochrons cannot be stored on a read-only standby")
+            sys.exit(1)
+        cur.execute("SELECT last_value FROM util.load_generation;")
+        generation = cur.fetchone()[0]
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    if args.raster_dir:
+        # Matplotlib is only needed to triangulate the stations for rasters
+        import nrcif.raster
+        rasteriser = nrcif.raster.Rasteriser.from_timetable(timetable)
+        raster_store = nrcif.raster.RasterStore(args.raster_dir)
+        raster_store.set_timetable(timetable)
+
+    departures = {time_to_minutes(t): t for t in args.TIME}
+    total = len(origins) * len(departures)
+    print("Computing {} isochrons".format(total), flush=True)
+
+    batch = IsochronBatch(timetable, args.workers)
+    buffer = []
+    done = 0
+    start = time.perf_counter()
+    try:
+        for origin, depart, rows in batch.run(origins, sorted(departures)):
+            station = timetable.locations[origin]
+            depart = departures[depart]
+            if args.output_dir:
+                write_isochron(station, depart, rows)
+            if args.raster_dir:
+                minutes = nrcif.raster.isochron_minutes(timetable, rows)
+                raster_store.save(station, args.DATE,
+                                  time_to_minutes(depart),
+                                  rasteriser.rasterise(minutes))
+            if args.table:
+                buffer.append((station, depart, rows))
+                if len(buffer) >= args.batch_size:
+                    store_isochrons(cur, buffer)
+                    buffer = []
+            done += 1
+            if done % 100 == 0:
+                print("{} of {} isochrons computed".format(done, total),
+                      flush=True)
+        if buffer:
+            store_isochrons(cur, buffer)
+    finally:
+        batch.close()
+    elapsed = time.perf_counter() - start
+
+    if args.table:
+        connection.commit()
+
+connection.close()
+
+print("Computed {} isochrons in {:.1f}s ({:.1f} per second)"
+      .format(done, elapsed, done / elapsed if elapsed else 0.0))
+for w in batch.worker_stats():
+    print("Worker {}: {} isochrons in {:.1f}s ({:.1f} per second)"
+          .format(w.pid, w.jobs, w.seconds,
+                  w.jobs / w.seconds if w.seconds else 0.0))
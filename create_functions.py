@@ -71,18 +71,39 @@ else:
 
 sources = [
     'alf_get_direct_connections.sql',
+    'alf_links.sql',
+    'hist_release_diff.sql',
     'mca_get_full_timetable.sql',
+    'mca_get_full_timetable_range.sql',
     'mca_get_train_timetable.sql',
+    'mca_refresh_effective_schedule.sql',
     'msn_earliest_departure.sql',
     'msn_find_station.sql',
+    'msn_interchange.sql',
+    'msn_station_names.sql',
+    'msn_station_locations.sql',
+    'util_connection_scan.sql',
+    'util_reverse_connection_scan.sql',
+    'util_connections.sql',
     'util_get_direct_connections.sql',
+    'util_minutes.sql',
+    'util_isochron_cache.sql',
     'util_isochron_latlon.sql',
     'util_isochron.sql',
     'util_iterate_reachable.sql',
+    'util_runs_on.sql',
     'util_natgrid_en_to_latlon.sql',
-    'ztr_get_full_timetable.sql'
+    'ztr_get_full_timetable.sql',
+    'ztr_get_full_timetable_range.sql',
+    'ztr_refresh_effective_schedule.sql'
     ]
 
+# The functions in schemas that are only created on request are skipped when
+# the schema is not in the database
+optional_schemas = {
+    'hist_release_diff.sql': 'hist'
+    }
+
 connection.autocommit = True
 
 with connection.cursor() as cur:
@@ -91,6 +112,14 @@ with connection.cursor() as cur:
     cur.execute('CREATE SCHEMA util;')
 
     for s in sources:
+        if s in optional_schemas:
+            cur.execute('SELECT to_regnamespace(%s) IS NULL;',
+                        (optional_schemas[s],))
+            missing = cur.fetchone()
+            if missing and missing[0]:
+                print("Skipping {} as there is no {} schema"
+                      .format(s, optional_schemas[s]))
+                continue
         file_path = os.path.join(args.source_path, s)
         # Some tools may create .sql files with a superfluous BOM at the
         # start, even though they are supposed to by UTF-8...
@@ -0,0 +1,108 @@
+# export_gtfs.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+''' export_gtfs.py - Write the loaded timetable for a range of dates as a GTFS
+    feed, writing the files of the feed in parallel.'''
+
+import os
+import argparse
+import datetime
+import time
+
+import psycopg2
+
+from nrcif.gtfs import FEED_FILES, export_feed, zip_feed
+
+
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("START", help="The first date of the feed in the format "
+                                  "'2015-01-01'",
+                    type=read_date)
+parser.add_argument("END", help="The last date of the feed in the format "
+                                "'2015-03-31'",
+                    type=read_date)
+parser.add_argument("OUTPUT_DIR", help="The directory to write the feed "
+                                       "files to")
+
+parser_output = parser.add_argument_group("output options")
+parser_output.add_argument("--zip", help="Also put the feed files into this "
+                                         "zip file",
+                           action="store", default=None)
+parser_output.add_argument("--workers", help="Number of files to write at "
+                                             "once, each using its own "
+                                             "database connection (default "
+                                             "4)",
+                           action="store", type=int, default=4)
+
+parser_db = parser.add_argument_group("database arguments")
+parser_db.add_argument("--database",
+                       help="PostgreSQL database to use (default ukraildata)",
+                       action="store", default="ukraildata")
+parser_db.add_argument("--user", help="PostgreSQL user for upload",
+                       action="store",
+                       default=os.environ.get("USER", "postgres"))
+parser_db.add_argument("--password", help="PostgreSQL user password",
+                       action="store", default="")
+parser_db.add_argument("--host", help="PostgreSQL host (if using TCP/IP)",
+                       action="store", default=None)
+parser_db.add_argument("--port", help="PostgreSQL port (if required)",
+                       action="store", type=int, default=5432)
+args = parser.parse_args()
+
+if args.END < args.START:
+    parser.error("The last date is before the first date")
+
+
+def connect():
+    '''Open a new connection to the database'''
+
+    if args.host:
+        return psycopg2.connect(database=args.database,
+                                user=args.user,
+                                password=args.password,
+                                host=args.host,
+                                port=args.port)
+    else:
+        return psycopg2.connect(database=args.database,
+                                user=args.user,
+                                password=args.password)
+
+os.makedirs(args.OUTPUT_DIR, exist_ok=True)
+
+print("Exporting the GTFS feed from {} to {}".format(args.START, args.END),
+      flush=True)
+start = time.perf_counter()
+results = export_feed(connect, args.START, args.END, args.OUTPUT_DIR,
+                      args.workers)
+for name in FEED_FILES:
+    rows, elapsed = results[name]
+    print("{}.txt: {} rows in {:.1f}s".format(name, rows, elapsed))
+
+if args.zip:
+    zip_feed(args.OUTPUT_DIR, args.zip)
+    print("Written {}".format(args.zip))
+
+print("Exported the feed in {:.1f}s".format(time.perf_counter() - start))
@@ -0,0 +1,106 @@
+# export_timetable.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+''' export_timetable.py - Write out the full timetable for each date in a
+    range, from a single pass over the timetable data.'''
+
+import os
+import argparse
+import datetime
+import time
+
+import psycopg2
+
+from nrcif.export import export_copy, export_columnar
+
+
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("START", help="The first date in the format "
+                                  "'2015-01-01'",
+                    type=read_date)
+parser.add_argument("END", help="The last date in the format '2015-01-31'",
+                    type=read_date)
+parser.add_argument("OUTPUT_DIR", help="The directory to write the files to")
+
+parser_output = parser.add_argument_group("output options")
+parser_output.add_argument("--schema", help="The timetable to export, mca or "
+                                            "ztr (default mca)",
+                           action="store", choices=("mca", "ztr"),
+                           default="mca")
+parser_output.add_argument("--format", help="Write files in COPY text format "
+                                            "or NumPy .npz files with an "
+                                            "array for each column (default "
+                                            "copy)",
+                           action="store", choices=("copy", "npz"),
+                           default="copy")
+
+parser_db = parser.add_argument_group("database arguments")
+parser_db.add_argument("--database",
+                       help="PostgreSQL database to use (default ukraildata)",
+                       action="store", default="ukraildata")
+parser_db.add_argument("--user", help="PostgreSQL user for upload",
+                       action="store",
+                       default=os.environ.get("USER", "postgres"))
+parser_db.add_argument("--password", help="PostgreSQL user password",
+                       action="store", default="")
+parser_db.add_argument("--host", help="PostgreSQL host (if using TCP/IP)",
+                       action="store", default=None)
+parser_db.add_argument("--port", help="PostgreSQL port (if required)",
+                       action="store", type=int, default=5432)
+args = parser.parse_args()
+
+if args.END < args.START:
+    parser.error("The last date is before the first date")
+
+if args.host:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password,
+                                  host=args.host,
+                                  port=args.port)
+else:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password)
+
+os.makedirs(args.OUTPUT_DIR, exist_ok=True)
+
+print("Exporting the {} timetables from {} to {}"
+      .format(args.schema, args.START, args.END), flush=True)
+start = time.perf_counter()
+if args.format == "copy":
+    rows = export_copy(connection, args.schema, args.START, args.END,
+                       args.OUTPUT_DIR)
+else:
+    rows = export_columnar(connection, args.schema, args.START, args.END,
+                           args.OUTPUT_DIR)
+elapsed = time.perf_counter() - start
+connection.close()
+
+for d in sorted(rows):
+    print("{}: {} stops".format(d, rows[d]))
+print("Exported {} stops for {} dates in {:.1f}s"
+      .format(sum(rows.values()), len(rows), elapsed))
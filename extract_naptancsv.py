@@ -30,6 +30,8 @@ import contextlib
 import psycopg2
 
 import nrcif.mockdb
+import nrcif.natgrid
+import nrcif.postload
 
 
 parser = argparse.ArgumentParser()
@@ -99,7 +101,9 @@ with zipfile.ZipFile(args.NaPTAN, "r") as naptan, \
             stationnamelang VARCHAR,
             gridtype CHAR(1),
             easting INTEGER,
-            northing INTEGER );
+            northing INTEGER,
+            latitude DOUBLE PRECISION,
+            longitude DOUBLE PRECISION );
     ''')
     if not args.no_index:
         cur.execute('''
@@ -110,14 +114,15 @@ with zipfile.ZipFile(args.NaPTAN, "r") as naptan, \
     fpp = naptan.open('RailReferences.csv', 'r')
     fpp.readline()  # Discard the header line
 
-    sql_placeholder = ",".join(["$"+str(x) for x in range(1, 9)])
+    sql_placeholder = ",".join(["$"+str(x) for x in range(1, 11)])
     cur.execute('''PREPARE ins_naptan AS
             INSERT INTO naptan.railreferences VALUES({});'''
                 .format(sql_placeholder))
 
-    py_placeholder = ",".join(["%s"]*8)
+    py_placeholder = ",".join(["%s"]*10)
     ins_statement = '''EXECUTE ins_naptan ({});'''.format(py_placeholder)
 
+    records = []
     with contextlib.closing(fpp) as fp:
         for record in fp:
             splitrecord = record.decode("ASCII").split(',')
@@ -125,7 +130,22 @@ with zipfile.ZipFile(args.NaPTAN, "r") as naptan, \
                 splitrecord[i] = splitrecord[i].strip('"')
             for i in range(6, 8):
                 splitrecord[i] = int(splitrecord[i])
-            cur.execute(ins_statement, splitrecord[0:8])
+            records.append(splitrecord[0:8])
+
+    # Only the locations given on the UK National Grid (rather than the Irish
+    # grid) are converted to latitude and longitude, all in one go.
+    eastings = [x[6] if x[5] == "U" else 0 for x in records]
+    northings = [x[7] if x[5] == "U" else 0 for x in records]
+    lat, lon = nrcif.natgrid.en_to_latlon_list(eastings, northings)
+
+    for record, record_lat, record_lon in zip(records, lat, lon):
+        cur.execute(ins_statement, record + [record_lat, record_lon])
+    connection.commit()
+
+    # The NaPTAN station names and positions are added to the station name
+    # and location indexes
+    nrcif.postload.refresh_station_names(cur, ("naptan",))
+    nrcif.postload.refresh_station_locations(cur, ("naptan",))
     connection.commit()
 
 connection.autocommit = True
@@ -26,6 +26,7 @@ import os
 import argparse
 import zipfile
 import contextlib
+import datetime
 
 import psycopg2
 
@@ -34,9 +35,18 @@ import nrcif.ztr_reader
 import nrcif.msn_reader
 import nrcif.tsi_reader
 import nrcif.alf_reader
+import nrcif.history
 import nrcif.mockdb
+import nrcif.postload
+import nrcif.projection
+import nrcif.snapshot
 
 
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
 parser = argparse.ArgumentParser()
 parser.add_argument("TTIS",
                     help="The TTIS .zip file containing the required data")
@@ -61,6 +71,62 @@ parser_no.add_argument("--old-naming",
                        help="Use old naming convention in TTIF file",
                        action="store_true", default=False)
 
+parser_no.add_argument("--stopping-patterns",
+                       help="Store the main timetable locations in the "
+                            "normalised stopping pattern layout (the schema "
+                            "must have been generated with the same option)",
+                       action="store_true", default=False)
+parser_no.add_argument("--history",
+                       help="Add the main timetable to the archive of past "
+                            "releases in the hist schema as the release "
+                            "NAME, rather than loading it into the mca "
+                            "schema",
+                       metavar="NAME", action="store", default=None)
+
+parser_proj = parser.add_argument_group("projection options")
+parser_proj.add_argument("--include-records",
+                         help="Only load these optional record types of the "
+                              "main timetable and Z-Trains data, as a comma "
+                              "separated list such as 'TI,AA'",
+                         metavar="LIST", action="store",
+                         type=nrcif.projection.name_list, default=None)
+parser_proj.add_argument("--exclude-records",
+                         help="Don't load these optional record types, as a "
+                              "comma separated list such as 'CR,LN,TN'",
+                         metavar="LIST", action="store",
+                         type=nrcif.projection.name_list, default=[])
+parser_proj.add_argument("--include-fields",
+                         help="Only load these fields of the record types "
+                              "named, as a comma separated list such as "
+                              "'BX.atoc_code,BX.rsid'",
+                         metavar="LIST", action="store",
+                         type=nrcif.projection.name_list, default=[])
+parser_proj.add_argument("--exclude-fields",
+                         help="Don't load these fields, as a comma separated "
+                              "list such as 'BS.headcode,LI.line' (the schema "
+                              "must have been generated with the same "
+                              "projection options)",
+                         metavar="LIST", action="store",
+                         type=nrcif.projection.name_list, default=[])
+
+parser_post = parser.add_argument_group("post-load options")
+parser_post.add_argument("--connections-horizon",
+                         help="Number of days of connections to store for "
+                              "routing (default 0, don't store any)",
+                         metavar="DAYS", action="store", type=int, default=0)
+parser_post.add_argument("--connections-start",
+                         help="The first date to store connections for in "
+                              "the format '2015-01-01' (default today)",
+                         metavar="DATE", action="store", type=read_date,
+                         default=datetime.date.today())
+
+parser_snapshot = parser.add_argument_group("snapshot options")
+parser_snapshot.add_argument("--snapshot",
+                             help="Write a columnar snapshot of the parsed "
+                                  "data to this directory rather than "
+                                  "sending it to the database",
+                             metavar="DIR", action="store", default=None)
+
 parser_db = parser.add_argument_group("database arguments")
 parser_db.add_argument("--dry-run", help="Dump output to a file rather than "
                                          "sending to the database",
@@ -89,11 +155,33 @@ parser_db.add_argument("--maintenance-work-mem",
 
 args = parser.parse_args()
 
+if (args.include_records is not None or args.exclude_records or
+        args.include_fields or args.exclude_fields):
+    try:
+        projection = nrcif.projection.Projection(args.include_records,
+                                                 args.exclude_records,
+                                                 args.include_fields,
+                                                 args.exclude_fields)
+        nrcif.mca_reader.MCA.project_layouts(projection,
+                                             args.stopping_patterns)
+    except ValueError as err:
+        parser.error(str(err))
+else:
+    projection = None
+
+if args.history and (args.snapshot or args.stopping_patterns or projection):
+    parser.error("--history cannot be used with --snapshot, "
+                 "--stopping-patterns or the projection options")
+
 if not zipfile.is_zipfile(args.TTIS):
     print("{} is not a valid ZIP file".format(args.TTIS))
     sys.exit(1)
 
-if args.dry_run:
+if args.snapshot:
+    connection = nrcif.snapshot.Writer(
+        args.snapshot, source=os.path.basename(args.TTIS),
+        projection=projection, stopping_patterns=args.stopping_patterns)
+elif args.dry_run:
     connection = nrcif.mockdb.Connection(args.dry_run)
 else:
     if args.host:
@@ -101,27 +189,42 @@ else:
                                       user=args.user,
                                       password=args.password,
                                       host=args.host,
-                                      port=args.post)
+                                      port=args.port)
     else:
         connection = psycopg2.connect(database=args.database,
                                       user=args.user,
                                       password=args.password)
 
+# The main timetable can be added to the archive rather than the mca schema
+if args.history:
+    mca_class = nrcif.history.HistoryMCA
+else:
+    mca_class = nrcif.mca_reader.MCA
+
 if args.old_naming:
     # job wanted?, job handling class, file extension, needs MSN header fix?
-    jobs = ((args.no_mca, nrcif.mca_reader.MCA, "MCA", False),
+    jobs = ((args.no_mca, mca_class, "MCA", False),
             (args.no_ztr, nrcif.ztr_reader.ZTR, "ZTR", False),
             (args.no_msn, nrcif.msn_reader.MSN, "MSN", True),
             (args.no_tsi, nrcif.tsi_reader.TSI, "TSI", False),
             (args.no_alf, nrcif.alf_reader.ALF, "ALF", False))
 else:
     # job wanted?, job handling class, file extension, needs MSN header fix?
-    jobs = ((args.no_mca, nrcif.mca_reader.MCA, "mca", False),
+    jobs = ((args.no_mca, mca_class, "mca", False),
             (args.no_ztr, nrcif.ztr_reader.ZTR, "ztr", False),
             (args.no_msn, nrcif.msn_reader.MSN, "msn", True),
             (args.no_tsi, nrcif.tsi_reader.TSI, "tsi", False),
             (args.no_alf, nrcif.alf_reader.ALF, "alf", False))
 
+# Any extra options for the job handling classes
+job_options = {nrcif.mca_reader.MCA:
+               {"stopping_patterns": args.stopping_patterns,
+                "projection": projection},
+               nrcif.ztr_reader.ZTR:
+               {"projection": projection},
+               nrcif.history.HistoryMCA:
+               {"release": args.history}}
+
 with zipfile.ZipFile(args.TTIS, "r") as ttis, \
         connection.cursor() as cur:
 
@@ -136,11 +239,19 @@ with zipfile.ZipFile(args.TTIS, "r") as ttis, \
                     (args.maintenance_work_mem*1024,))
 
     ttis_files = {x[-3:]: x for x in ttis.namelist()}
+    loaded = set()
+
+    # The ZTR file does not specify the timetable period, so the period given
+    # in the MCA file is used for the ZTR day bitmaps.
+    period = None
 
     for job in jobs:
 
         if not job[0]:
-            handling_obj = job[1](cur)
+            handling_obj = job[1](cur, **job_options.get(job[1], {}))
+
+            if job[1] is nrcif.ztr_reader.ZTR and period:
+                handling_obj.set_period(*period)
 
             fpp = ttis.open(ttis_files[job[2]], "r")
 
@@ -159,7 +270,29 @@ with zipfile.ZipFile(args.TTIS, "r") as ttis, \
             print()
             connection.commit()
 
-connection.autocommit = True
-with connection.cursor() as cur:
-    cur.execute("VACUUM ANALYZE;")
-connection.close()
+            if job[1] is nrcif.history.HistoryMCA:
+                loaded.add("hist")
+                print("Added {} new schedule blocks to the archive, out of "
+                      "{} in the release".format(
+                          handling_obj.new_blocks,
+                          len(handling_obj.release_blocks)))
+            else:
+                loaded.add(job[2].lower())
+
+            if job[1] is mca_class:
+                period = handling_obj.period
+
+    # The derived data is rebuilt when a snapshot is loaded instead
+    if not args.snapshot:
+        nrcif.postload.refresh_all(cur, loaded, args.connections_start,
+                                   args.connections_horizon)
+    connection.commit()
+
+if args.snapshot:
+    connection.close()
+    print("Written snapshot to {}".format(args.snapshot))
+else:
+    connection.autocommit = True
+    with connection.cursor() as cur:
+        cur.execute("VACUUM ANALYZE;")
+    connection.close()
@@ -0,0 +1,113 @@
+# load_snapshot.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+''' load_snapshot.py - Load a columnar snapshot written by extract_ttis.py into
+    a PostgreSQL database using COPY, without parsing the TTIS files again'''
+
+import os
+import argparse
+import datetime
+import time
+
+import psycopg2
+
+import nrcif.postload
+import nrcif.snapshot
+
+
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("SNAPSHOT", help="The snapshot directory written by "
+                                     "extract_ttis.py --snapshot")
+
+parser_load = parser.add_argument_group("load options")
+parser_load.add_argument("--schema", help="Only load the tables of this "
+                                          "schema (may be repeated)",
+                         action="append", default=None,
+                         choices=("mca", "ztr", "msn", "tsi", "alf"))
+
+parser_post = parser.add_argument_group("post-load options")
+parser_post.add_argument("--connections-horizon",
+                         help="Number of days of connections to store for "
+                              "routing (default 0, don't store any)",
+                         metavar="DAYS", action="store", type=int, default=0)
+parser_post.add_argument("--connections-start",
+                         help="The first date to store connections for in "
+                              "the format '2015-01-01' (default today)",
+                         metavar="DATE", action="store", type=read_date,
+                         default=datetime.date.today())
+
+parser_db = parser.add_argument_group("database arguments")
+parser_db.add_argument("--database",
+                       help="PostgreSQL database to use (default ukraildata)",
+                       action="store", default="ukraildata")
+parser_db.add_argument("--user", help="PostgreSQL user for upload",
+                       action="store",
+                       default=os.environ.get("USER", "postgres"))
+parser_db.add_argument("--password", help="PostgreSQL user password",
+                       action="store", default="")
+parser_db.add_argument("--host", help="PostgreSQL host (if using TCP/IP)",
+                       action="store", default=None)
+parser_db.add_argument("--port", help="PostgreSQL port (if required)",
+                       action="store", type=int, default=5432)
+args = parser.parse_args()
+
+snapshot = nrcif.snapshot.Snapshot(args.SNAPSHOT)
+schemas = snapshot.schemas()
+if args.schema:
+    schemas &= set(args.schema)
+tables = [x for x in snapshot.tables if x.split(".")[0] in schemas]
+
+if snapshot.manifest["options"].get("stopping_patterns") and "mca" in schemas:
+    print("The snapshot uses the stopping pattern layout, so the mca schema "
+          "must have been generated with the same option")
+
+if args.host:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password,
+                                  host=args.host,
+                                  port=args.port)
+else:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password)
+
+with connection.cursor() as cur:
+    for table in tables:
+        start = time.perf_counter()
+        print("Loading {}: ".format(table), end="", flush=True)
+        rows = snapshot.load(cur, [table])[table]
+        print("{} rows in {:.1f}s".format(rows, time.perf_counter() - start))
+    connection.commit()
+
+    nrcif.postload.refresh_all(cur, schemas, args.connections_start,
+                               args.connections_horizon)
+    connection.commit()
+
+connection.autocommit = True
+with connection.cursor() as cur:
+    cur.execute("VACUUM ANALYZE;")
+connection.close()
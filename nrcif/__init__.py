@@ -26,6 +26,10 @@ discrepancies between the available public documentation of the format and the
 actual files, this module provide basic CIF tools that will need to be
 customised for each source of CIF files.'''
 
+import operator
+
+from nrcif.fields import ExcludedField
+
 
 class UnexpectedCIFRecord(Exception):
     '''An exception raised when a record being processed is not of a valid
@@ -36,6 +40,22 @@ class UnexpectedCIFRecord(Exception):
     pass
 
 
+def sql_name(name):
+    '''Convert the name of a field into the name of its SQL column'''
+
+    return name.replace(" ", "_").replace("-", "_").lower()
+
+
+def _selector(positions):
+    '''Return a function that picks the values at the given positions out of
+    a list, as a tuple'''
+
+    if len(positions) == 1:
+        position = positions[0]
+        return lambda values: (values[position],)
+    return operator.itemgetter(*positions)
+
+
 class CIFReader(object):
     '''A state machine with side-effects that forms a base for handling CIF
     files.'''
@@ -60,12 +80,20 @@ class CIFReader(object):
 
     schema = "public"
 
+    # The record types that a projection can leave out of a load, and the
+    # fields of each record type that the reader needs and so cannot be left
+    # out, by column name
+    optional_records = frozenset()
+    key_fields = dict()
+
     def __init__(self, cur):
         '''Requires a DB API cursor to the database contains the data'''
 
         self.cur = cur
         self.context = dict()
         self.sql = dict()
+        self.selectors = dict()
+        self.skip_records = frozenset()
         self.state = "Start_Of_File"
 
         # This code pre-builds a dict of any process_ZZ methods that have been
@@ -77,15 +105,33 @@ class CIFReader(object):
             except AttributeError:
                 pass
 
-    def prepare_sql_insert(self, rtype, tablename, number_params=None):
+    @classmethod
+    def project_layouts(cls, projection):
+        '''Return the layouts of the reader with a nrcif.projection.Projection
+        applied, and the set of record types that it leaves out'''
+
+        if projection is None:
+            return cls.layouts, frozenset()
+        return projection.apply(cls.layouts, cls.optional_records,
+                                cls.key_fields)
+
+    def prepare_sql_insert(self, rtype, tablename, number_params=None,
+                           omit=()):
         '''Prepare a suitable SQL insert statement for record type rtype in
         the schema self.schema, the table named tablename and with the
         specified number of parameters (inferred from the record type if not
-        specified.'''
+        specified. The positions of any parameters that have been left out of
+        the table by a projection are given in omit, counting from 0, and are
+        dropped by the insert method.'''
 
         if not number_params:
             number_params = self.layouts[rtype].sql_width
 
+        if omit:
+            kept = [x for x in range(number_params) if x not in omit]
+            self.selectors[rtype] = _selector(kept)
+            number_params = len(kept)
+
         sql_params = ",".join(["$"+str(x)
                                for x in range(1, number_params+1)])
 
@@ -99,6 +145,15 @@ class CIFReader(object):
                                                               tablename,
                                                               params)
 
+    def insert(self, rtype, params):
+        '''Insert a row using the statement prepared for record type rtype,
+        dropping any parameters that have been left out by a projection'''
+
+        selector = self.selectors.get(rtype)
+        if selector is not None:
+            params = selector(params)
+        self.cur.execute(self.sql[rtype], params)
+
     def process(self, record):
         '''Process a record and call any specialist handlers that may have been
         defined in subclasses.'''
@@ -114,6 +169,8 @@ class CIFReader(object):
                                       .format(rtype, self.state))
 
         self.state = rtype
+        if rtype in self.skip_records:
+            return
         self.context[rtype] = self.layouts[rtype].read(record)
         if rtype in self.process_methods:
             self.process_methods[rtype]()
@@ -128,6 +185,26 @@ class CIFRecord(object):
         self.width = sum((x.width for x in self.fields))
         self.sql_width = sum((1 for x in self.fields if x.sql_type))
 
+        # The positions among the values read of any data fields that have
+        # been left out by a projection
+        data_fields = [x for x in self.fields if x.sql_type]
+        self.omitted = [i for i, x in enumerate(data_fields) if x.excluded]
+
+    def column_names(self):
+        '''Return the SQL column names of the record's data fields'''
+
+        return [sql_name(x.name) for x in self.fields if x.sql_type]
+
+    def project(self, excluded):
+        '''Return a copy of the record in which the data fields with the given
+        column names are not decoded, are read as None and are left out of the
+        SQL DDL'''
+
+        return CIFRecord(self.name,
+                         (ExcludedField(x) if x.sql_type and
+                          sql_name(x.name) in excluded else x
+                          for x in self.fields))
+
     def read(self, text):
         '''Convert a fixed-format record into a list of Python values'''
 
@@ -163,14 +240,12 @@ class CIFRecord(object):
         result = ""
         first_field = True
         for field in self.fields:
-            if field.sql_type:
+            if field.sql_type and not field.excluded:
                 if first_field:
                     first_field = False
                 else:
                     result += ",\n"
-                clean_name = field.name.replace(" ", "_")\
-                    .replace("-", "_").lower()
-                result += "\t{0}\t\t{1}".format(clean_name,
+                result += "\t{0}\t\t{1}".format(sql_name(field.name),
                                                 field.sql_type)
         return result
 
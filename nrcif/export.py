@@ -0,0 +1,183 @@
+# export.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''export - Write out the full timetables for a range of dates
+
+The get_full_timetable_range functions return the full timetable for every
+date in a range from a single query. This module streams the result into a
+separate file for each date, either in the text format used by the
+PostgreSQL COPY command, so that the timetables can be loaded into other
+tables or databases without any conversion, or as NumPy .npz files holding
+one array for each column. Only one day of the timetable is held in memory
+at a time.'''
+
+import os
+
+import numpy as np
+
+from nrcif.fetch import iter_batches, DEFAULT_BATCH_SIZE
+
+# The columns returned by the get_full_timetable functions, with the dtypes
+# used in the columnar files
+TIMETABLE_COLUMNS = (("train_uid", "U6"),
+                     ("stp_indicator", "U1"),
+                     ("loc_order", np.int32),
+                     ("xmidnight", np.bool_),
+                     ("location", "U7"),
+                     ("scheduled_arrival", np.int32),
+                     ("scheduled_departure", np.int32),
+                     ("scheduled_pass", np.int32),
+                     ("platform", "U3"),
+                     ("arrival_min", np.int32),
+                     ("departure_min", np.int32),
+                     ("pass_min", np.int32))
+
+# Used in the columnar files for times that are not given
+MISSING = -1
+
+
+def export_filename(directory, schema, timetable_date, extension):
+    '''Return the name of the file for the timetable on a date'''
+
+    return os.path.join(directory, "{}_timetable_{:%Y%m%d}.{}"
+                        .format(schema, timetable_date, extension))
+
+
+def _column_sql(name, dtype):
+    '''Return the SQL for a column in the columnar files, with the scheduled
+    times given as seconds after midnight and the missing values replaced'''
+
+    if name.startswith("scheduled_"):
+        return "COALESCE(EXTRACT(EPOCH FROM {})::integer, {})" \
+            .format(name, MISSING)
+    elif dtype is np.int32:
+        return "COALESCE({}, {})".format(name, MISSING)
+    elif dtype is np.bool_:
+        return "COALESCE({}, FALSE)".format(name)
+    else:
+        return "COALESCE({}, '')".format(name)
+
+
+class DateSplitter(object):
+    '''A file-like object to be passed to cursor.copy_expert, which writes
+    each line of COPY text output to the file for the date in its first
+    column, leaving out the date. The lines must be in order of date.'''
+
+    def __init__(self, directory, schema):
+        self.directory = directory
+        self.schema = schema
+        self.buffer = b""
+        self.date_text = None
+        self.date = None
+        self.file = None
+        self.rows = dict()
+
+    def _switch(self, date_text):
+        if self.file is not None:
+            self.file.close()
+        self.date_text = date_text
+        self.date = np.datetime64(date_text.decode("ascii")).item()
+        self.rows[self.date] = 0
+        self.file = open(export_filename(self.directory, self.schema,
+                                         self.date, "copy"), "wb")
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("UTF-8")
+        lines = (self.buffer + data).split(b"\n")
+        # The last piece is an incomplete line, or empty
+        self.buffer = lines.pop()
+        for line in lines:
+            date_text, rest = line.split(b"\t", 1)
+            if date_text != self.date_text:
+                self._switch(date_text)
+            self.file.write(rest + b"\n")
+            self.rows[self.date] += 1
+        return len(data)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+def export_copy(connection, schema, start_date, end_date, directory):
+    '''Write the full timetable from a schema for each date from start_date
+    to end_date inclusive to a file in COPY text format, returning a dict
+    of the number of rows written for each date. The columns are those of
+    the get_full_timetable functions.'''
+
+    splitter = DateSplitter(directory, schema)
+    try:
+        with connection.cursor() as cur:
+            query = cur.mogrify("COPY (SELECT * FROM {}.get_full_timetable_"
+                                "range(%s, %s)) TO STDOUT"
+                                .format(schema), (start_date, end_date))
+            cur.copy_expert(query.decode("UTF-8"), splitter)
+    finally:
+        splitter.close()
+    return splitter.rows
+
+
+def _write_columnar(directory, schema, timetable_date, chunks):
+    columns = {name: np.concatenate([chunk[i] for chunk in chunks])
+               for i, (name, dtype) in enumerate(TIMETABLE_COLUMNS)}
+    np.savez(export_filename(directory, schema, timetable_date, "npz"),
+             **columns)
+    return len(columns["train_uid"])
+
+
+def export_columnar(connection, schema, start_date, end_date, directory,
+                    batch_size=DEFAULT_BATCH_SIZE):
+    '''Write the full timetable from a schema for each date from start_date
+    to end_date inclusive to a NumPy .npz file with an array for each of
+    the columns of the get_full_timetable functions, returning a dict of the
+    number of rows written for each date. The scheduled times are given as
+    seconds after midnight, and missing times and minutes as MISSING.'''
+
+    query = "SELECT timetable_date, {} FROM {}.get_full_timetable_range" \
+        "(%s, %s);".format(", ".join(_column_sql(name, dtype)
+                                     for name, dtype in TIMETABLE_COLUMNS),
+                           schema)
+    dtypes = ("datetime64[D]",) + tuple(x[1] for x in TIMETABLE_COLUMNS)
+
+    rows = dict()
+    current = None
+    chunks = []
+    for batch in iter_batches(connection, query, (start_date, end_date),
+                              dtypes, batch_size):
+        # The rows are in order of date, so each batch is split where the
+        # date changes
+        dates = batch[0]
+        breaks = np.flatnonzero(dates[1:] != dates[:-1]) + 1
+        for begin, end in zip(np.concatenate(([0], breaks)),
+                              np.concatenate((breaks, [len(dates)]))):
+            timetable_date = dates[begin].item()
+            if timetable_date != current:
+                if chunks:
+                    rows[current] = _write_columnar(directory, schema,
+                                                    current, chunks)
+                current = timetable_date
+                chunks = []
+            chunks.append([column[begin:end] for column in batch[1:]])
+    if chunks:
+        rows[current] = _write_columnar(directory, schema, current, chunks)
+    return rows
@@ -0,0 +1,80 @@
+# fetch.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''fetch - Stream query results into NumPy arrays
+
+Large query results are read through a named (server-side) cursor, so that
+PostgreSQL sends the rows in batches rather than all at once, and each batch
+is copied column by column into NumPy arrays rather than being built up into
+Python lists one row at a time. The arrays are allocated in advance and
+doubled in size when they are full.'''
+
+import itertools
+
+import numpy as np
+
+DEFAULT_BATCH_SIZE = 10000
+
+# Used to give each server-side cursor a unique name
+_cursor_ids = itertools.count()
+
+
+def iter_batches(connection, query, params=None, dtypes=(),
+                 batch_size=DEFAULT_BATCH_SIZE):
+    '''Run a query on a psycopg2 connection and yield the results in batches
+    of up to batch_size rows, with each batch given as a list of NumPy arrays
+    with the given dtypes, one for each column. As a named cursor is used,
+    the connection must not be in autocommit mode.'''
+
+    name = "nrcif_fetch_{}".format(next(_cursor_ids))
+    with connection.cursor(name) as cur:
+        cur.itersize = batch_size
+        cur.execute(query, params)
+        while True:
+            rows = cur.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [np.array(column, dtype=dtype)
+                   for column, dtype in zip(zip(*rows), dtypes)]
+
+
+def fetch_arrays(connection, query, params=None, dtypes=(),
+                 batch_size=DEFAULT_BATCH_SIZE, size_hint=None):
+    '''Run a query on a psycopg2 connection and return the whole result as a
+    list of NumPy arrays with the given dtypes, one for each column.
+    size_hint is the number of rows expected, if it is known.'''
+
+    size = size_hint or batch_size
+    arrays = [np.empty(size, dtype=dtype) for dtype in dtypes]
+    n = 0
+
+    for batch in iter_batches(connection, query, params, dtypes, batch_size):
+        end = n + len(batch[0])
+        if end > size:
+            size = max(end, size * 2)
+            grown = [np.empty(size, dtype=dtype) for dtype in dtypes]
+            for old, new in zip(arrays, grown):
+                new[:n] = old[:n]
+            arrays = grown
+        for array, column in zip(arrays, batch):
+            array[n:end] = column
+        n = end
+
+    return [array[:n] for array in arrays]
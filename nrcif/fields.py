@@ -31,6 +31,7 @@ class CIFField(object):
 
     sql_type = None
     py_type = type(None)
+    excluded = False
 
     def __init__(self, name, width):
         self.name = name
@@ -130,6 +131,24 @@ class SpareField(CIFField):
         return None
 
 
+class ExcludedField(CIFField):
+    '''Stands in for a data field that has been left out of a load by a
+    projection. The text is never decoded and the field is read as None, but
+    it keeps its place among the data fields of the record.'''
+
+    py_type = None
+    excluded = True
+
+    def __init__(self, field):
+        self.name = field.name
+        self.width = field.width
+        self.sql_type = field.sql_type
+
+    @classmethod
+    def read(cls, text):
+        return None
+
+
 class FlagField(CIFField):
     '''Represents a 1-char wide CIF field that must be one of a set of
     flags'''
@@ -194,6 +213,47 @@ class TimeHField(CIFField):
                                  second=0)
 
 
+def time_to_minutes(value, round_up=False):
+    '''Convert a time read by a TimeField or TimeHField into the number of
+    minutes since midnight. Half-minutes are rounded down unless round_up is
+    set, so that arrivals can be rounded up and departures rounded down.'''
+
+    if value is None:
+        return None
+
+    result = value.hour * 60 + value.minute
+    if round_up and value.second:
+        result += 1
+    return result
+
+
+def time_to_half_minutes(value):
+    '''Convert a time read by a TimeField or TimeHField into the number of
+    half-minutes since midnight, which represents scheduled times exactly.'''
+
+    if value is None:
+        return None
+
+    return value.hour * 120 + value.minute * 2 + (1 if value.second else 0)
+
+
+def array_literal(values):
+    '''Format a list as an SQL array literal. This is used rather than
+    letting the database adapter build an ARRAY[] expression as an array where
+    every element is NULL would otherwise have the wrong type.'''
+
+    result = []
+    for x in values:
+        if x is None:
+            result.append("NULL")
+        elif isinstance(x, str):
+            result.append('"' + x.replace("\\", "\\\\").replace('"', '\\"') +
+                          '"')
+        else:
+            result.append(str(x))
+    return "{" + ",".join(result) + "}"
+
+
 class DDMMYYDateField(CIFField):
     '''Represents a date in the DDMMYY format with Y2K munging'''
 
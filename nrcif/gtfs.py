@@ -0,0 +1,312 @@
+# gtfs.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''gtfs - Export the timetable as a GTFS feed
+
+The loaded MCA and ZTR schedules are written out as the files of a General
+Transit Feed Specification (GTFS) feed covering a range of dates. Each file
+is produced by its own COPY ... TO STDOUT query on its own connection, with
+PostgreSQL formatting the CSV and the output written straight to the file, so
+the files can be written in parallel and the timetable is never held in
+memory. All the connections share a snapshot exported by the first, so the
+files are consistent even if the data is being changed.
+
+The trips and services are given small integer ids, taken from the rank of
+each schedule's key (the source schema, train UID, date_runs_from and STP
+indicator), which are the same in every query and so do not have to be
+passed between the connections. Each schedule is a trip with its own
+service, whose calendar gives the days it runs from the basic schedule, with
+the dates on which it is overlaid or cancelled in calendar_dates. The stops
+are the stations with known positions, identified by their TIPLOCs, and the
+routes and agencies are the train operators, identified by their ATOC codes.
+The transfers are the interchange times in msn.interchange, including the TOC
+specific times as transfers between routes, and the fixed links in
+alf.links.'''
+
+import concurrent.futures
+import os
+import time
+import zipfile
+
+from psycopg2.extensions import ISOLATION_LEVEL_REPEATABLE_READ
+
+# Used for the schedules without an ATOC code
+UNKNOWN_TOC = "ZZ"
+
+AGENCY_URL = "https://www.nationalrail.co.uk/"
+AGENCY_TIMEZONE = "Europe/London"
+
+# Route type for rail services
+ROUTE_TYPE_RAIL = 2
+
+# The schedules that are in force on any of the dates in the feed, with their
+# trip ids. Cancellations are left out, as they only remove dates from the
+# other schedules. %(start)s and %(end)s are the first and last dates.
+SCHEDULES_CTE = '''schedules AS (
+    SELECT dense_rank() OVER (ORDER BY source, train_uid, date_runs_from,
+                                       stp_indicator) AS trip_id, s.*
+    FROM (
+        SELECT 'mca' AS source, train_uid, date_runs_from, date_runs_to,
+            stp_indicator, days_run,
+            COALESCE(atoc_code, '{0}') AS atoc_code
+        FROM mca.basic_schedule AS bs
+        WHERE stp_indicator <> 'C' AND EXISTS (
+            SELECT 1 FROM mca.effective_schedule AS es
+            WHERE es.train_uid = bs.train_uid AND
+                es.date_runs_from = bs.date_runs_from AND
+                es.stp_indicator = bs.stp_indicator AND
+                es.valid_dates && daterange(%(start)s, %(end)s, '[]'))
+        UNION ALL
+        SELECT 'ztr', train_uid, date_runs_from, date_runs_to,
+            stp_indicator, days_run,
+            COALESCE(atoc_code, '{0}')
+        FROM ztr.basic_schedule AS bs
+        WHERE stp_indicator <> 'C' AND EXISTS (
+            SELECT 1 FROM ztr.effective_schedule AS es
+            WHERE es.train_uid = bs.train_uid AND
+                es.date_runs_from = bs.date_runs_from AND
+                es.stp_indicator = bs.stp_indicator AND
+                es.valid_dates && daterange(%(start)s, %(end)s, '[]'))
+        ) AS s
+    )'''.format(UNKNOWN_TOC)
+
+# The stations with known positions, which are the stops of the feed
+STATIONS_CTE = '''stations AS (
+    SELECT tiploc_code, _3_alpha_code, station_name, cate_type, latitude,
+        longitude
+    FROM msn.station_detail
+    WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    )'''
+
+# The ZTR locations are given as 3-alpha codes, so they are replaced by the
+# main TIPLOC of each station
+MAIN_TIPLOCS_CTE = '''main_tiplocs AS (
+    SELECT DISTINCT ON (_3_alpha_code) _3_alpha_code, tiploc_code
+    FROM stations
+    ORDER BY _3_alpha_code, cate_type = 9, tiploc_code
+    )'''
+
+_LOCATION_TABLES = ("origin_location", "intermediate_location",
+                    "terminating_location")
+
+
+def _gtfs_time(column):
+    '''Return the SQL to format minutes after midnight as a GTFS time, which
+    may be after 24:00:00 for trains that run past midnight. The percent
+    signs are doubled as the query is given parameters.'''
+
+    return "format('%%s:%%s:00', lpad(({0} / 60)::text, 2, '0'), " \
+        "lpad(({0} %% 60)::text, 2, '0'))".format(column)
+
+
+def _calling_points_sql():
+    '''Return the SQL for the calling points of the trains in both
+    schemas, with the TIPLOC of each as stop_id'''
+
+    queries = []
+    for schema, stop_id, join in (
+            ("mca", "l.location", ""),
+            ("ztr", "m.tiploc_code",
+             "\n            INNER JOIN main_tiplocs AS m\n"
+             "                ON (m._3_alpha_code = LEFT(l.location, 3))")):
+        for table in _LOCATION_TABLES:
+            queries.append('''SELECT '{0}' AS source, l.train_uid,
+            l.date_runs_from, l.stp_indicator, l.loc_order, {1} AS stop_id,
+            l.arrival_min, l.departure_min
+        FROM {0}.{2} AS l{3}
+        WHERE l.arrival_min IS NOT NULL OR l.departure_min IS NOT NULL'''
+                           .format(schema, stop_id, table, join))
+    return "\n        UNION ALL\n        ".join(queries)
+
+STOP_TIMES_SQL = '''WITH {}, {}, {}
+    SELECT s.trip_id,
+        {} AS arrival_time,
+        {} AS departure_time,
+        trim(c.stop_id) AS stop_id, c.loc_order AS stop_sequence
+    FROM (
+        {}
+        ) AS c
+        INNER JOIN schedules AS s
+            USING (source, train_uid, date_runs_from, stp_indicator)
+    WHERE c.stop_id IN (SELECT tiploc_code FROM stations)
+    ORDER BY s.trip_id, c.loc_order'''.format(
+        SCHEDULES_CTE, STATIONS_CTE, MAIN_TIPLOCS_CTE,
+        _gtfs_time("COALESCE(c.arrival_min, c.departure_min)"),
+        _gtfs_time("COALESCE(c.departure_min, c.arrival_min)"),
+        _calling_points_sql())
+
+FEED_SQL = {
+    "agency": '''WITH {}
+        SELECT DISTINCT atoc_code AS agency_id, atoc_code AS agency_name,
+            '{}' AS agency_url, '{}' AS agency_timezone
+        FROM schedules
+        ORDER BY atoc_code'''.format(SCHEDULES_CTE, AGENCY_URL,
+                                     AGENCY_TIMEZONE),
+
+    "routes": '''WITH {}
+        SELECT DISTINCT atoc_code AS route_id, atoc_code AS agency_id,
+            atoc_code AS route_short_name, '' AS route_long_name,
+            {} AS route_type
+        FROM schedules
+        ORDER BY atoc_code'''.format(SCHEDULES_CTE, ROUTE_TYPE_RAIL),
+
+    "stops": '''WITH {}
+        SELECT trim(tiploc_code) AS stop_id, _3_alpha_code AS stop_code,
+            trim(station_name) AS stop_name, latitude AS stop_lat,
+            longitude AS stop_lon
+        FROM stations
+        ORDER BY tiploc_code'''.format(STATIONS_CTE),
+
+    "trips": '''WITH {}
+        SELECT atoc_code AS route_id, trip_id AS service_id, trip_id,
+            train_uid AS trip_short_name
+        FROM schedules
+        ORDER BY trip_id'''.format(SCHEDULES_CTE),
+
+    "stop_times": STOP_TIMES_SQL,
+
+    "calendar": '''WITH {}
+        SELECT trip_id AS service_id,
+            days_run[1]::integer AS monday, days_run[2]::integer AS tuesday,
+            days_run[3]::integer AS wednesday,
+            days_run[4]::integer AS thursday, days_run[5]::integer AS friday,
+            days_run[6]::integer AS saturday, days_run[7]::integer AS sunday,
+            to_char(GREATEST(date_runs_from, %(start)s), 'YYYYMMDD')
+                AS start_date,
+            to_char(LEAST(date_runs_to, %(end)s), 'YYYYMMDD') AS end_date
+        FROM schedules
+        ORDER BY trip_id'''.format(SCHEDULES_CTE),
+
+    # The dates on which a schedule would run but another schedule for the
+    # same train is in force instead, or the train is cancelled
+    "calendar_dates": '''WITH {}
+        SELECT s.trip_id AS service_id, to_char(d, 'YYYYMMDD') AS date,
+            2 AS exception_type
+        FROM schedules AS s,
+            generate_series(GREATEST(s.date_runs_from, %(start)s),
+                            LEAST(s.date_runs_to, %(end)s),
+                            '1 day'::interval) AS d
+        WHERE s.days_run[EXTRACT(ISODOW FROM d)] AND NOT EXISTS (
+            SELECT 1
+            FROM (  SELECT 'mca' AS source, * FROM mca.effective_schedule
+                    UNION ALL
+                    SELECT 'ztr', * FROM ztr.effective_schedule
+                ) AS es
+            WHERE es.source = s.source AND
+                es.train_uid = s.train_uid AND
+                es.date_runs_from = s.date_runs_from AND
+                es.stp_indicator = s.stp_indicator AND
+                es.day_of_week = EXTRACT(ISODOW FROM d) AND
+                es.valid_dates @> d::date)
+        ORDER BY s.trip_id, d'''.format(SCHEDULES_CTE),
+
+    # The standard and TOC specific interchange times at each station, and
+    # the longest fixed link between each pair of stations on any of the
+    # dates. The hours and days of the fixed links cannot be given in GTFS.
+    "transfers": '''WITH {}, {}, tocs AS (
+        SELECT DISTINCT atoc_code FROM schedules
+        )
+        SELECT trim(i.tiploc_code) AS from_stop_id,
+            trim(i.tiploc_code) AS to_stop_id,
+            NULLIF(i.arriving_toc, '**') AS from_route_id,
+            NULLIF(i.departing_toc, '**') AS to_route_id,
+            2 AS transfer_type, i.change_time * 60 AS min_transfer_time
+        FROM msn.interchange AS i
+        WHERE i.tiploc_code IN (SELECT tiploc_code FROM stations) AND
+            (i.arriving_toc = '**' OR
+             i.arriving_toc IN (SELECT atoc_code FROM tocs)) AND
+            (i.departing_toc = '**' OR
+             i.departing_toc IN (SELECT atoc_code FROM tocs))
+        UNION ALL
+        SELECT trim(l.from_tiploc), trim(l.to_tiploc), NULL, NULL, 2,
+            MAX(l.link_time) * 60
+        FROM alf.links AS l
+        WHERE l.from_tiploc IN (SELECT tiploc_code FROM stations) AND
+            l.to_tiploc IN (SELECT tiploc_code FROM stations) AND
+            l.valid_dates && daterange(%(start)s, %(end)s, '[]')
+        GROUP BY l.from_tiploc, l.to_tiploc
+        ORDER BY 1, 2, 3 NULLS FIRST, 4 NULLS FIRST'''.format(
+            SCHEDULES_CTE, STATIONS_CTE)
+    }
+
+FEED_FILES = tuple(FEED_SQL)
+
+
+def export_file(connect, snapshot, name, start_date, end_date, directory):
+    '''Write one file of the feed on a new connection using the snapshot,
+    returning the number of rows written and the time taken'''
+
+    started = time.perf_counter()
+    connection = connect()
+    try:
+        connection.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ,
+                               readonly=True)
+        with connection.cursor() as cur:
+            if snapshot is not None:
+                cur.execute("SET TRANSACTION SNAPSHOT %s;", (snapshot,))
+            query = cur.mogrify(FEED_SQL[name], {"start": start_date,
+                                                 "end": end_date})
+            with open(os.path.join(directory, name + ".txt"), "wb") as f:
+                cur.copy_expert("COPY ({}) TO STDOUT WITH (FORMAT csv, "
+                                "HEADER)".format(query.decode("UTF-8")), f)
+            rows = cur.rowcount
+        connection.rollback()
+    finally:
+        connection.close()
+    return rows, time.perf_counter() - started
+
+
+def export_feed(connect, start_date, end_date, directory, workers=None,
+                files=FEED_FILES):
+    '''Write the GTFS feed for the dates from start_date to end_date
+    inclusive to a directory, with up to workers files written at once.
+    connect is a function that returns a new DB API connection. Returns a
+    dict of the number of rows written and the time taken for each file.'''
+
+    results = dict()
+    connection = connect()
+    try:
+        connection.set_session(isolation_level=ISOLATION_LEVEL_REPEATABLE_READ,
+                               readonly=True)
+        with connection.cursor() as cur:
+            cur.execute("SELECT pg_export_snapshot();")
+            snapshot = cur.fetchone()[0]
+
+        # The snapshot can only be used while the transaction that exported
+        # it is open
+        with concurrent.futures.ThreadPoolExecutor(workers) as executor:
+            futures = {executor.submit(export_file, connect, snapshot, name,
+                                       start_date, end_date, directory): name
+                       for name in files}
+            for future in concurrent.futures.as_completed(futures):
+                results[futures[future]] = future.result()
+        connection.rollback()
+    finally:
+        connection.close()
+    return results
+
+
+def zip_feed(directory, filename, files=FEED_FILES):
+    '''Put the files of a feed written by export_feed into a zip file'''
+
+    with zipfile.ZipFile(filename, "w", zipfile.ZIP_DEFLATED) as zf:
+        for name in files:
+            zf.write(os.path.join(directory, name + ".txt"), name + ".txt")
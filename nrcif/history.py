@@ -0,0 +1,280 @@
+# history.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''history - Keep an archive of the main timetable from a series of releases
+
+The hist schema holds the main timetable from any number of TTIS releases.
+The records of each schedule, from the BS record to the LT record, form a
+block, which is identified by the SHA-1 hash of its text. Each distinct block
+is parsed and stored only once, however many releases it appears in, and the
+release_block table lists the blocks that make up each release. As most
+schedules are unchanged from one release to the next, only the new blocks of
+each release have to be parsed or stored.
+
+The HistoryMCA class adds a release to the archive, and materialise_release
+copies a release back into the tables of the mca schema so that it can be
+used in the same way as a release loaded by extract_ttis.py. The changes
+between two releases are found from the hashes alone by the
+hist.release_diff function.'''
+
+import hashlib
+import io
+
+import nrcif.mca_reader
+import nrcif.service_calendar
+import nrcif.snapshot
+
+# The tables holding the schedule blocks, and those holding the other records
+# of each release
+BLOCK_TABLES = ("basic_schedule", "origin_location", "intermediate_location",
+                "changes_en_route", "terminating_location",
+                "location_specific_note")
+RELEASE_TABLES = ("associations", "tiploc_insert", "tiploc_amend",
+                  "tiploc_delete")
+
+
+class HistoryMCA(nrcif.mca_reader.MCA):
+    '''A state machine with side-effects that adds the MCA file of a release
+    to the archive. The records of each schedule are gathered into a block and
+    hashed, and only blocks that are not already in the archive are parsed.'''
+
+    schema = "hist"
+
+    # The records that make up a schedule block
+    block_types = frozenset(("BS", "BX", "TN", "LO", "LI", "CR", "LT", "LN"))
+
+    # The day bitmaps depend on the timetable period of each release, so are
+    # only built when a release is materialised
+    day_bitmaps = False
+
+    def __init__(self, cur, release):
+        '''Requires a DB API cursor to the database containing the archive
+        and a name for the release, which must not already be in use'''
+
+        self.templates = dict()
+        super().__init__(cur)
+        self.block = []
+        self.release_blocks = set()
+        self.new_blocks = 0
+
+        # Only one release can be added at a time
+        cur.execute("LOCK TABLE hist.release, hist.schedule_block "
+                    "IN SHARE ROW EXCLUSIVE MODE;")
+        cur.execute('''SELECT
+            (SELECT COALESCE(max(release_id), 0) FROM hist.release),
+            (SELECT COALESCE(max(block_id), 0) FROM hist.schedule_block);''')
+        previous, self.last_block_id = cur.fetchone() or (0, 0)
+        self.release_id = previous + 1
+
+        cur.execute("INSERT INTO hist.release VALUES(%s,%s,now(),NULL,NULL);",
+                    (self.release_id, release))
+
+        # The blocks of the latest release are kept in memory, as most of
+        # them will be in this release as well
+        cur.execute('''SELECT sb.block_hash, sb.block_id
+            FROM hist.schedule_block AS sb
+                INNER JOIN hist.release_block AS rb USING (block_id)
+            WHERE rb.release_id = %s;''', (previous,))
+        self.known_blocks = {x[0]: x[1] for x in iter(cur.fetchone, None)}
+
+        nrcif.CIFReader.prepare_sql_insert(self, "SB", "schedule_block", 5)
+        nrcif.CIFReader.prepare_sql_insert(self, "RB", "release_block", 2)
+
+        for i in ('AA', 'TI', 'TA', 'TD'):
+            self.bind_sql(i, self.release_id)
+
+    def prepare_sql_insert(self, rtype, tablename, number_params=None,
+                           omit=()):
+        '''Prepare an SQL insert statement as in CIFReader, with an extra
+        first column for the block or release that the row belongs to, which
+        is filled in by bind_sql. The archive is always stored in full, so
+        no columns can be omitted.'''
+
+        if omit:
+            raise ValueError("Columns cannot be left out of the archive")
+
+        if not number_params:
+            number_params = self.layouts[rtype].sql_width
+
+        super().prepare_sql_insert(rtype, tablename, number_params + 1)
+        self.templates[rtype] = self.sql[rtype].replace("(%s,", "({},", 1)
+
+    def bind_sql(self, rtype, value):
+        '''Set the block or release for the rows inserted for record type
+        rtype'''
+
+        self.sql[rtype] = self.templates[rtype].format(int(value))
+
+    def set_period(self, period_start, period_end):
+        '''Set the timetable period covered by the release, and record it in
+        the archive'''
+
+        self.period = nrcif.service_calendar.clip_period(period_start,
+                                                         period_end)
+        self.cur.execute("UPDATE hist.release SET period_start = %s, "
+                         "period_end = %s WHERE release_id = %s;",
+                         self.period + (self.release_id,))
+
+    def find_block(self, block_hash):
+        '''Return the id of the block with the given hash, or None if it is
+        not in the archive'''
+
+        block_id = self.known_blocks.get(block_hash)
+        if block_id is None:
+            self.cur.execute("SELECT block_id FROM hist.schedule_block "
+                             "WHERE block_hash = %s;", (block_hash,))
+            result = self.cur.fetchone()
+            if result is not None:
+                block_id = result[0]
+        return block_id
+
+    def store_block(self):
+        '''Add the current schedule block to the release, parsing it and
+        storing it in the archive if it has not been seen before'''
+
+        if not self.block:
+            return
+
+        text = "\n".join(x.rstrip() for x in self.block)
+        block_hash = hashlib.sha1(text.encode("ASCII")).hexdigest()
+        block_id = self.find_block(block_hash)
+
+        if block_id is None:
+            self.last_block_id += 1
+            block_id = self.last_block_id
+            for i in ('BS', 'LO', 'LI', 'CR', 'LT', 'LN'):
+                self.bind_sql(i, block_id)
+            for record in self.block:
+                super().process(record)
+            self.cur.execute(self.sql["SB"], [block_id, block_hash,
+                                              self.train_UID,
+                                              self.date_runs_from,
+                                              self.stp_indicator])
+            self.new_blocks += 1
+        else:
+            # The block has been checked already, so it is enough to move the
+            # state on to the last record of the block
+            self.state = self.block[-1][self.rslice]
+
+        self.known_blocks[block_hash] = block_id
+        if block_id not in self.release_blocks:
+            self.release_blocks.add(block_id)
+            self.cur.execute(self.sql["RB"], [self.release_id, block_id])
+        self.block = []
+
+    def process(self, record):
+        '''Gather the records of each schedule into a block, which is stored
+        when the next schedule or other record starts, and process any other
+        records as usual'''
+
+        rtype = record[self.rslice]
+        if rtype == "BS" or rtype not in self.block_types:
+            self.store_block()
+
+        if rtype in self.block_types:
+            self.block.append(record)
+        else:
+            super().process(record)
+
+
+def find_release(cur, release):
+    '''Return the id and timetable period of the named release'''
+
+    cur.execute("SELECT release_id, period_start, period_end "
+                "FROM hist.release WHERE release_name = %s;", (release,))
+    result = cur.fetchone()
+    if result is None:
+        raise ValueError("There is no release named {} in the archive"
+                         .format(release))
+    return result
+
+
+def load_day_bitmaps(cur, release_id, period_start, period_end):
+    '''Build the day bitmaps of the schedule blocks of a release for its
+    timetable period, and load them into the day_bitmap temporary table'''
+
+    cur.execute("DROP TABLE IF EXISTS pg_temp.day_bitmap;")
+    cur.execute("CREATE TEMPORARY TABLE day_bitmap (block_id INTEGER, "
+                "days_bitmap BIT VARYING);")
+    if period_start is None:
+        return
+
+    cur.execute('''SELECT DISTINCT ON (bs.block_id) bs.block_id,
+            bs.date_runs_from, bs.date_runs_to, bs.days_run,
+            bs.bank_holiday_running
+        FROM hist.basic_schedule AS bs
+            INNER JOIN hist.release_block AS rb USING (block_id)
+        WHERE rb.release_id = %s;''', (release_id,))
+
+    data = io.StringIO()
+    for block_id, runs_from, runs_to, days_run, bank_holiday in cur:
+        bitmap = nrcif.service_calendar.schedule_bitmap(
+            period_start, period_end, runs_from, runs_to, days_run,
+            bank_holiday)
+        data.write("{}\t{}\n".format(block_id,
+                                     nrcif.service_calendar.bitmap_to_sql(
+                                         bitmap, period_start, period_end)))
+    data.seek(0)
+    cur.copy_expert("COPY day_bitmap FROM STDIN", data)
+    cur.execute("ALTER TABLE day_bitmap ADD PRIMARY KEY (block_id);")
+
+
+def materialise_release(cur, release, schema="mca"):
+    '''Replace the main timetable in the schema, which must have the usual
+    layout rather than the stopping pattern layout, with the named release
+    from the archive. Returns the number of schedule blocks in the
+    release.'''
+
+    release_id, period_start, period_end = find_release(cur, release)
+    columns = nrcif.snapshot.table_columns("mca")
+
+    cur.execute("TRUNCATE {};".format(", ".join(
+        "{}.{}".format(schema, x)
+        for x in BLOCK_TABLES + RELEASE_TABLES + ("calendar_period",))))
+
+    if period_start is not None:
+        cur.execute("INSERT INTO {}.calendar_period VALUES(%s,%s);"
+                    .format(schema), (period_start, period_end))
+
+    load_day_bitmaps(cur, release_id, period_start, period_end)
+
+    for table in BLOCK_TABLES:
+        names = [x[0] for x in columns[table]]
+        select = ", ".join("db.days_bitmap" if x == "days_bitmap" else
+                           "t." + x for x in names)
+        cur.execute('''INSERT INTO {0}.{1} ({2})
+            SELECT {3}
+            FROM hist.{1} AS t
+                INNER JOIN hist.release_block AS rb USING (block_id)
+                LEFT JOIN day_bitmap AS db USING (block_id)
+            WHERE rb.release_id = %s;'''.format(schema, table,
+                                                ", ".join(names), select),
+                    (release_id,))
+
+    for table in RELEASE_TABLES:
+        names = ", ".join(x[0] for x in columns[table])
+        cur.execute('''INSERT INTO {0}.{1} ({2})
+            SELECT {2} FROM hist.{1} WHERE release_id = %s;'''
+                    .format(schema, table, names), (release_id,))
+
+    cur.execute("SELECT count(*) FROM hist.release_block "
+                "WHERE release_id = %s;", (release_id,))
+    return cur.fetchone()[0]
@@ -0,0 +1,160 @@
+# mapping.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''mapping - Map backgrounds for plotting isochrons
+
+Creating a high resolution Basemap reads the coastline and boundary data and
+projects it, which takes much longer than plotting an isochron on it. The
+get_basemap function keeps each Basemap it creates on disk as a pickle, keyed
+by the parameters it was created with, so later runs only need to load it
+with the coastlines already projected. Within a process the same Basemap is
+returned every time it is asked for.
+
+The isochrons themselves are drawn in two stages, so that each can be timed:
+triangulate projects the station positions and triangulates them, and
+draw_isochron draws the contours on a new figure with the map background.'''
+
+import hashlib
+import os
+import pickle
+
+import numpy as np
+import matplotlib.pyplot as plt
+import matplotlib.tri
+from mpl_toolkits.basemap import Basemap
+
+# The map of Great Britain and Ireland used for isochrons
+UK_MAP = dict(llcrnrlon=-10.5, llcrnrlat=49.5, urcrnrlon=3.5, urcrnrlat=59.5,
+              resolution='h', projection='tmerc', lon_0=-4.36, lat_0=54.7)
+
+# The stations labelled on isochron maps, along with the origin station
+LABEL_CITIES = frozenset(('CAMBDGE', 'EDINBUR', 'KNGX   ',
+                          'EXETERC', 'CRDFCEN', 'BHAMNWS',
+                          'MNCRPIC', 'SOTON  ', 'ABRDEEN',
+                          'DRHM   ', 'BANGOR ', 'OBAN   ',
+                          'BLFSTCL', 'DUBLINC', 'PENZNCE',
+                          'LOWSTFT', 'CATZTUS', 'CARLILE',
+                          'SCRBSTR', 'NEWQUAY', 'DOVERP '))
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "nrcif")
+
+# The Basemaps already created or loaded by this process
+_basemaps = dict()
+
+
+def basemap_key(params):
+    '''Return a string identifying a Basemap created with the given
+    parameters'''
+
+    text = repr(sorted(params.items()))
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def get_basemap(cache_dir=DEFAULT_CACHE_DIR, **params):
+    '''Return a Basemap created with the given parameters (by default those
+    of UK_MAP), loading it from cache_dir if it has been created before.
+    If cache_dir is None the Basemap is not stored on disk.'''
+
+    params = params or UK_MAP
+    key = basemap_key(params)
+    if key in _basemaps:
+        return _basemaps[key]
+
+    filename = None
+    m = None
+    if cache_dir is not None:
+        filename = os.path.join(cache_dir, "basemap_{}.pickle".format(key))
+        try:
+            with open(filename, "rb") as f:
+                m = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError):
+            # The pickle is missing or was made by another version of Basemap
+            m = None
+
+    if m is None:
+        m = Basemap(**params)
+        if filename is not None:
+            # The pickle is written under a temporary name and then renamed,
+            # so that other processes never see a partly written file
+            temp = "{}.{}".format(filename, os.getpid())
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                with open(temp, "wb") as f:
+                    pickle.dump(m, f, pickle.HIGHEST_PROTOCOL)
+                os.replace(temp, filename)
+            except OSError as err:
+                print("Could not cache the map in {}: {}"
+                      .format(cache_dir, err))
+
+    _basemaps[key] = m
+    return m
+
+
+def draw_background(m, ax=None):
+    '''Draw the coastlines, boundaries and graticule of a map'''
+
+    m.drawmapboundary(fill_color='white', ax=ax)
+    m.drawcoastlines(ax=ax)
+    m.drawcountries(ax=ax)
+
+    m.drawparallels(np.arange(-40., 61., 2.), ax=ax)
+    m.drawmeridians(np.arange(-20., 21., 2.), ax=ax)
+
+
+def label_cities(location, lat, lon, origin=None):
+    '''Return a dict giving the (longitude, latitude) of each of the
+    locations of an isochron that is in LABEL_CITIES or is the origin'''
+
+    labels = list(LABEL_CITIES) + ([origin] if origin else [])
+    return {location[i]: (lon[i], lat[i])
+            for i in np.flatnonzero(np.isin(location, labels))}
+
+
+def triangulate(m, lat, lon):
+    '''Project the positions of the locations of an isochron onto a map and
+    return a Triangulation of them'''
+
+    x, y = m(np.asarray(lon), np.asarray(lat))
+    return matplotlib.tri.Triangulation(x, y)
+
+
+def draw_isochron(m, triangulation, delay, cities=None, title=None):
+    '''Draw the contours of an isochron on a new figure with the map
+    background, labelling the cities given as a dict of (longitude,
+    latitude) keyed by name. Returns the figure.'''
+
+    fig = plt.figure()
+    ax = fig.add_subplot(1, 1, 1)
+    draw_background(m, ax)
+
+    contours = ax.tricontourf(triangulation, np.asarray(delay))
+
+    m.colorbar(contours, fig=fig, ax=ax)
+    m.drawmapboundary(fill_color=None, ax=ax)
+
+    for name, (lon, lat) in (cities or dict()).items():
+        x, y = m(lon, lat)
+        m.plot(x, y, 'kx', ax=ax)
+        ax.text(x-8000, y+3500, name, size='small', color='k')
+
+    if title:
+        ax.set_title(title)
+    return fig
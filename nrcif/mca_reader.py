@@ -23,11 +23,25 @@
 This module reads data from an MCA file from ATOC containing timetable
 information for UK rail journeys and inserts it into a database. The module
 has to be provided with a databae cursor initially, and then fed with
-lines/records one at a time.'''
+lines/records one at a time.
+
+The locations can optionally be stored in a normalised layout, where each
+distinct sequence of locations visited is stored once as a stopping pattern,
+and each schedule refers to its stopping pattern and gives the times and other
+details for the locations in arrays. This layout has to be selected when the
+schema is generated as well as when the file is read.
+
+A nrcif.projection.Projection can be given to leave out the optional record
+types and fields that are not needed, which must also have been used when the
+schema was generated.'''
 
 import nrcif
 import nrcif.records
 import nrcif.mockdb
+import nrcif.service_calendar
+
+from nrcif.fields import time_to_minutes, time_to_half_minutes
+from nrcif.fields import array_literal
 
 
 class MCA(nrcif.CIFReader):
@@ -62,17 +76,54 @@ class MCA(nrcif.CIFReader):
 
     schema = "mca"
 
-    def __init__(self, cur):
+    # Whether the bitmap of the days in the timetable period on which each
+    # schedule runs is stored
+    day_bitmaps = True
+
+    # The record types that a projection can leave out. BX is needed for the
+    # operator of each train.
+    optional_records = frozenset(("TI", "TA", "TD", "AA", "TN", "CR", "LN"))
+
+    # The fields used to identify schedules and locations, find the period
+    # and work out the times, and those read by the functions in the sql
+    # directory and the GTFS export
+    key_fields = {"HD": ("user_extract_start_date", "user_extract_end_date"),
+                  "BS": ("train_uid", "date_runs_from", "date_runs_to",
+                         "days_run", "bank_holiday_running",
+                         "stp_indicator"),
+                  "BX": ("atoc_code",),
+                  "LO": ("location", "location_suffix",
+                         "scheduled_departure", "platform"),
+                  "LI": ("location", "location_suffix", "scheduled_arrival",
+                         "scheduled_departure", "scheduled_pass",
+                         "platform"),
+                  "LT": ("location", "location_suffix", "scheduled_arrival",
+                         "platform"),
+                  "TI": ("tiploc_code",),
+                  "TA": ("tiploc_code",),
+                  "TD": ("tiploc_code",)}
+
+    def __init__(self, cur, stopping_patterns=False, projection=None):
         '''Requires a DB API cursor to the database that will contain the
-        data'''
+        data. If stopping_patterns is set the locations are stored in the
+        normalised stopping pattern layout. If a projection is given only the
+        records and fields it selects are loaded.'''
 
         super().__init__(cur)
+        self.layouts, self.skip_records = self.project_layouts(
+            projection, stopping_patterns)
         self.train_UID = None
         self.date_runs_from = None
         self.stp_indicator = None
         self.LOC_order = 0
         self.xmidnight = None
-        self.last_time = None
+        self.day_offset = 0
+        self.last_hm = None
+        self.period = None
+        self.days_bitmap = None
+        self.stopping_patterns = stopping_patterns
+        self.patterns = dict()
+        self.stops = []
 
         # for typing convenience
         layouts = self.layouts
@@ -83,36 +134,86 @@ class MCA(nrcif.CIFReader):
         for i in layouts.keys():
             self.context[i] = [None] * layouts[i].sql_width
 
-        # Prepare SQL insert statements
-        bs_width = layouts['BS'].sql_width + \
-            layouts['BX'].sql_width + \
-            layouts['TN'].sql_width
-        self.prepare_sql_insert("BS", "basic_schedule", bs_width)
+        # Prepare SQL insert statements. The basic schedule has an extra
+        # column for the bitmap of days run.
+        bs_width = 0
+        bs_omit = []
+        for i in ('BS', 'BX', 'TN'):
+            bs_omit.extend(bs_width + x for x in layouts[i].omitted)
+            bs_width += layouts[i].sql_width
+        self.prepare_sql_insert("BS", "basic_schedule", bs_width + 1,
+                                bs_omit)
+
+        # The LO, LI and LT tables have extra columns at the end giving the
+        # arrival, departure and passing times in minutes after the midnight
+        # at the start of the day the train starts its journey. In the
+        # normalised layout the LO, LI and LT records are instead gathered
+        # into a single row per schedule.
+        if stopping_patterns:
+            route_types = ('CR', 'LN')
+            self.prepare_sql_insert("SP", "stopping_pattern", 3)
+            self.prepare_sql_insert("SL", "schedule_location", 16)
+        else:
+            route_types = ('LO', 'LI', 'CR', 'LT', 'LN')
 
-        for i in ('LO', 'LI', 'CR', 'LT', 'LN'):
+        for i in route_types:
+            if i in self.skip_records:
+                continue
             width = 5 + layouts[i].sql_width
+            if i in ('LO', 'LI', 'LT'):
+                width += 3
             tablename = layouts[i].name.lower().replace(" ", "_")
-            self.prepare_sql_insert(i, tablename, width)
+            self.prepare_sql_insert(i, tablename, width,
+                                    [5 + x for x in layouts[i].omitted])
 
         for i in ('AA', 'TI', 'TA', 'TD'):
+            if i in self.skip_records:
+                continue
             tablename = layouts[i].name.lower().replace(" ", "_")
-            self.prepare_sql_insert(i, tablename)
+            self.prepare_sql_insert(i, tablename, omit=layouts[i].omitted)
+
+    @classmethod
+    def project_layouts(cls, projection, stopping_patterns=False):
+        '''Return the layouts with a projection applied and the set of record
+        types that it leaves out. The LO, LI and LT records are stored in a
+        fixed layout in the stopping pattern layout, so none of their fields
+        can be left out.'''
+
+        layouts, skipped = super().project_layouts(projection)
+        if stopping_patterns and any(layouts[i].omitted
+                                     for i in ('LO', 'LI', 'LT')):
+            raise ValueError("Fields of LO, LI and LT records cannot be left "
+                             "out in the stopping pattern layout")
+        return layouts, skipped
+
+    def set_period(self, period_start, period_end):
+        '''Set the timetable period covered by the day bitmaps of the
+        schedules, and record it in the database'''
+
+        self.period = nrcif.service_calendar.clip_period(period_start,
+                                                         period_end)
+        self.cur.execute("INSERT INTO {}.calendar_period VALUES(%s,%s);"
+                         .format(self.schema), self.period)
+
+    def process_HD(self):
+        '''Process HD (Header) records'''
+        self.set_period(self.context["HD"][7], self.context["HD"][8])
 
     def process_TI(self):
         '''Process TI (TIPLOC Insert) records'''
-        self.cur.execute(self.sql["TI"], self.context["TI"])
+        self.insert("TI", self.context["TI"])
 
     def process_TA(self):
         '''Process TA (TIPLOC Amend) records'''
-        self.cur.execute(self.sql["TA"], self.context["TA"])
+        self.insert("TA", self.context["TA"])
 
     def process_TD(self):
         '''Process TD (TIPLOC Delete) records'''
-        self.cur.execute(self.sql["TD"], self.context["TD"])
+        self.insert("TD", self.context["TD"])
 
     def process_AA(self):
         '''Process AA (Associations) records'''
-        self.cur.execute(self.sql["AA"], self.context["AA"])
+        self.insert("AA", self.context["AA"])
 
     def process_BS(self):
         '''Process BS (Basic Schedule) records'''
@@ -124,14 +225,96 @@ class MCA(nrcif.CIFReader):
         self.date_runs_from = self.context["BS"][2]
         self.stp_indicator = self.context["BS"][21]
 
+        if self.period and self.day_bitmaps:
+            bitmap = nrcif.service_calendar.schedule_bitmap(
+                self.period[0], self.period[1],
+                self.context["BS"][2], self.context["BS"][3],
+                self.context["BS"][4], self.context["BS"][5])
+            self.days_bitmap = nrcif.service_calendar.bitmap_to_sql(
+                bitmap, self.period[0], self.period[1])
+        else:
+            self.days_bitmap = None
+
         # If the BS record is a short-term cancellation of a permanent
         # service there will be no further details or any locations
         # given, so the record may just as well be posted immediately.
         if self.stp_indicator == "C":
-            self.cur.execute(self.sql["BS"],
-                             self.context["BS"] +
-                             self.context["BX"] +
-                             self.context["TN"])
+            self.insert("BS", self.context["BS"] +
+                        self.context["BX"] +
+                        self.context["TN"] +
+                        [self.days_bitmap])
+
+    def half_minutes(self, arrival, departure, passing):
+        '''Convert the arrival, departure and passing times of the current
+        location into half-minutes after the midnight at the start of the
+        train's journey. Each time is taken in turn, and a day is added
+        whenever a time is earlier than the time before it in the schedule,
+        so the times never decrease even when midnight falls between the
+        arrival and departure at a stop. xmidnight is set if the first time
+        given for the location is after midnight.'''
+
+        result = []
+        for value in (arrival, departure, passing):
+            hm = time_to_half_minutes(value)
+            if hm is not None:
+                hm += self.day_offset
+                if self.last_hm is not None and hm < self.last_hm:
+                    self.day_offset += 2880
+                    hm += 2880
+                self.last_hm = hm
+            result.append(hm)
+
+        first = next(x for x in result if x is not None)
+        self.xmidnight = first >= 2880
+        return result
+
+    @staticmethod
+    def minutes(half_minutes):
+        '''Convert the arrival, departure and passing times of a location in
+        half-minutes into minutes. Arrival times are rounded up and the others
+        are rounded down to the nearest minute.'''
+
+        arrival, departure, passing = half_minutes
+        return [(arrival + 1) // 2 if arrival is not None else None,
+                departure // 2 if departure is not None else None,
+                passing // 2 if passing is not None else None]
+
+    def add_stop(self, location, location_suffix, arrival_hm, departure_hm,
+                 pass_hm, public_arrival, public_departure, platform, line,
+                 path, activity, engineering_allowance=None,
+                 pathing_allowance=None, performance_allowance=None):
+        '''Add a location to the stopping pattern of the current schedule,
+        with the scheduled times given in half-minutes'''
+
+        self.stops.append((location, location_suffix,
+                           arrival_hm, departure_hm, pass_hm,
+                           time_to_minutes(public_arrival),
+                           time_to_minutes(public_departure),
+                           platform, line, path, "".join(activity),
+                           engineering_allowance, pathing_allowance,
+                           performance_allowance))
+
+    def store_stops(self):
+        '''Store the locations of the current schedule, adding its stopping
+        pattern if it has not been seen before'''
+
+        columns = list(zip(*self.stops))
+        pattern = (columns[0], columns[1])
+
+        pattern_id = self.patterns.get(pattern)
+        if pattern_id is None:
+            pattern_id = len(self.patterns) + 1
+            self.patterns[pattern] = pattern_id
+            self.cur.execute(self.sql["SP"], [pattern_id,
+                                              array_literal(columns[0]),
+                                              array_literal(columns[1])])
+
+        self.cur.execute(self.sql["SL"], [self.train_UID,
+                                          self.date_runs_from,
+                                          self.stp_indicator,
+                                          pattern_id] +
+                         [array_literal(x) for x in columns[2:]])
+        self.stops = []
 
     def process_LO(self):
         '''Process LO (Origin Location) records'''
@@ -139,68 +322,89 @@ class MCA(nrcif.CIFReader):
         # Note - the LO state can only be reached from BS, so there
         # must have been a valid BS record before this point. However
         # the BX and TN  context may be null.
-        self.cur.execute(self.sql["BS"],
-                         self.context["BS"] +
-                         self.context["BX"] +
-                         self.context["TN"])
+        self.insert("BS", self.context["BS"] +
+                    self.context["BX"] +
+                    self.context["TN"] +
+                    [self.days_bitmap])
         self.LOC_order = 0
-        self.xmidnight = False
-        self.last_time = self.context["LO"][1]
-        self.cur.execute(self.sql["LO"], [self.train_UID,
-                                          self.date_runs_from,
-                                          self.stp_indicator,
-                                          self.LOC_order,
-                                          False] + self.context["LO"])
+        self.day_offset = 0
+        self.last_hm = None
+        times = self.half_minutes(None, self.context["LO"][2], None)
+
+        if self.stopping_patterns:
+            LO = self.context["LO"]
+            self.stops = []
+            self.add_stop(LO[0], LO[1], *times, None, LO[3],
+                          LO[4], LO[5], None, LO[8], LO[6], LO[7], LO[9])
+            return
+
+        self.insert("LO", [self.train_UID,
+                           self.date_runs_from,
+                           self.stp_indicator,
+                           self.LOC_order,
+                           self.xmidnight] + self.context["LO"] +
+                    self.minutes(times))
 
     def process_LI(self):
         '''Process LI (Intermediate Location) records'''
 
         self.LOC_order += 1
-        current_time = (self.context["LI"][1] or
-                        self.context["LI"][2] or
-                        self.context["LI"][3])
-        if not self.xmidnight and current_time < self.last_time:
-            self.xmidnight = True
-        else:
-            self.last_time = current_time
-
-        self.cur.execute(self.sql["LI"], [self.train_UID,
-                                          self.date_runs_from,
-                                          self.stp_indicator,
-                                          self.LOC_order,
-                                          self.xmidnight] + self.context["LI"])
+        times = self.half_minutes(self.context["LI"][2],
+                                  self.context["LI"][3],
+                                  self.context["LI"][4])
+
+        if self.stopping_patterns:
+            LI = self.context["LI"]
+            self.add_stop(LI[0], LI[1], *times, LI[5], LI[6],
+                          LI[7], LI[8], LI[9], LI[10], LI[11], LI[12], LI[13])
+            return
+
+        minutes = self.minutes(times)
+        self.insert("LI", [self.train_UID,
+                           self.date_runs_from,
+                           self.stp_indicator,
+                           self.LOC_order,
+                           self.xmidnight] +
+                    self.context["LI"] + minutes)
 
     def process_CR(self):
         '''Process CR (Changes-en-route) records'''
 
-        self.cur.execute(self.sql["CR"], [self.train_UID,
-                                          self.date_runs_from,
-                                          self.stp_indicator,
-                                          self.LOC_order,
-                                          self.xmidnight] + self.context["CR"])
+        self.insert("CR", [self.train_UID,
+                           self.date_runs_from,
+                           self.stp_indicator,
+                           self.LOC_order,
+                           self.xmidnight] + self.context["CR"])
 
     def process_LT(self):
         '''Process LT (Terminating Location) records'''
 
         self.LOC_order += 1
-        if not self.xmidnight and self.context["LT"][1] < self.last_time:
-            self.xmidnight = True
-        else:
-            self.last_time = self.context["LT"][1]
-        self.cur.execute(self.sql["LT"], [self.train_UID,
-                                          self.date_runs_from,
-                                          self.stp_indicator,
-                                          self.LOC_order,
-                                          self.xmidnight] + self.context["LT"])
+        times = self.half_minutes(self.context["LT"][2], None, None)
+
+        if self.stopping_patterns:
+            LT = self.context["LT"]
+            self.add_stop(LT[0], LT[1], *times, LT[3], None,
+                          LT[4], None, LT[5], LT[6])
+            self.store_stops()
+            return
+
+        minutes = self.minutes(times)
+        self.insert("LT", [self.train_UID,
+                           self.date_runs_from,
+                           self.stp_indicator,
+                           self.LOC_order,
+                           self.xmidnight] +
+                    self.context["LT"] + minutes)
 
     def process_LN(self):
         '''Process LN (Location Notes) records'''
 
-        self.cur.execute(self.sql["LN"], [self.train_UID,
-                                          self.date_runs_from,
-                                          self.stp_indicator,
-                                          self.LOC_order,
-                                          self.xmidnight] + self.context["LN"])
+        self.insert("LN", [self.train_UID,
+                           self.date_runs_from,
+                           self.stp_indicator,
+                           self.LOC_order,
+                           self.xmidnight] + self.context["LN"])
 
 if __name__ == "__main__":
     nrcif.mockdb.demonstrate_reader(MCA)
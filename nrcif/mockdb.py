@@ -42,6 +42,17 @@ class Cursor(object):
         self.log_file.write("Executed SQL: '{}' with params '{}'\n"
                             .format(sql, repr(params)))
 
+    def callproc(self, procname, params=None):
+        '''Log a request to call a stored procedure with given parameters'''
+
+        self.log_file.write("Called procedure: '{}' with params '{}'\n"
+                            .format(procname, repr(params)))
+
+    def fetchone(self):
+        '''The dummy cursor never has any results to return'''
+
+        return None
+
     def copy_from(self, file, table, sep='\t',
                   null='\\N', size=8192, columns=None):
         '''Log a request to execute a COPY command to upload bulk data. This
@@ -23,11 +23,16 @@
 This module reads data from an MSN file from ATOC containing station details
 for UK rail stations and inserts it into a database. The module has to be
 provided with a database cursor initially, and then fed with lines/records one
-at a time. '''
+at a time.
+
+The station details are held back until the end of the file, so that the
+latitudes and longitudes of all the stations can be calculated from their
+National Grid co-ordinates in one go.'''
 
 import nrcif
 import nrcif.msn_records
 import nrcif.mockdb
+import nrcif.natgrid
 
 
 class MSN(nrcif.CIFReader):
@@ -70,21 +75,43 @@ class MSN(nrcif.CIFReader):
 
         # Note that the MSN class does not keep any state, because if
         # you only consider the records that are not marked 'historic'
-        # then there is no order-dependence!
+        # then there is no order-dependence! The station details are
+        # buffered until the end of the file.
+        self.stations = []
 
         # The following ensures all context is valid for insertion into
         # the database, even if it is just a row of NULL/None
         for i in self.layouts.keys():
             self.context[i] = [None] * self.layouts[i].sql_width
 
-        # Prepare SQL insert statements
+        # Prepare SQL insert statements. The station details have extra
+        # columns for the latitude and longitude.
         for i in ("A", "L", "V"):
             tablename = self.layouts[i].name.lower().replace(" ", "_")
-            self.prepare_sql_insert(i, tablename)
+            if i == "A":
+                self.prepare_sql_insert(i, tablename,
+                                        self.layouts[i].sql_width + 2)
+            else:
+                self.prepare_sql_insert(i, tablename)
 
     def process_A(self):
         '''Process station details (A) record'''
-        self.cur.execute(self.sql["A"], self.context["A"])
+        self.stations.append(self.context["A"])
+
+    def process_E(self):
+        '''Process the final trailer (E) record by inserting the buffered
+        station details with their latitudes and longitudes'''
+
+        # The MSN file gives the co-ordinates in units of 100m, offset so
+        # that they are all positive
+        eastings = [x[5] * 100 - 1000000 for x in self.stations]
+        northings = [x[7] * 100 - 6000000 for x in self.stations]
+        lat, lon = nrcif.natgrid.en_to_latlon_list(eastings, northings)
+
+        for station, station_lat, station_lon in zip(self.stations, lat, lon):
+            self.cur.execute(self.sql["A"],
+                             station + [station_lat, station_lon])
+        self.stations = []
 
     def process_L(self):
         '''Process station alias (L) record'''
@@ -0,0 +1,115 @@
+# natgrid.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''natgrid - Convert National Grid co-ordinates to latitude and longitude
+
+This module uses the conversion formulae recommended by the Ordnance Survey
+for the UK National Grid (i.e. using the 1830 Airy ellipsoid), exactly as in
+the util.natgrid_en_to_latlon SQL function. The results are not suitable for
+comparison with GRS80 (i.e. the WGS84 or GPS ellipsoid) co-ordinates. The
+conversion works on whole arrays of co-ordinates at once so that all the
+stations can be converted while they are being loaded.'''
+
+import numpy as np
+
+a = 6377563.396
+b = 6356256.910
+ee = (a**2 - b**2) / a**2
+F0 = 0.9996012717
+phi0 = np.radians(49.0)
+lambda0 = -np.radians(2.0)
+E0 = 400000.0
+N0 = -100000.0
+
+n = (a - b) / (a + b)
+n1 = b * F0 * (1.0 + n + 5.0/4.0 * n**2 + 5.0/4.0 * n**3)
+n2 = b * F0 * (3.0 * n + 3.0 * n**2 + 21.0/8.0 * n**3)
+n3 = b * F0 * (15.0/8.0 * n**2 + 15.0/8.0 * n**3)
+n4 = b * F0 * (35.0/24.0 * n**3)
+
+
+def meridional_arc(phi):
+    '''Return the developed meridional arc from the true origin to the
+    latitudes phi (in radians)'''
+
+    return ((phi - phi0) * n1 -
+            np.sin(phi - phi0) * np.cos(phi + phi0) * n2 +
+            np.sin(2.0 * (phi - phi0)) * np.cos(2.0 * (phi + phi0)) * n3 -
+            np.sin(3.0 * (phi - phi0)) * np.cos(3.0 * (phi + phi0)) * n4)
+
+
+def en_to_latlon(E, N):
+    '''Convert sequences of eastings and northings in metres to arrays of
+    latitudes and longitudes in degrees'''
+
+    E = np.asarray(E, dtype=np.float64)
+    N = np.asarray(N, dtype=np.float64)
+
+    phi_prime = phi0 + (N - N0) / (a * F0)
+    M = meridional_arc(phi_prime)
+    while np.any(np.abs(N - N0 - M) >= 0.00001):
+        phi_prime = phi_prime + (N - N0 - M) / (a * F0)
+        M = meridional_arc(phi_prime)
+
+    cpp = np.cos(phi_prime)
+    s2pp = np.sin(phi_prime)**2
+    tpp = np.tan(phi_prime)
+    t2pp = tpp**2
+    t4pp = tpp**4
+    t6pp = tpp**6
+
+    nu = a * F0 * (1.0 - ee * s2pp)**-0.5
+    rho = a * F0 * (1.0 - ee) * (1.0 - ee * s2pp)**-1.5
+    eta2 = nu / rho - 1.0
+
+    VII = tpp / (2.0 * rho * nu)
+    VIII = tpp / (24.0 * rho * nu**3) * (5.0 + 3.0 * t2pp + eta2 -
+                                         9.0 * eta2 * t2pp)
+    IX = tpp / (720.0 * rho * nu**5) * (61.0 + 90.0 * t2pp + 45.0 * t4pp)
+    X = 1.0 / (nu * cpp)
+    XI = 1.0 / (6.0 * nu**3 * cpp) * (nu / rho + 2.0 * t2pp)
+    XII = 1.0 / (120.0 * nu**5 * cpp) * (5.0 + 28.0 * t2pp + 24.0 * t4pp)
+    XIIA = 1.0 / (5040.0 * nu**7 * cpp) * (61.0 + 662.0 * t2pp +
+                                           1320.0 * t4pp + 720.0 * t6pp)
+
+    dE = E - E0
+    phi = phi_prime - VII * dE**2 + VIII * dE**4 - IX * dE**6
+    lam = lambda0 + X * dE - XI * dE**3 + XII * dE**5 - XIIA * dE**7
+
+    return np.degrees(phi), np.degrees(lam)
+
+
+def en_to_latlon_list(E, N):
+    '''Convert sequences of eastings and northings in metres to lists of
+    latitudes and longitudes, giving None for any co-ordinates that are not
+    positive as these represent unknown locations'''
+
+    E = np.asarray(E, dtype=np.float64)
+    N = np.asarray(N, dtype=np.float64)
+    valid = (E > 0) & (N > 0)
+
+    lat = [None] * len(E)
+    lon = [None] * len(E)
+    if np.any(valid):
+        valid_lat, valid_lon = en_to_latlon(E[valid], N[valid])
+        for i, la, lo in zip(np.flatnonzero(valid), valid_lat, valid_lon):
+            lat[i] = float(la)
+            lon[i] = float(lo)
+    return lat, lon
@@ -0,0 +1,128 @@
+# postload.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''postload - Refresh derived data after new data has been loaded
+
+Some of the routines in the sql directory work from tables that are derived
+from the raw data, rather than from the raw data itself. This module calls the
+routines that refresh them. As these routines are installed separately by
+create_functions.py, any that have not been installed are skipped.'''
+
+
+def routine_installed(cur, routine):
+    '''Check whether the named routine has been installed in the database'''
+
+    cur.execute("SELECT to_regproc(%s);", (routine,))
+    result = cur.fetchone()
+    return result is not None and result[0] is not None
+
+
+def call_routine(cur, routine, params=()):
+    '''Call the named routine if it has been installed, returning True if it
+    was called.'''
+
+    if not routine_installed(cur, routine):
+        print("Skipping {} as it has not been installed".format(routine))
+        return False
+
+    print("Running {}".format(routine), flush=True)
+    cur.callproc(routine, params)
+    return True
+
+
+def refresh_effective_schedules(cur, schemas):
+    '''Rebuild the effective schedules for the timetable schemas that have
+    been loaded'''
+
+    for schema in ("mca", "ztr"):
+        if schema in schemas:
+            call_routine(cur, schema + ".refresh_effective_schedule")
+
+
+def refresh_interchange(cur, schemas):
+    '''Rebuild the interchange times if the station or TOC specific
+    interchange data has been loaded'''
+
+    if "msn" in schemas or "tsi" in schemas:
+        call_routine(cur, "msn.refresh_interchange")
+
+
+def refresh_station_names(cur, schemas):
+    '''Rebuild the station name index if the station data has been loaded
+    from the MSN or NaPTAN data'''
+
+    if "msn" in schemas or "naptan" in schemas:
+        call_routine(cur, "msn.refresh_station_names")
+
+
+def refresh_station_locations(cur, schemas):
+    '''Rebuild the spatial index of station positions if the station data
+    has been loaded from the MSN or NaPTAN data'''
+
+    if "msn" in schemas or "naptan" in schemas:
+        call_routine(cur, "msn.refresh_station_locations")
+
+
+def refresh_links(cur, schemas):
+    '''Rebuild the fixed links between TIPLOCs if the fixed link or station
+    data has been loaded'''
+
+    if "alf" in schemas or "msn" in schemas:
+        call_routine(cur, "alf.refresh_links")
+
+
+def drop_connections(cur, schemas):
+    '''Drop the stored connections for every date if the timetable, station
+    or fixed link data has been loaded, as util.ensure_connections would
+    otherwise keep using the connections built from the old data'''
+
+    if any(x in schemas for x in ("mca", "ztr", "msn", "alf")):
+        call_routine(cur, "util.drop_connections", (None,))
+
+
+def refresh_connections(cur, start_date, horizon):
+    '''Rebuild the stored connections for horizon days from start_date'''
+
+    if horizon > 0:
+        call_routine(cur, "util.refresh_connections", (start_date, horizon))
+
+
+def invalidate_isochron_cache(cur):
+    '''Advance the load generation so that any cached isochrons computed
+    from the old data are discarded'''
+
+    call_routine(cur, "util.invalidate_isochron_cache")
+
+
+def refresh_all(cur, schemas, connections_start, connections_horizon):
+    '''Rebuild all of the derived data that depends on the schemas that have
+    been loaded, and the stored connections for connections_horizon days
+    from connections_start. The connections stored for any other dates are
+    dropped, to be rebuilt by util.ensure_connections when needed.'''
+
+    refresh_effective_schedules(cur, schemas)
+    refresh_interchange(cur, schemas)
+    refresh_links(cur, schemas)
+    refresh_station_names(cur, schemas)
+    refresh_station_locations(cur, schemas)
+    drop_connections(cur, schemas)
+    refresh_connections(cur, connections_start, connections_horizon)
+    if schemas:
+        invalidate_isochron_cache(cur)
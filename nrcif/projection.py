@@ -0,0 +1,144 @@
+# projection.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''projection - Choose the records and fields of a CIF file to be loaded
+
+Many uses of the timetable data need only the schedules with their locations
+and times, so the readers can be given a Projection that leaves out whole
+record types, or individual fields of a record type. Records that are left
+out are never decoded or stored, and fields that are left out are never
+decoded, are read as None and are not stored. The schema has to be generated
+with the same projection.
+
+Record types are given by their two-letter codes, such as CR, and fields by
+the record type and the SQL column name, such as BS.headcode. Only the record
+types listed in the optional_records attribute of a reader can be left out,
+and the fields listed in its key_fields attribute are always loaded.'''
+
+
+def name_list(text):
+    '''Split a comma-separated list given as a command line argument'''
+
+    return [x.strip() for x in text.split(",") if x.strip()]
+
+
+class Projection(object):
+    '''A choice of the record types and fields of a CIF file to be loaded.
+    If include_records is given, only the optional record types in it are
+    loaded. If include_fields names any fields of a record type, only those
+    fields of the record type are loaded.'''
+
+    def __init__(self, include_records=None, exclude_records=(),
+                 include_fields=(), exclude_fields=()):
+
+        if include_records is None:
+            self.include_records = None
+        else:
+            self.include_records = frozenset(include_records)
+        self.exclude_records = frozenset(exclude_records)
+        self.include_fields = self._by_record(include_fields)
+        self.exclude_fields = self._by_record(exclude_fields)
+
+    @staticmethod
+    def _by_record(fields):
+        '''Gather fields given as RT.column_name into a dict of sets of column
+        names keyed on the record type'''
+
+        result = dict()
+        for field in fields:
+            rtype, sep, name = field.partition(".")
+            if not sep or not name:
+                raise ValueError("'{}' is not a field in the form "
+                                 "RT.column_name".format(field))
+            result.setdefault(rtype, set()).add(name.lower())
+        return result
+
+    def as_dict(self):
+        '''Return the projection as a dict of lists'''
+
+        def fields(by_record):
+            return sorted("{}.{}".format(rtype, name)
+                          for rtype, names in by_record.items()
+                          for name in names)
+
+        return {"include_records": (None if self.include_records is None
+                                    else sorted(self.include_records)),
+                "exclude_records": sorted(self.exclude_records),
+                "include_fields": fields(self.include_fields),
+                "exclude_fields": fields(self.exclude_fields)}
+
+    def apply(self, layouts, optional_records=frozenset(), key_fields=None):
+        '''Return a copy of the layouts dict with the fields that are left out
+        replaced by ExcludedField, and the set of record types that are left
+        out. An optional record type with all of its fields left out is left
+        out altogether. Raises ValueError if the projection names unknown
+        record types or fields, or would leave out records or fields that
+        are needed.'''
+
+        key_fields = key_fields or dict()
+
+        named = (set(self.include_records or ()) | self.exclude_records |
+                 set(self.include_fields) | set(self.exclude_fields))
+        unknown = named - set(layouts)
+        if unknown:
+            raise ValueError("Unknown record types: {}"
+                             .format(", ".join(sorted(unknown))))
+
+        needed = self.exclude_records - optional_records
+        if needed:
+            raise ValueError("Record types that cannot be left out: {}"
+                             .format(", ".join(sorted(needed))))
+
+        skipped = set(self.exclude_records)
+        if self.include_records is not None:
+            skipped |= optional_records - self.include_records
+
+        result = dict(layouts)
+        for rtype, layout in layouts.items():
+            columns = set(layout.column_names())
+            keys = set(key_fields.get(rtype, ()))
+            include = self.include_fields.get(rtype)
+            exclude = self.exclude_fields.get(rtype, set())
+
+            unknown = (exclude | (include or set())) - columns
+            if unknown:
+                raise ValueError("Unknown fields of {} records: {}"
+                                 .format(rtype, ", ".join(sorted(unknown))))
+
+            if rtype in skipped:
+                excluded = columns
+            else:
+                needed = exclude & keys
+                if needed:
+                    raise ValueError("Fields of {} records that cannot be "
+                                     "left out: {}"
+                                     .format(rtype, ", ".join(sorted(needed))))
+                excluded = set(exclude)
+                if include is not None:
+                    excluded |= columns - include - keys
+                if excluded and excluded == columns and \
+                        rtype in optional_records:
+                    skipped.add(rtype)
+
+            if excluded:
+                result[rtype] = layout.project(excluded)
+
+        return result, frozenset(skipped)
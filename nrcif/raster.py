@@ -0,0 +1,322 @@
+# raster.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''raster - Isochrons as grids of journey times
+
+A raster is a grid of square cells over the National Grid giving the journey
+time in minutes to each cell, found by linear interpolation between the
+journey times to the stations at the corners of the triangle containing the
+cell. The Rasteriser class triangulates the stations of a timetable and finds
+the triangle and weights of each cell once, so turning an isochron into a
+raster only needs a few NumPy operations. As every raster uses the same grid,
+rasters for different timetables or departure times can be compared or
+averaged directly as arrays.
+
+The RasterStore class keeps rasters as compressed .npz files, one for each
+station, date and departure time, marked with the fingerprint of the
+timetable they were computed from so that rasters from older data are not
+used once it has been reloaded, and the TileCache class cuts square tiles
+from them at a number of zoom levels, keeping the most recently used rasters
+and tiles in memory.'''
+
+import collections
+import io
+import os
+import threading
+
+import numpy as np
+import matplotlib.image
+import matplotlib.pyplot as plt
+import matplotlib.tri
+
+from nrcif.routing.matrix import UNREACHABLE
+
+TILE_SIZE = 256
+
+
+class RasterGrid(object):
+    '''A grid of square cells over the National Grid, given by its north west
+    corner in metres, the size of the cells and the number of cells across
+    and down. Row 0 is the northern edge, as in an image.'''
+
+    def __init__(self, west=0.0, north=1250000.0, cell_size=2000.0,
+                 width=350, height=625):
+        self.west = west
+        self.north = north
+        self.cell_size = cell_size
+        self.width = width
+        self.height = height
+
+    def params(self):
+        '''Return the parameters of the grid as a tuple'''
+
+        return (self.west, self.north, self.cell_size, self.width,
+                self.height)
+
+    def centres(self):
+        '''Return arrays of the eastings and northings of the centres of all
+        the cells, row by row'''
+
+        e = self.west + (np.arange(self.width) + 0.5) * self.cell_size
+        n = self.north - (np.arange(self.height) + 0.5) * self.cell_size
+        ee, nn = np.meshgrid(e, n)
+        return ee.ravel(), nn.ravel()
+
+# A grid of 2km cells covering Great Britain
+GB_GRID = RasterGrid()
+
+
+def isochron_minutes(timetable, rows):
+    '''Return an array of the journey time in minutes to each location id of
+    a timetable, from isochron rows of (TIPLOC, delay in hours, latitude,
+    longitude), with UNREACHABLE for the locations not in the isochron'''
+
+    minutes = np.full(len(timetable.locations), UNREACHABLE, dtype=np.int64)
+    for tiploc, delay, lat, lon in rows:
+        minutes[timetable.index[tiploc]] = round(delay * 60.0)
+    return minutes
+
+
+class Rasteriser(object):
+    '''Interpolates the journey times to the stations onto the cells of a
+    RasterGrid'''
+
+    def __init__(self, eastings, northings, grid=GB_GRID, max_edge=30000.0):
+        '''eastings and northings give the position of each location id in
+        metres, or NaN where it is not known. Cells in triangles with an edge
+        longer than max_edge metres, such as those across the sea, are left
+        empty.'''
+
+        eastings = np.asarray(eastings, dtype=np.float64)
+        northings = np.asarray(northings, dtype=np.float64)
+        known = np.flatnonzero(~(np.isnan(eastings) | np.isnan(northings)))
+        self.grid = grid
+
+        triangulation = matplotlib.tri.Triangulation(eastings[known],
+                                                     northings[known])
+        x = triangulation.x[triangulation.triangles]
+        y = triangulation.y[triangulation.triangles]
+        edges = np.hypot(x - np.roll(x, 1, axis=1), y - np.roll(y, 1, axis=1))
+        triangulation.set_mask(edges.max(axis=1) > max_edge)
+
+        ce, cn = grid.centres()
+        found = triangulation.get_trifinder()(ce, cn)
+        self.cells = np.flatnonzero(found >= 0)
+        corners = triangulation.triangles[found[self.cells]]
+
+        # The barycentric co-ordinates of each cell centre in its triangle
+        x = triangulation.x[corners]
+        y = triangulation.y[corners]
+        px = ce[self.cells]
+        py = cn[self.cells]
+        det = ((y[:, 1] - y[:, 2]) * (x[:, 0] - x[:, 2]) +
+               (x[:, 2] - x[:, 1]) * (y[:, 0] - y[:, 2]))
+        w0 = ((y[:, 1] - y[:, 2]) * (px - x[:, 2]) +
+              (x[:, 2] - x[:, 1]) * (py - y[:, 2])) / det
+        w1 = ((y[:, 2] - y[:, 0]) * (px - x[:, 2]) +
+              (x[:, 0] - x[:, 2]) * (py - y[:, 2])) / det
+        self.weights = np.stack((w0, w1, 1.0 - w0 - w1), axis=1)
+        self.corners = known[corners]
+
+    @classmethod
+    def from_timetable(cls, timetable, grid=GB_GRID, max_edge=30000.0):
+        '''Create a Rasteriser for the stations of a Timetable'''
+
+        return cls(timetable.easting, timetable.northing, grid, max_edge)
+
+    def rasterise(self, minutes):
+        '''Return a raster of 16-bit journey times in minutes, given an array
+        of the journey time to each location id. Where a corner of a triangle
+        cannot be reached, the cells are interpolated from the other corners.
+        Cells that cannot be reached are given the value UNREACHABLE.'''
+
+        values = np.asarray(minutes, dtype=np.float64)[self.corners]
+        reached = values < UNREACHABLE
+        weights = np.where(reached, self.weights, 0.0)
+        total = weights.sum(axis=1)
+        valid = total > 0.0
+        times = (weights * np.where(reached, values, 0.0)).sum(axis=1)
+
+        result = np.full(self.grid.width * self.grid.height, UNREACHABLE,
+                         dtype=np.uint16)
+        result[self.cells[valid]] = np.clip(
+            np.rint(times[valid] / total[valid]), 0, UNREACHABLE - 1)
+        return result.reshape(self.grid.height, self.grid.width)
+
+
+class RasterStore(object):
+    '''Keeps rasters as compressed .npz files in a directory, with a
+    subdirectory for each date. Once set_timetable has been called for a
+    date, only the rasters computed from that timetable are loaded.'''
+
+    def __init__(self, directory, grid=GB_GRID):
+        self.directory = directory
+        self.grid = grid
+        self.fingerprints = dict()
+
+    def set_timetable(self, timetable):
+        '''Mark the rasters saved for the timetable's date as computed from
+        it, and ignore those stored from any other timetable'''
+
+        self.fingerprints[timetable.date] = timetable.fingerprint
+
+    def path(self, station, timetable_date, depart):
+        '''Return the file name for the raster of a station, date and
+        departure time in minutes'''
+
+        return os.path.join(self.directory, timetable_date.isoformat(),
+                            "{}_{:02d}{:02d}.npz".format(station.strip(),
+                                                         depart // 60,
+                                                         depart % 60))
+
+    def save(self, station, timetable_date, depart, raster):
+        '''Store a raster, replacing any stored before'''
+
+        filename = self.path(station, timetable_date, depart)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        # The raster is written under a temporary name and then renamed, so
+        # that readers never see a partly written file
+        temp = "{}.{}".format(filename, os.getpid())
+        with open(temp, "wb") as f:
+            np.savez_compressed(f, raster=raster,
+                                grid=np.array(self.grid.params()),
+                                timetable=np.array(self.fingerprints.get(
+                                    timetable_date, "")))
+        os.replace(temp, filename)
+
+    def load(self, station, timetable_date, depart):
+        '''Return a stored raster, or None if there is none for this grid
+        and timetable'''
+
+        try:
+            with np.load(self.path(station, timetable_date, depart)) as f:
+                if tuple(f["grid"].tolist()) != self.grid.params():
+                    return None
+                if timetable_date in self.fingerprints and \
+                        ("timetable" not in f or str(f["timetable"]) !=
+                         self.fingerprints[timetable_date]):
+                    return None
+                return f["raster"]
+        except FileNotFoundError:
+            return None
+
+
+class TileCache(object):
+    '''Cuts square tiles of TILE_SIZE pixels from the rasters in a
+    RasterStore. At the highest zoom level, max_zoom, each pixel of a tile is
+    one cell of the grid and each lower level halves the resolution, giving
+    each pixel the shortest journey time of the cells it covers. Tile (0, 0)
+    is at the north west corner of the grid.'''
+
+    def __init__(self, store, max_tiles=1024, max_rasters=16):
+        self.store = store
+        self.max_tiles = max_tiles
+        self.max_rasters = max_rasters
+        self.rasters = collections.OrderedDict()
+        self.tiles = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+        grid = store.grid
+        self.max_zoom = max(0, int(np.ceil(np.log2(
+            max(grid.width, grid.height) / TILE_SIZE))))
+
+    def _remember(self, cache, key, value, limit):
+        cache[key] = value
+        cache.move_to_end(key)
+        while len(cache) > limit:
+            cache.popitem(last=False)
+
+    def raster(self, station, timetable_date, depart):
+        '''Return a raster from memory or the store, or None if it has not
+        been stored'''
+
+        key = (station, timetable_date, depart)
+        with self.lock:
+            if key in self.rasters:
+                self.rasters.move_to_end(key)
+                return self.rasters[key]
+        raster = self.store.load(station, timetable_date, depart)
+        if raster is not None:
+            with self.lock:
+                self._remember(self.rasters, key, raster, self.max_rasters)
+        return raster
+
+    def put_raster(self, station, timetable_date, depart, raster):
+        '''Store a new raster, discarding any tiles cut from an older one'''
+
+        self.store.save(station, timetable_date, depart, raster)
+        key = (station, timetable_date, depart)
+        with self.lock:
+            self._remember(self.rasters, key, raster, self.max_rasters)
+            for k in [k for k in self.tiles if k[:3] == key]:
+                del self.tiles[k]
+
+    def clear(self):
+        '''Forget the rasters and tiles held in memory'''
+
+        with self.lock:
+            self.rasters.clear()
+            self.tiles.clear()
+
+    def tile(self, station, timetable_date, depart, zoom, x, y):
+        '''Return a tile as a TILE_SIZE square array of journey times in
+        minutes, or None if the raster has not been stored'''
+
+        if not 0 <= zoom <= self.max_zoom:
+            raise ValueError("The zoom level must be from 0 to {}"
+                             .format(self.max_zoom))
+        key = (station, timetable_date, depart, zoom, x, y)
+        with self.lock:
+            if key in self.tiles:
+                self.tiles.move_to_end(key)
+                return self.tiles[key]
+
+        raster = self.raster(station, timetable_date, depart)
+        if raster is None:
+            return None
+
+        factor = 2 ** (self.max_zoom - zoom)
+        size = TILE_SIZE * factor
+        block = np.full((size, size), UNREACHABLE, dtype=np.uint16)
+        if x >= 0 and y >= 0:
+            part = raster[y*size:(y+1)*size, x*size:(x+1)*size]
+            block[:part.shape[0], :part.shape[1]] = part
+        tile = block.reshape(TILE_SIZE, factor,
+                             TILE_SIZE, factor).min(axis=(1, 3))
+
+        with self.lock:
+            self._remember(self.tiles, key, tile, self.max_tiles)
+        return tile
+
+    def png(self, station, timetable_date, depart, zoom, x, y,
+            max_minutes=480, cmap="viridis"):
+        '''Return a tile as a PNG image, coloured by journey time up to
+        max_minutes with the cells that cannot be reached left transparent,
+        or None if the raster has not been stored'''
+
+        tile = self.tile(station, timetable_date, depart, zoom, x, y)
+        if tile is None:
+            return None
+
+        rgba = plt.get_cmap(cmap)(np.clip(tile / max_minutes, 0.0, 1.0))
+        rgba[tile == UNREACHABLE, 3] = 0.0
+        data = io.BytesIO()
+        matplotlib.image.imsave(data, rgba, format="png")
+        return data.getvalue()
@@ -0,0 +1,128 @@
+# render.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''render - Draw many isochron maps in parallel
+
+The RenderBatch class computes isochrons from an in-memory timetable and
+draws each of them to a file over a pool of worker processes. The timetable
+and the Basemap are set as module globals before the workers are forked, so
+the map projection is only prepared once and shared by every worker. The
+figures are drawn with the non-interactive Agg backend so that no display is
+needed. The time each plot spends in each stage is returned so that slow
+plots can be found.'''
+
+import collections
+import os
+import time
+
+import matplotlib.pyplot as plt
+
+import nrcif.routing.batch
+import nrcif.routing.csa
+from nrcif.mapping import label_cities, triangulate, draw_isochron
+
+# The map, output directory, file format and whether to label cities, used by
+# the worker processes. These are set in the parent process before the
+# workers are forked.
+_basemap = None
+_output_dir = None
+_file_format = None
+_labels = True
+
+RenderTimes = collections.namedtuple("RenderTimes",
+                                     ["query", "triangulation",
+                                      "contouring", "write"])
+
+RenderResult = collections.namedtuple("RenderResult",
+                                      ["origin", "depart", "filename",
+                                       "times", "error"])
+
+
+def isochron_filename(station, timetable_date, depart, file_format):
+    '''Return the name of the file for an isochron map, given the departure
+    time in minutes'''
+
+    return "{}_{}_{:02d}{:02d}.{}".format(station.strip(),
+                                          timetable_date.isoformat(),
+                                          depart // 60, depart % 60,
+                                          file_format)
+
+
+def _render_job(job):
+    origin, depart = job
+    tt = nrcif.routing.batch._timetable
+    station = tt.locations[origin]
+
+    start = time.perf_counter()
+    rows = nrcif.routing.csa.isochron(tt, origin, depart)
+    location = [x[0] for x in rows]
+    delay = [x[1] for x in rows]
+    lat = [x[2] for x in rows]
+    lon = [x[3] for x in rows]
+    query = time.perf_counter()
+
+    # Contours cannot be drawn if too few locations can be reached
+    try:
+        triangulation = triangulate(_basemap, lat, lon)
+    except (ValueError, RuntimeError) as err:
+        return RenderResult(origin, depart, None, None,
+                            "{} locations cannot be plotted: {}"
+                            .format(len(rows), err))
+    triangulated = time.perf_counter()
+
+    cities = label_cities(location, lat, lon, station) if _labels else None
+    title = ("Isochron map of UK rail journeys from {} {} {:02d}:{:02d}"
+             .format(station, tt.date, depart // 60, depart % 60))
+    fig = draw_isochron(_basemap, triangulation, delay, cities, title)
+    contoured = time.perf_counter()
+
+    filename = isochron_filename(station, tt.date, depart, _file_format)
+    fig.savefig(os.path.join(_output_dir, filename))
+    plt.close(fig)
+    written = time.perf_counter()
+
+    return RenderResult(origin, depart, filename,
+                        RenderTimes(query - start, triangulated - query,
+                                    contoured - triangulated,
+                                    written - contoured),
+                        None)
+
+
+class RenderBatch(nrcif.routing.batch.Batch):
+    '''Draws isochron maps over a pool of worker processes'''
+
+    def __init__(self, timetable, basemap, output_dir, file_format="png",
+                 labels=True, workers=None):
+        global _basemap, _output_dir, _file_format, _labels
+
+        plt.switch_backend("Agg")
+        _basemap = basemap
+        _output_dir = output_dir
+        _file_format = file_format
+        _labels = labels
+        super().__init__(timetable, workers)
+
+    def run(self, origins, departures):
+        '''Draw the isochron maps for every combination of origin location id
+        and departure time in minutes, yielding RenderResults in the order
+        they are completed'''
+
+        return self.map(_render_job,
+                        [(o, d) for o in origins for d in departures])
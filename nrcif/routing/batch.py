@@ -0,0 +1,130 @@
+# nrcif/routing/batch.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''batch - Compute many isochrons from one timetable in parallel
+
+The timetable is set as a module global before a pool of worker processes is
+forked, so each worker reads the same copy of the timetable arrays rather than
+loading its own. Each job returns the time it took and the id of the worker
+process that ran it so that the throughput of the workers can be reported.'''
+
+import collections
+import multiprocessing
+import os
+import time
+
+import numpy as np
+
+import nrcif.routing.csa
+
+# The timetable used by the worker processes. This is set in the parent
+# process before the workers are forked.
+_timetable = None
+
+WorkerStats = collections.namedtuple("WorkerStats",
+                                     ["pid", "jobs", "seconds"])
+
+
+def select_origins(timetable, max_cate_type):
+    '''Return the ids of the stations with a CATE interchange type no greater
+    than max_cate_type. Locations that are not in the MSN data are never
+    selected.'''
+
+    return [i for i, cate in enumerate(timetable.cate_type.tolist())
+            if 0 <= cate <= max_cate_type]
+
+
+def select_near(timetable, location_id, radius):
+    '''Return the ids of the stations within radius metres of a location,
+    including the location itself'''
+
+    tt = timetable
+    if np.isnan(tt.easting[location_id]):
+        raise ValueError("The position of {} is not known"
+                         .format(tt.locations[location_id].strip()))
+    return [i for i, distance in
+            tt.station_grid.within(tt.easting[location_id],
+                                   tt.northing[location_id], radius)]
+
+
+def _timed(task):
+    function, job = task
+    start = time.perf_counter()
+    result = function(job)
+    return (os.getpid(), time.perf_counter() - start, result)
+
+
+def _isochron_job(job):
+    origin, depart = job
+    return (origin, depart,
+            nrcif.routing.csa.isochron(_timetable, origin, depart))
+
+
+class Batch(object):
+    '''Runs jobs that use a timetable over a pool of worker processes and
+    keeps track of how much work each worker has done'''
+
+    def __init__(self, timetable, workers=None):
+        global _timetable
+
+        self.timetable = timetable
+        self.workers = workers or multiprocessing.cpu_count()
+        self.stats = dict()
+
+        _timetable = timetable
+        context = multiprocessing.get_context("fork")
+        self.pool = context.Pool(self.workers)
+
+    def map(self, function, jobs):
+        '''Apply a module-level function to each of the jobs in the worker
+        processes, yielding the results in the order they are completed'''
+
+        jobs = [(function, job) for job in jobs]
+        chunksize = max(1, len(jobs) // (self.workers * 8))
+        for pid, seconds, result in self.pool.imap_unordered(_timed, jobs,
+                                                             chunksize):
+            count, total = self.stats.get(pid, (0, 0.0))
+            self.stats[pid] = (count + 1, total + seconds)
+            yield result
+
+    def worker_stats(self):
+        '''Return a list of WorkerStats giving the number of jobs each worker
+        has completed and the time it spent on them'''
+
+        return [WorkerStats(pid, count, seconds)
+                for pid, (count, seconds) in sorted(self.stats.items())]
+
+    def close(self):
+        '''Shut down the worker pool'''
+
+        self.pool.close()
+        self.pool.join()
+
+
+class IsochronBatch(Batch):
+    '''Computes isochrons over a pool of worker processes'''
+
+    def run(self, origins, departures):
+        '''Compute the isochrons for every combination of origin location id
+        and departure time in minutes, yielding (origin id, departure, rows)
+        tuples in the order they are completed'''
+
+        return self.map(_isochron_job,
+                        [(o, d) for o in origins for d in departures])
@@ -0,0 +1,494 @@
+# nrcif/routing/csa.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''csa - Journey searches over an in-memory Timetable
+
+This module implements the Connection Scan Algorithm in the same way as the
+util.connection_scan SQL function. The connections of the day are scanned once
+in order of departure, keeping the earliest known arrival at each location.
+A train can be boarded at a location once the station-specific interchange
+time has passed since arriving there, or the TOC specific interchange time if
+one is given for the operators of the two trains. A fixed link can only be
+taken straight after arriving at a location by train, or leaving the origin,
+within its hours of operation, so the links are followed after every train
+that is caught and not on from their far ends. Journeys do not continue past
+midnight.
+
+The reverse scan answers the opposite question: the latest time each location
+can be left while still reaching a destination by a given time. The
+connections are scanned once in the reverse order, keeping the latest time at
+which a traveller can be ready to leave each location, with the same
+interchange times and fixed links as the forward scan, so that a forward scan
+from the latest time found for a location arrives in time.'''
+
+import numpy as np
+
+# Used for locations that have not been reached
+UNREACHED = 1 << 30
+
+MIDNIGHT = 1440
+
+# Used for locations from which the destination cannot be reached in time
+NEVER = -UNREACHED
+
+
+class ScanResult(object):
+    '''The result of a connection scan from a single origin. For each
+    location the earliest arrival and departure are given in minutes after
+    midnight, together with the location where the last train or fixed link
+    of the journey was boarded, its departure time from there and the train
+    UID or link mode. by_link marks the locations whose earliest arrival is
+    by a fixed link, and for those link_train gives the (from id, departure,
+    train UID, arrival) of the train taken to the start of the link, which
+    need not be the earliest arrival there, or None if the link was taken
+    from the origin.'''
+
+    def __init__(self, timetable, origin, depart, arrival, ready, via_from,
+                 via_departure, via_uid, by_link, link_train):
+        self.timetable = timetable
+        self.origin = origin
+        self.depart = depart
+        self.arrival = arrival
+        self.ready = ready
+        self.via_from = via_from
+        self.via_departure = via_departure
+        self.via_uid = via_uid
+        self.by_link = by_link
+        self.link_train = link_train
+
+    def reached(self):
+        '''Return the ids of the locations that were reached'''
+
+        return [i for i, x in enumerate(self.arrival) if x < UNREACHED]
+
+    def legs(self, destination):
+        '''Return the journey to a location as a list of (from id, departure,
+        to id, arrival, train UID or link mode) tuples, or None if the
+        location was not reached'''
+
+        if self.arrival[destination] >= UNREACHED:
+            return None
+
+        result = []
+        i = destination
+        while i != self.origin:
+            via_from = self.via_from[i]
+            result.append((via_from, self.via_departure[i], i,
+                           self.arrival[i], self.via_uid[i]))
+            if self.by_link[i] and self.link_train[i] is not None:
+                # The train taken to the start of the link
+                train_from, departure, uid, arrival = self.link_train[i]
+                result.append((train_from, departure, via_from, arrival,
+                               uid))
+                via_from = train_from
+            i = via_from
+        result.reverse()
+        return result
+
+    def path(self, destination):
+        '''Return the train UIDs and link modes used to reach a location'''
+
+        legs = self.legs(destination)
+        return None if legs is None else [x[4] for x in legs]
+
+
+def connection_scan(timetable, origin, depart, destination=None):
+    '''Find the earliest arrival at every location reachable from the origin
+    location id after the departure time in minutes. If a destination is
+    given the scan stops as soon as no later connection can improve the
+    arrival there.'''
+
+    tt = timetable
+    n = len(tt.locations)
+    change = tt.change.tolist()
+    link_offsets = tt.link_offsets.tolist()
+    link_to = tt.link_to.tolist()
+    link_start = tt.link_start.tolist()
+    link_end = tt.link_end.tolist()
+    link_minutes = tt.link_minutes.tolist()
+    link_mode = tt.link_mode
+    trip_uid = tt.trip_uid
+    trip_toc = tt.trip_toc
+    toc_change = tt.toc_change
+    toc_change_at = tt.toc_change_at
+
+    arrival = [UNREACHED] * n
+    ready = [UNREACHED] * n
+    via_from = [-1] * n
+    via_departure = [-1] * n
+    via_uid = [None] * n
+    by_link = [False] * n
+    arrived_toc = [None] * n
+    boarded_at = [-1] * len(trip_uid)
+    boarded_departure = [-1] * len(trip_uid)
+    link_train = [None] * n
+
+    def follow_links(x, r, train):
+        for k in range(link_offsets[x], link_offsets[x + 1]):
+            if not link_start[k] <= r <= link_end[k]:
+                continue
+            a = r + link_minutes[k]
+            t = link_to[k]
+            if a < MIDNIGHT and a < arrival[t]:
+                arrival[t] = a
+                ready[t] = a + change[t]
+                via_from[t] = x
+                via_departure[t] = r
+                via_uid[t] = link_mode[k]
+                by_link[t] = True
+                link_train[t] = train
+                arrived_toc[t] = None
+
+    arrival[origin] = depart
+    ready[origin] = depart
+    follow_links(origin, depart, None)
+
+    start = int(np.searchsorted(tt.departure, depart, side="right"))
+    for dep, arr, f, t, trip in zip(tt.departure[start:].tolist(),
+                                    tt.arrival[start:].tolist(),
+                                    tt.from_id[start:].tolist(),
+                                    tt.to_id[start:].tolist(),
+                                    tt.trip[start:].tolist()):
+
+        if destination is not None and dep >= arrival[destination]:
+            break
+        if arr >= MIDNIGHT:
+            continue
+
+        if boarded_at[trip] < 0:
+            r = ready[f]
+            if f in toc_change_at and arrived_toc[f] is not None:
+                m = toc_change.get((f, arrived_toc[f], trip_toc[trip]))
+                if m is not None:
+                    r = arrival[f] + m
+            if r >= dep:
+                continue
+            boarded_at[trip] = f
+            boarded_departure[trip] = dep
+
+        if arr < arrival[t]:
+            arrival[t] = arr
+            ready[t] = arr + change[t]
+            via_from[t] = boarded_at[trip]
+            via_departure[t] = boarded_departure[trip]
+            via_uid[t] = trip_uid[trip]
+            by_link[t] = False
+            arrived_toc[t] = trip_toc[trip]
+
+        # A link can only be taken straight after arriving within its hours
+        # of operation, so a later train may reach a link that an earlier
+        # arrival missed
+        if link_offsets[t] < link_offsets[t + 1]:
+            follow_links(t, arr + change[t],
+                         (boarded_at[trip], boarded_departure[trip],
+                          trip_uid[trip], arr))
+
+    return ScanResult(tt, origin, depart, arrival, ready, via_from,
+                      via_departure, via_uid, by_link, link_train)
+
+
+def isochron(timetable, origin, depart):
+    '''Return the rows of an isochron from the origin location id after the
+    departure time in minutes, as in util.isochron_latlon: a list of (TIPLOC,
+    delay in hours, latitude, longitude) tuples for the stations with known
+    positions, in order of arrival'''
+
+    tt = timetable
+    result = connection_scan(tt, origin, depart)
+    rows = []
+    for i in result.reached():
+        if np.isnan(tt.latitude[i]):
+            continue
+        rows.append((tt.locations[i], (result.arrival[i] - depart) / 60.0,
+                     float(tt.latitude[i]), float(tt.longitude[i])))
+    rows.sort(key=lambda x: x[1])
+    return rows
+
+
+def journey(timetable, origin, destination, depart):
+    '''Return the legs of the earliest arriving journey between two location
+    ids after the departure time in minutes, as (from TIPLOC, departure
+    minute, to TIPLOC, arrival minute, train UID or link mode) tuples, or None
+    if the destination cannot be reached'''
+
+    tt = timetable
+    result = connection_scan(tt, origin, depart, destination)
+    legs = result.legs(destination)
+    if legs is None:
+        return None
+    return [(tt.locations[f], dep, tt.locations[t], arr, uid)
+            for f, dep, t, arr, uid in legs]
+
+
+class ReverseScanResult(object):
+    '''The result of a reverse connection scan to a single destination. For
+    each location the latest time at which a traveller can be ready to leave
+    is given in minutes after midnight, as for the depart argument of
+    connection_scan, together with the departure time, the location where
+    the first train or fixed link of the journey is left, its arrival time
+    there and the train UID or link mode. by_link marks the locations where
+    that is a fixed link. The latest time for leaving by train and the train
+    to take are kept as well, with the best train of each operator at
+    locations with TOC specific interchange times, as which can be caught
+    after arriving depends on the train arrived on, and a link can only be
+    taken straight after arriving.'''
+
+    def __init__(self, timetable, destination, arrive, latest, via, by_link,
+                 latest_train, train_via, toc_via):
+        self.timetable = timetable
+        self.destination = destination
+        self.arrive = arrive
+        self.latest = latest
+        self.via = via
+        self.by_link = by_link
+        self.latest_train = latest_train
+        self.train_via = train_via
+        self.toc_via = toc_via
+
+    def reached(self):
+        '''Return the ids of the locations from which the destination can be
+        reached'''
+
+        return [i for i, x in enumerate(self.latest) if x > NEVER]
+
+    def departure(self, origin):
+        '''Return the latest departure in minutes after midnight from a
+        location, or None if the destination cannot be reached from it'''
+
+        if self.latest[origin] <= NEVER:
+            return None
+        return self.via[origin][0]
+
+    def link_leg(self, x, r):
+        '''Return the leg for the first fixed link from a location that can
+        be taken by a traveller ready to leave at r, in time to catch a train
+        at the far end or to reach the destination, or None if there is no
+        such link'''
+
+        tt = self.timetable
+        for k in tt.links_from(x):
+            if not tt.link_start[k] <= r <= tt.link_end[k]:
+                continue
+            y = int(tt.link_to[k])
+            a = r + int(tt.link_minutes[k])
+            if y == self.destination:
+                if a > self.arrive:
+                    continue
+            elif a + tt.change[y] > self.latest_train[y]:
+                continue
+            return (r, y, a, tt.link_mode[k], None)
+        return None
+
+    def next_leg(self, x, arrived, arrived_toc, after_link=False):
+        '''Return the leg to take from a location after arriving there at the
+        given time on a train of the given operator (None after a fixed
+        link), and whether it is a fixed link, or (None, False) if the
+        destination cannot be reached in time from there'''
+
+        tt = self.timetable
+        r = arrived + int(tt.change[x])
+        if arrived_toc is not None and x in tt.toc_change_at:
+            # Only some of the trains may be caught after arriving on a
+            # train of this operator
+            options = []
+            for toc, option in self.toc_via.get(x, dict()).items():
+                m = tt.toc_change.get((x, arrived_toc, toc))
+                if (r if m is None else arrived + m) < option[0]:
+                    options.append((option[0], option))
+            if options:
+                return max(options)[1], False
+        elif r <= self.latest_train[x]:
+            return self.train_via[x], False
+        if not after_link:
+            leg = self.link_leg(x, r)
+            if leg is not None:
+                return leg, True
+        return None, False
+
+    def legs(self, origin):
+        '''Return the latest departing journey from a location as a list of
+        (from id, departure, to id, arrival, train UID or link mode) tuples,
+        or None if the destination cannot be reached from it'''
+
+        if self.latest[origin] <= NEVER:
+            return None
+
+        result = []
+        if origin == self.destination:
+            return result
+        x = origin
+        leg = self.via[origin]
+        after_link = self.by_link[origin]
+        while True:
+            departure, to, arrival, uid, toc = leg
+            result.append((x, departure, to, arrival, uid))
+            if to == self.destination:
+                return result
+            x = to
+            leg, after_link = self.next_leg(x, arrival, toc, after_link)
+
+    def path(self, origin):
+        '''Return the train UIDs and link modes used from a location'''
+
+        legs = self.legs(origin)
+        return None if legs is None else [x[4] for x in legs]
+
+
+def reverse_connection_scan(timetable, destination, arrive, origin=None):
+    '''Find the latest time at which every location can be left to reach
+    the destination location id by the arrival time in minutes. If an origin
+    is given the scan stops as soon as no earlier connection can improve the
+    departure from there.
+
+    As in connection_scan, a train can be boarded once the interchange time
+    has passed since arriving at a location, and the fixed links are assumed
+    to be symmetrical and are not followed on from the far end. A link can
+    only be taken straight after arriving at a location, or from the origin,
+    within its hours of operation, so a train is only left where another
+    train or a link can be taken from there in time.'''
+
+    tt = timetable
+    n = len(tt.locations)
+    change = tt.change.tolist()
+    link_offsets = tt.link_offsets.tolist()
+    link_to = tt.link_to.tolist()
+    link_start = tt.link_start.tolist()
+    link_end = tt.link_end.tolist()
+    link_minutes = tt.link_minutes.tolist()
+    link_mode = tt.link_mode
+    trip_uid = tt.trip_uid
+    trip_toc = tt.trip_toc
+    toc_change = tt.toc_change
+    toc_change_at = tt.toc_change_at
+
+    # The latest ready time at each location, for leaving by any means and
+    # for leaving by train (using the standard interchange time). The latest
+    # ready time for leaving by train is one minute before the train departs.
+    latest = [NEVER] * n
+    latest_train = [NEVER] * n
+    via = [None] * n
+    by_link = [False] * n
+    train_via = [None] * n
+    toc_via = dict()
+    alight_at = [-1] * len(trip_uid)
+    alight_arrival = [-1] * len(trip_uid)
+
+    result = ReverseScanResult(tt, destination, arrive, latest, via, by_link,
+                               latest_train, train_via, toc_via)
+
+    def follow_links(x, deadline):
+        # As the links are symmetrical, the links from x give those to x. A
+        # traveller must be ready within the hours of the link and in time to
+        # arrive at x by the deadline.
+        for k in range(link_offsets[x], link_offsets[x + 1]):
+            y = link_to[k]
+            d = min(deadline - link_minutes[k], link_end[k])
+            if d < link_start[k] or d <= latest[y]:
+                continue
+            latest[y] = d
+            via[y] = (d, x, d + link_minutes[k], link_mode[k], None)
+            by_link[y] = True
+
+    def can_change(t, arr, toc):
+        r = arr + change[t]
+        if t in toc_change_at and toc is not None:
+            for departing, option in toc_via.get(t, dict()).items():
+                m = toc_change.get((t, toc, departing))
+                if (r if m is None else arr + m) < option[0]:
+                    return True
+        elif r <= latest_train[t]:
+            return True
+        return (link_offsets[t] < link_offsets[t + 1] and
+                result.link_leg(t, r) is not None)
+
+    latest[destination] = arrive
+    latest_train[destination] = arrive
+    via[destination] = (arrive, destination, arrive, None, None)
+    follow_links(destination, arrive)
+
+    end = int(np.searchsorted(tt.departure, arrive, side="right"))
+    for dep, arr, f, t, trip in zip(reversed(tt.departure[:end].tolist()),
+                                    reversed(tt.arrival[:end].tolist()),
+                                    reversed(tt.from_id[:end].tolist()),
+                                    reversed(tt.to_id[:end].tolist()),
+                                    reversed(tt.trip[:end].tolist())):
+
+        if origin is not None and dep - 1 <= latest[origin]:
+            break
+        if arr > arrive or arr >= MIDNIGHT or f == destination:
+            continue
+
+        if alight_at[trip] < 0:
+            if t != destination and not can_change(t, arr, trip_toc[trip]):
+                continue
+            alight_at[trip] = t
+            alight_arrival[trip] = arr
+
+        leg = (dep, alight_at[trip], alight_arrival[trip], trip_uid[trip],
+               trip_toc[trip])
+        if f in toc_change_at:
+            options = toc_via.setdefault(f, dict())
+            if trip_toc[trip] not in options or \
+                    dep > options[trip_toc[trip]][0]:
+                options[trip_toc[trip]] = leg
+
+        if dep - 1 > latest_train[f]:
+            latest_train[f] = dep - 1
+            train_via[f] = leg
+            if dep - 1 > latest[f]:
+                latest[f] = dep - 1
+                via[f] = leg
+                by_link[f] = False
+            follow_links(f, dep - 1 - change[f])
+
+    return result
+
+
+def reverse_isochron(timetable, destination, arrive):
+    '''Return the rows of a reverse isochron to the destination location id
+    by the arrival time in minutes: a list of (TIPLOC, time before the
+    arrival in hours of the latest departure, latitude, longitude) tuples for
+    the stations with known positions, latest departure first'''
+
+    tt = timetable
+    result = reverse_connection_scan(tt, destination, arrive)
+    rows = []
+    for i in result.reached():
+        if np.isnan(tt.latitude[i]):
+            continue
+        rows.append((tt.locations[i],
+                     (arrive - result.departure(i)) / 60.0,
+                     float(tt.latitude[i]), float(tt.longitude[i])))
+    rows.sort(key=lambda x: x[1])
+    return rows
+
+
+def arrive_by_journey(timetable, origin, destination, arrive):
+    '''Return the legs of the latest departing journey between two location
+    ids that arrives by the arrival time in minutes, in the same form as
+    journey, or None if there is no such journey'''
+
+    tt = timetable
+    result = reverse_connection_scan(tt, destination, arrive, origin)
+    legs = result.legs(origin)
+    if legs is None:
+        return None
+    return [(tt.locations[f], dep, tt.locations[t], arr, uid)
+            for f, dep, t, arr, uid in legs]
@@ -0,0 +1,141 @@
+# nrcif/routing/matrix.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''matrix - Station to station travel time matrices
+
+A travel time matrix gives the shortest journey time in minutes between every
+pair of a set of stations, for departures at a number of times on a date. The
+matrix is stored as a NumPy .npy file of 16-bit unsigned integers, with a
+JSON file alongside it giving the TIPLOC codes of the rows and columns, the
+date and the departure times. Row i gives the journey times from station i, so
+a whole row can be read from disk at once. Stations that cannot be reached are
+given the value UNREACHABLE.
+
+The TravelTimeMatrix class opens a matrix with the .npy file mapped into
+memory, so only the parts of the matrix that are used are read from disk.'''
+
+import json
+
+import numpy as np
+
+import nrcif.routing.batch
+import nrcif.routing.csa
+
+UNREACHABLE = 0xFFFF
+
+# The destination location ids and the departure times used by the worker
+# processes. These are set in the parent process before the workers are
+# forked.
+_destinations = None
+_departures = None
+
+
+def _matrix_row(job):
+    row, origin = job
+    tt = nrcif.routing.batch._timetable
+    best = np.full(len(_destinations), UNREACHABLE, dtype=np.int64)
+    for depart in _departures:
+        result = nrcif.routing.csa.connection_scan(tt, origin, depart)
+        arrival = np.array(result.arrival, dtype=np.int64)[_destinations]
+        best = np.minimum(best, arrival - depart)
+    return row, best.astype(np.uint16)
+
+
+class MatrixBatch(nrcif.routing.batch.Batch):
+    '''Computes the rows of a travel time matrix over a pool of worker
+    processes'''
+
+    def __init__(self, timetable, stations, departures, workers=None):
+        '''stations is a sequence of location ids and departures a sequence
+        of departure times in minutes after midnight'''
+
+        global _destinations, _departures
+
+        self.stations = list(stations)
+        self.departures = sorted(departures)
+        _destinations = np.array(self.stations, dtype=np.intp)
+        _departures = self.departures
+        super().__init__(timetable, workers)
+
+    def run(self, filename):
+        '''Compute the matrix and write it to filename.npy, with the index in
+        filename.json. Yields the number of rows written after each row is
+        completed.'''
+
+        n = len(self.stations)
+        tt = self.timetable
+
+        with open(filename + ".json", "w") as f:
+            json.dump({"date": tt.date.isoformat(),
+                       "departures": self.departures,
+                       "tiplocs": [tt.locations[i].strip()
+                                   for i in self.stations]}, f)
+
+        matrix = np.lib.format.open_memmap(filename + ".npy", mode="w+",
+                                           dtype=np.uint16, shape=(n, n))
+        done = 0
+        for row, times in self.map(_matrix_row, enumerate(self.stations)):
+            matrix[row] = times
+            done += 1
+            yield done
+        matrix.flush()
+        del matrix
+
+
+class TravelTimeMatrix(object):
+    '''A travel time matrix opened from disk. The matrix attribute is a
+    read-only memory-mapped NumPy array.'''
+
+    def __init__(self, filename):
+        '''filename is the name the matrix was written with, without the .npy
+        or .json extension'''
+
+        with open(filename + ".json") as f:
+            header = json.load(f)
+        self.date = header["date"]
+        self.departures = header["departures"]
+        self.tiplocs = header["tiplocs"]
+        self.index = {t: i for i, t in enumerate(self.tiplocs)}
+        self.matrix = np.load(filename + ".npy", mmap_mode="r")
+
+    def __len__(self):
+        return len(self.tiplocs)
+
+    def lookup(self, tiploc):
+        '''Return the row or column number of a TIPLOC code, raising KeyError
+        if it is not in the matrix'''
+
+        return self.index[tiploc.strip().upper()]
+
+    def minutes(self, origin, destination):
+        '''Return the shortest journey time in minutes between two TIPLOC
+        codes, or None if the destination cannot be reached'''
+
+        result = int(self.matrix[self.lookup(origin),
+                                 self.lookup(destination)])
+        return None if result == UNREACHABLE else result
+
+    def from_station(self, origin):
+        '''Return a dict of the journey times in minutes from a TIPLOC code
+        to each of the stations that can be reached'''
+
+        row = self.matrix[self.lookup(origin)]
+        return {self.tiplocs[i]: int(row[i])
+                for i in np.flatnonzero(row != UNREACHABLE)}
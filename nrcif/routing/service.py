@@ -0,0 +1,233 @@
+# nrcif/routing/service.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''service - Answer routing queries from a pool of worker processes
+
+The RoutingService class loads the timetables for a range of dates and then
+starts a pool of worker processes to answer queries. The workers are started
+by a fork server, which is itself started with the first pool before any
+queries are served, so the workers are never forked from a process that is
+running the threads of the HTTP server. Each worker is given a copy of the
+timetables when it starts, rather than loading them from the database. When
+the timetables are reloaded a new pool is started and the old one is closed
+and joined once the queries it is working on have finished.'''
+
+import datetime
+import multiprocessing
+import signal
+import threading
+import time
+
+import nrcif.routing.csa
+from nrcif.routing.timetable import Timetable
+
+# The timetables used by the worker processes, keyed by date. This is set in
+# the parent process when the timetables are loaded, and in each worker by
+# _set_timetables when it starts.
+_timetables = dict()
+
+
+def _set_timetables(timetables):
+    '''Initialise a worker process with the timetables for the pool. The
+    workers ignore interrupts, leaving the parent process to shut them down.'''
+
+    global _timetables
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _timetables = timetables
+
+
+def load_timetables(cur, start_date, days):
+    '''Load the timetables for a number of days from start_date, returning a
+    dict keyed by date. The connections for each date are created first if
+    the database is not a read-only standby.'''
+
+    cur.execute("SELECT pg_is_in_recovery();")
+    standby = cur.fetchone()[0]
+
+    result = dict()
+    for i in range(0, days):
+        d = start_date + datetime.timedelta(days=i)
+        if not standby:
+            cur.callproc("util.ensure_connections", (d,))
+            cur.connection.commit()
+        result[d] = Timetable.from_database(cur, d)
+    return result
+
+
+def _lookup(timetable_date, *stations):
+    '''Find the timetable for a date and the location ids for the stations,
+    raising KeyError if any of them cannot be found'''
+
+    if timetable_date not in _timetables:
+        raise KeyError("No timetable has been loaded for {}"
+                       .format(timetable_date))
+    tt = _timetables[timetable_date]
+    ids = []
+    for station in stations:
+        location_id = tt.find_station(station)
+        if location_id is None:
+            raise KeyError("Station {} cannot be identified".format(station))
+        ids.append(location_id)
+    return tt, ids
+
+
+def _isochron_job(timetable_date, station, depart):
+    tt, ids = _lookup(timetable_date, station)
+    return nrcif.routing.csa.isochron(tt, ids[0], depart)
+
+
+def _journey_job(timetable_date, origin, destination, depart):
+    tt, ids = _lookup(timetable_date, origin, destination)
+    return nrcif.routing.csa.journey(tt, ids[0], ids[1], depart)
+
+
+def _reverse_isochron_job(timetable_date, station, arrive):
+    tt, ids = _lookup(timetable_date, station)
+    return nrcif.routing.csa.reverse_isochron(tt, ids[0], arrive)
+
+
+def _arrive_by_job(timetable_date, origin, destination, arrive):
+    tt, ids = _lookup(timetable_date, origin, destination)
+    return nrcif.routing.csa.arrive_by_journey(tt, ids[0], ids[1], arrive)
+
+
+class RoutingService(object):
+    '''Holds the loaded timetables and the pool of worker processes'''
+
+    def __init__(self, connect, start_date, days, workers=None):
+        '''connect is a function that returns a new DB API connection, used
+        whenever the timetables are (re)loaded. If start_date is None no
+        timetables are loaded until reload or set_timetables is called.'''
+
+        self.connect = connect
+        self.workers = workers or multiprocessing.cpu_count()
+        self.context = multiprocessing.get_context("forkserver")
+        self.context.set_forkserver_preload(["nrcif.routing.csa",
+                                             "nrcif.routing.timetable"])
+        self.lock = threading.Lock()
+        self.pool = None
+        self.dates = []
+        self.loaded_at = None
+        if start_date is not None:
+            self.reload(start_date, days)
+
+    def reload(self, start_date, days):
+        '''Load the timetables for a new range of dates and start a new pool
+        of workers to use them'''
+
+        connection = self.connect()
+        try:
+            with connection.cursor() as cur:
+                timetables = load_timetables(cur, start_date, days)
+        finally:
+            connection.close()
+
+        self.set_timetables(timetables)
+
+    def set_timetables(self, timetables):
+        '''Start a new pool of workers to use the timetables in a dict keyed
+        by date, replacing any that were loaded before'''
+
+        global _timetables
+
+        pool = self.context.Pool(self.workers, initializer=_set_timetables,
+                                 initargs=(timetables,))
+
+        with self.lock:
+            old_pool = self.pool
+            _timetables = timetables
+            self.pool = pool
+            self.dates = sorted(timetables)
+            self.loaded_at = time.time()
+
+        if old_pool is not None:
+            old_pool.close()
+            old_pool.join()
+
+    def status(self):
+        '''Return a dict describing the loaded timetables'''
+
+        with self.lock:
+            return {"dates": [d.isoformat() for d in self.dates],
+                    "connections": {d.isoformat(): len(_timetables[d])
+                                    for d in self.dates},
+                    "workers": self.workers,
+                    "loaded_at": self.loaded_at}
+
+    def _submit(self, job, args):
+        with self.lock:
+            if self.pool is None:
+                raise KeyError("No timetables have been loaded")
+            pending = self.pool.apply_async(job, args)
+        return pending.get()
+
+    def timetable(self, timetable_date):
+        '''Return the loaded Timetable for a date, raising KeyError if it has
+        not been loaded'''
+
+        with self.lock:
+            return _lookup(timetable_date)[0]
+
+    def search_stations(self, text, k=10):
+        '''Return up to k (TIPLOC, station name, CATE type) tuples for the
+        stations with names matching the text. This is answered directly
+        rather than by the workers, as it is quick.'''
+
+        with self.lock:
+            if not self.dates:
+                raise KeyError("No timetables have been loaded")
+            tt = _timetables[self.dates[0]]
+        return tt.station_index.search(text, k)
+
+    def isochron(self, timetable_date, station, depart):
+        '''Return the isochron rows for a station, date and departure time in
+        minutes after midnight'''
+
+        return self._submit(_isochron_job, (timetable_date, station, depart))
+
+    def journey(self, timetable_date, origin, destination, depart):
+        '''Return the legs of the earliest arriving journey between two
+        stations'''
+
+        return self._submit(_journey_job,
+                            (timetable_date, origin, destination, depart))
+
+    def reverse_isochron(self, timetable_date, station, arrive):
+        '''Return the reverse isochron rows for a station, date and arrival
+        time in minutes after midnight'''
+
+        return self._submit(_reverse_isochron_job,
+                            (timetable_date, station, arrive))
+
+    def arrive_by(self, timetable_date, origin, destination, arrive):
+        '''Return the legs of the latest departing journey between two
+        stations that arrives by the arrival time'''
+
+        return self._submit(_arrive_by_job,
+                            (timetable_date, origin, destination, arrive))
+
+    def close(self):
+        '''Shut down the worker pool'''
+
+        with self.lock:
+            if self.pool is not None:
+                self.pool.close()
+                self.pool.join()
+                self.pool = None
@@ -0,0 +1,151 @@
+# nrcif/routing/spatial.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''spatial - Find the stations near a point
+
+The StationGrid class divides the National Grid into square cells and keeps
+the stations in each cell, so the stations within a distance of a point or
+the nearest stations to it can be found by looking only at the cells around
+the point. It answers the same queries as msn.nearest_stations and
+msn.stations_within.'''
+
+import numpy as np
+
+
+class StationGrid(object):
+    '''A grid of cells containing station positions given as National Grid
+    eastings and northings in metres'''
+
+    sql = '''SELECT tiploc_code, position[0], position[1]
+        FROM msn.station_locations;'''
+
+    def __init__(self, keys, eastings, northings, cell_size=5000.0):
+        '''keys is a sequence of TIPLOCs or location ids, with the positions
+        of each given by eastings and northings. Any positions that are NaN
+        are left out.'''
+
+        eastings = np.asarray(eastings, dtype=np.float64)
+        northings = np.asarray(northings, dtype=np.float64)
+        valid = ~(np.isnan(eastings) | np.isnan(northings))
+
+        self.keys = [k for k, v in zip(keys, valid) if v]
+        self.eastings = eastings[valid]
+        self.northings = northings[valid]
+        self.cell_size = cell_size
+
+        cx = np.floor(self.eastings / cell_size).astype(np.int64)
+        cy = np.floor(self.northings / cell_size).astype(np.int64)
+        self.cells = dict()
+        for i, cell in enumerate(zip(cx.tolist(), cy.tolist())):
+            self.cells.setdefault(cell, []).append(i)
+        self.cells = {c: np.array(v, dtype=np.intp)
+                      for c, v in self.cells.items()}
+
+        if self.cells:
+            self.min_cell = (int(cx.min()), int(cy.min()))
+            self.max_cell = (int(cx.max()), int(cy.max()))
+
+    @classmethod
+    def from_database(cls, cur, cell_size=5000.0):
+        '''Load the station positions from msn.station_locations using a DB
+        API cursor'''
+
+        cur.execute(cls.sql)
+        rows = cur.fetchall()
+        return cls([x[0] for x in rows], [x[1] for x in rows],
+                   [x[2] for x in rows], cell_size)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _ring(self, cx, cy, r):
+        '''Return the indexes of the stations in the cells at a distance of r
+        cells from the cell (cx, cy), only looking at the cells within the
+        extent of the grid'''
+
+        (x0, y0), (x1, y1) = self.min_cell, self.max_cell
+        xs = range(max(cx - r, x0), min(cx + r, x1) + 1)
+        ys = range(max(cy - r + 1, y0), min(cy + r - 1, y1) + 1)
+        cells = []
+        for y in set((cy - r, cy + r)):
+            if y0 <= y <= y1:
+                cells.extend((x, y) for x in xs)
+        if r > 0:
+            for x in (cx - r, cx + r):
+                if x0 <= x <= x1:
+                    cells.extend((x, y) for y in ys)
+        found = [self.cells[c] for c in cells if c in self.cells]
+        if not found:
+            return np.empty(0, dtype=np.intp)
+        return np.concatenate(found)
+
+    def _result(self, indexes, distances):
+        order = np.argsort(distances, kind="stable")
+        return [(self.keys[indexes[i]], float(distances[i])) for i in order]
+
+    def within(self, easting, northing, radius):
+        '''Return (key, distance) tuples for the stations within radius
+        metres of a point, nearest first'''
+
+        if not self.cells:
+            return []
+
+        cx = int(np.floor(easting / self.cell_size))
+        cy = int(np.floor(northing / self.cell_size))
+        rings = int(np.ceil(radius / self.cell_size))
+        indexes = np.concatenate([self._ring(cx, cy, r)
+                                  for r in range(0, rings + 1)])
+        distances = np.hypot(self.eastings[indexes] - easting,
+                             self.northings[indexes] - northing)
+        keep = distances <= radius
+        return self._result(indexes[keep], distances[keep])
+
+    def nearest(self, easting, northing, k=10):
+        '''Return (key, distance) tuples for the k stations nearest to a
+        point, nearest first'''
+
+        if not self.cells:
+            return []
+
+        cx = int(np.floor(easting / self.cell_size))
+        cy = int(np.floor(northing / self.cell_size))
+        # The nearest and furthest rings that can contain any stations
+        (x0, y0), (x1, y1) = self.min_cell, self.max_cell
+        first = max(0, x0 - cx, cx - x1, y0 - cy, cy - y1)
+        last = max(abs(cx - x0), abs(cx - x1), abs(cy - y0), abs(cy - y1))
+
+        # Every station in a cell outside ring r is at least r cells away from
+        # the point, so the search can stop once k stations have been found
+        # that are no further away than that.
+        indexes = np.empty(0, dtype=np.intp)
+        distances = np.empty(0, dtype=np.float64)
+        for r in range(first, last + 1):
+            found = self._ring(cx, cy, r)
+            if len(found):
+                indexes = np.concatenate((indexes, found))
+                distances = np.concatenate((
+                    distances, np.hypot(self.eastings[found] - easting,
+                                        self.northings[found] - northing)))
+            if len(indexes) >= k and \
+                    np.partition(distances, k - 1)[k - 1] <= r * self.cell_size:
+                break
+
+        result = self._result(indexes, distances)
+        return result[:k]
@@ -0,0 +1,126 @@
+# nrcif/routing/stations.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''stations - Look up stations by name
+
+The StationIndex class finds the stations with a name containing a word that
+starts with the given text, ranked in the same way as msn.search_stations.
+The names are normalised as in msn.normalise_name and every word of every name
+is held in a sorted list, so a search is a binary search followed by a scan of
+the matching words.'''
+
+import bisect
+import heapq
+import re
+
+
+def normalise_name(name):
+    '''Return a station name in upper case with apostrophes removed and any
+    other punctuation or runs of spaces replaced by a single space'''
+
+    return re.sub("[^A-Z0-9]+", " ", name.upper().replace("'", "")).strip()
+
+
+def cate_rank(cate_type):
+    '''Return the rank of a CATE interchange type, highest first, with the
+    subsidiary TIPLOCs (type 9) and unknown types last'''
+
+    if cate_type is None or cate_type == 9:
+        return -1
+    return cate_type
+
+
+class StationIndex(object):
+    '''An in-memory index of station names'''
+
+    sql = '''SELECT station_name, tiploc_code, cate_type
+        FROM msn.station_names;'''
+
+    def __init__(self, names):
+        '''names is a sequence of (station name, TIPLOC, CATE type) tuples,
+        with more than one name allowed for each TIPLOC'''
+
+        self.names = []
+        self.tiplocs = []
+        self.cate_types = []
+        self.ranks = []
+        words = []
+
+        for name, tiploc, cate_type in names:
+            key = normalise_name(name)
+            if not key:
+                continue
+            i = len(self.names)
+            self.names.append(name.strip())
+            self.tiplocs.append(tiploc)
+            self.cate_types.append(cate_type)
+            self.ranks.append(cate_rank(cate_type))
+            # Each word is indexed with the rest of the name after it, so that
+            # text spanning more than one word can be found.
+            for m in re.finditer(" ", key):
+                words.append((key[m.end():], i, False))
+            words.append((key, i, True))
+
+        words.sort()
+        self.words = [x[0] for x in words]
+        self.word_name = [x[1] for x in words]
+        self.word_start = [x[2] for x in words]
+
+    @classmethod
+    def from_database(cls, cur):
+        '''Load the station names from msn.station_names using a DB API
+        cursor'''
+
+        cur.execute(cls.sql)
+        return cls(cur.fetchall())
+
+    def __len__(self):
+        return len(self.names)
+
+    def search(self, text, k=10):
+        '''Return up to k (TIPLOC, station name, CATE type) tuples for the
+        stations with a name containing a word starting with the text. The
+        largest interchanges come first, and then names that start with the
+        text.'''
+
+        key = normalise_name(text)
+        if not key:
+            return []
+
+        best = dict()
+        i = bisect.bisect_left(self.words, key)
+        while i < len(self.words) and self.words[i].startswith(key):
+            n = self.word_name[i]
+            order = (-self.ranks[n], not self.word_start[i],
+                     len(self.names[n]), self.names[n])
+            tiploc = self.tiplocs[n]
+            if tiploc not in best or order < best[tiploc][0]:
+                best[tiploc] = (order, n)
+            i += 1
+
+        return [(self.tiplocs[n], self.names[n], self.cate_types[n])
+                for order, n in heapq.nsmallest(k, best.values())]
+
+    def find(self, text):
+        '''Return the TIPLOC of the best match for the text, or None if there
+        is no match'''
+
+        result = self.search(text, 1)
+        return result[0][0] if result else None
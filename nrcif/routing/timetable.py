@@ -0,0 +1,252 @@
+# nrcif/routing/timetable.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''timetable - A day's timetable held in memory as arrays
+
+The Timetable class holds the elementary connections stored for a date in
+util.connections, sorted by departure time, together with the station details
+and the fixed links that apply on the date. The operator of each train is
+kept so that the TOC specific interchange times from msn.interchange can be
+used when changing trains, and the National Grid positions of the stations are
+held in a StationGrid so the stations near a point can be found quickly. The
+locations are numbered from 0 and all the per-location and per-connection
+data is held in NumPy arrays, so the whole timetable for a day takes a few
+tens of megabytes and can be shared between forked worker processes. A
+fingerprint of the contents identifies results that were computed from the
+same timetable.'''
+
+import hashlib
+
+import numpy as np
+
+from nrcif.fields import time_to_minutes
+from nrcif.routing.spatial import StationGrid
+from nrcif.routing.stations import StationIndex
+from nrcif.routing.transfers import TransferTimes
+
+
+class Timetable(object):
+    '''The connections, stations and fixed links for a single date'''
+
+    stations_sql = '''SELECT sd.tiploc_code, sd.station_name,
+        sd._3_alpha_code, sd.cate_type, sd.change_time, sd.latitude,
+        sd.longitude, sl.position[0], sl.position[1]
+        FROM msn.station_detail AS sd
+            LEFT JOIN msn.station_locations AS sl USING (tiploc_code)
+        ORDER BY sd.tiploc_code;'''
+
+    connections_sql = '''SELECT train_uid, xmidnight, from_location,
+        departure_min, to_location, arrival_min, toc
+        FROM util.connections
+        WHERE timetable_date = %s
+        ORDER BY departure_min;'''
+
+    # The fixed links are read from alf.links, where they have already been
+    # made symmetrical. Where more than one link between the same places
+    # applies on the date, the longest is used, as in
+    # alf.get_direct_connections.
+    links_sql = '''SELECT from_tiploc, to_tiploc, mode, start_time,
+        end_time, MAX(link_time)
+        FROM alf.links
+        WHERE days_mask & %s <> 0 AND valid_dates @> %s
+        GROUP BY 1, 2, 3, 4, 5;'''
+
+    def __init__(self, timetable_date, stations, connections, links,
+                 transfers=None, names=None):
+        '''stations is a sequence of (TIPLOC, name, 3-alpha code, CATE type,
+        change time, latitude, longitude, easting, northing) tuples, with the
+        easting and northing in metres, connections a sequence of
+        (train UID, xmidnight, from TIPLOC, departure minute, to TIPLOC,
+        arrival minute, TOC) tuples sorted by departure and links a sequence
+        of (from TIPLOC, to TIPLOC, mode, start minute, end minute, link
+        minutes) tuples. transfers is an optional TransferTimes object giving
+        the TOC specific interchange times. names is an optional sequence of
+        (station name, TIPLOC, CATE type) tuples giving every name the
+        stations are known by, as in msn.station_names. If it is not given
+        the stations are found by the names in stations alone.'''
+
+        self.date = timetable_date
+
+        self.locations = []
+        self.index = dict()
+        self.names = []
+        self.crs = []
+        cate = []
+        change = []
+        latitude = []
+        longitude = []
+        easting = []
+        northing = []
+
+        def add_location(tiploc, name=None, crs=None, cate_type=None,
+                         change_time=None, lat=None, lon=None, e=None,
+                         n=None):
+            self.index[tiploc] = len(self.locations)
+            self.locations.append(tiploc)
+            self.names.append(name.strip() if name else tiploc.strip())
+            self.crs.append(crs)
+            cate.append(cate_type if cate_type is not None else -1)
+            change.append(change_time or 0)
+            latitude.append(lat if lat is not None else np.nan)
+            longitude.append(lon if lon is not None else np.nan)
+            easting.append(e if e is not None else np.nan)
+            northing.append(n if n is not None else np.nan)
+
+        stations = list(stations)
+        for row in stations:
+            add_location(*row)
+        if names is None:
+            names = [(name, tiploc, cate_type)
+                     for tiploc, name, crs, cate_type, *others in stations
+                     if name]
+        self.station_index = StationIndex(x for x in names
+                                          if x[1] in self.index)
+
+        trips = dict()
+        self.trip_uid = []
+        self.trip_toc = []
+        trip = []
+        from_id = []
+        to_id = []
+        departure = []
+        arrival = []
+
+        for uid, xmidnight, from_loc, dep, to_loc, arr, toc in connections:
+            for loc in (from_loc, to_loc):
+                if loc not in self.index:
+                    add_location(loc)
+            if (uid, xmidnight) not in trips:
+                trips[(uid, xmidnight)] = len(self.trip_uid)
+                self.trip_uid.append(uid)
+                self.trip_toc.append(toc)
+            trip.append(trips[(uid, xmidnight)])
+            from_id.append(self.index[from_loc])
+            to_id.append(self.index[to_loc])
+            departure.append(dep)
+            arrival.append(arr)
+
+        self.cate_type = np.array(cate, dtype=np.int8)
+        self.change = np.array(change, dtype=np.int32)
+        self.latitude = np.array(latitude, dtype=np.float64)
+        self.longitude = np.array(longitude, dtype=np.float64)
+        self.easting = np.array(easting, dtype=np.float64)
+        self.northing = np.array(northing, dtype=np.float64)
+        self.station_grid = StationGrid(range(len(self.locations)),
+                                        self.easting, self.northing)
+
+        self.trip = np.array(trip, dtype=np.int32)
+        self.from_id = np.array(from_id, dtype=np.int32)
+        self.to_id = np.array(to_id, dtype=np.int32)
+        self.departure = np.array(departure, dtype=np.int32)
+        self.arrival = np.array(arrival, dtype=np.int32)
+
+        # The links are sorted by origin, so the links from location i are
+        # those from link_offsets[i] to link_offsets[i+1].
+        links = sorted((self.index[f], self.index[t], mode, start, end,
+                        minutes)
+                       for f, t, mode, start, end, minutes in links
+                       if f in self.index and t in self.index)
+        link_from = np.array([x[0] for x in links], dtype=np.int32)
+        self.link_offsets = np.searchsorted(link_from,
+                                            np.arange(len(self.locations) + 1))
+        self.link_to = np.array([x[1] for x in links], dtype=np.int32)
+        self.link_mode = [x[2] for x in links]
+        self.link_start = np.array([x[3] for x in links], dtype=np.int32)
+        self.link_end = np.array([x[4] for x in links], dtype=np.int32)
+        self.link_minutes = np.array([x[5] for x in links], dtype=np.int32)
+
+        # The TOC specific interchange times are keyed by (location id,
+        # arriving TOC, departing TOC). The standard times are in change.
+        self.toc_change = dict()
+        if transfers is not None:
+            for (tiploc, arriving, departing), minutes in \
+                    transfers.toc_specific().items():
+                if tiploc in self.index:
+                    self.toc_change[(self.index[tiploc], arriving,
+                                     departing)] = minutes
+        self.toc_change_at = frozenset(x[0] for x in self.toc_change)
+
+        digest = hashlib.sha1(self.date.isoformat().encode("UTF-8"))
+        for x in (self.locations, self.trip_uid, self.trip_toc,
+                  self.link_mode, sorted(self.toc_change.items())):
+            digest.update(repr(x).encode("UTF-8"))
+        for x in (self.change, self.latitude, self.longitude, self.easting,
+                  self.northing, self.trip, self.from_id, self.to_id,
+                  self.departure, self.arrival, self.link_offsets,
+                  self.link_to, self.link_start, self.link_end,
+                  self.link_minutes):
+            digest.update(x.tobytes())
+        self.fingerprint = digest.hexdigest()
+
+    @classmethod
+    def from_database(cls, cur, timetable_date):
+        '''Load the timetable for a date using a DB API cursor. The
+        connections for the date must already have been stored by
+        util.refresh_connections.'''
+
+        cur.execute(cls.stations_sql)
+        stations = cur.fetchall()
+
+        cur.execute(cls.connections_sql, (timetable_date,))
+        connections = cur.fetchall()
+        if not connections:
+            raise ValueError("No connections have been stored for {}"
+                             .format(timetable_date))
+
+        cur.execute(cls.links_sql, (1 << (timetable_date.isoweekday() - 1),
+                                    timetable_date))
+        links = [(f, t, mode, time_to_minutes(start), time_to_minutes(end),
+                  minutes)
+                 for f, t, mode, start, end, minutes in cur.fetchall()]
+
+        transfers = TransferTimes.from_database(cur)
+
+        # The aliases and NaPTAN names are used when the station names have
+        # been indexed by msn.refresh_station_names
+        names = None
+        cur.execute("SELECT to_regclass('msn.station_names');")
+        if cur.fetchone()[0] is not None:
+            cur.execute(StationIndex.sql)
+            names = cur.fetchall() or None
+
+        return cls(timetable_date, stations, connections, links, transfers,
+                   names)
+
+    def __len__(self):
+        return len(self.departure)
+
+    def find_station(self, text):
+        '''Return the location id for a TIPLOC code, a 3-alpha code or the
+        start of a word in a station name, or None if there is no match'''
+
+        text = text.strip().upper()
+        tiploc = text.ljust(7)
+        if tiploc in self.index:
+            return self.index[tiploc]
+        if len(text) == 3 and text in self.crs:
+            return self.crs.index(text)
+        tiploc = self.station_index.find(text)
+        return None if tiploc is None else self.index[tiploc]
+
+    def links_from(self, location_id):
+        '''Return the range of indexes of the links from a location'''
+
+        return range(self.link_offsets[location_id],
+                     self.link_offsets[location_id + 1])
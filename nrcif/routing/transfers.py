@@ -0,0 +1,75 @@
+# nrcif/routing/transfers.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''transfers - Minimum connection times between train operators
+
+The TransferTimes class holds the contents of the msn.interchange table, which
+combines the standard interchange time of each station from the MSN data with
+the TOC specific interchange times from the TSI data, in a dict so that the
+time for a change between two trains can be found without a query.'''
+
+# Used in msn.interchange for the standard interchange time of a station
+ANY_TOC = "**"
+
+
+class TransferTimes(object):
+    '''The minimum connection time at each station, keyed by (TIPLOC,
+    arriving TOC, departing TOC)'''
+
+    sql = '''SELECT tiploc_code, arriving_toc, departing_toc, change_time
+        FROM msn.interchange;'''
+
+    def __init__(self, rows=()):
+        '''rows is a sequence of (TIPLOC, arriving TOC, departing TOC, change
+        time) tuples, as in msn.interchange'''
+
+        self.times = {(tiploc, arriving, departing): minutes
+                      for tiploc, arriving, departing, minutes in rows}
+
+    @classmethod
+    def from_database(cls, cur):
+        '''Load the transfer times using a DB API cursor. If msn.interchange
+        has not been created, no transfer times are loaded.'''
+
+        cur.execute("SELECT to_regclass('msn.interchange');")
+        if cur.fetchone()[0] is None:
+            return cls()
+        cur.execute(cls.sql)
+        return cls(cur.fetchall())
+
+    def __len__(self):
+        return len(self.times)
+
+    def get(self, station, arriving_toc, departing_toc):
+        '''Return the minimum connection time in minutes at a station between
+        trains of the given operators, falling back to the standard time for
+        the station and then to no time at all'''
+
+        result = self.times.get((station, arriving_toc, departing_toc))
+        if result is None:
+            result = self.times.get((station, ANY_TOC, ANY_TOC), 0)
+        return result
+
+    def toc_specific(self):
+        '''Return the TOC specific times, leaving out the standard times for
+        each station'''
+
+        return {k: v for k, v in self.times.items()
+                if k[1] != ANY_TOC or k[2] != ANY_TOC}
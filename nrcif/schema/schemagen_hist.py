@@ -0,0 +1,151 @@
+# schemagen_hist.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''Generate SQL that will create a suitable schema for an archive of the
+main timetable data from a series of ATOC TTIS releases, in which each
+schedule is stored only once however many releases it appears in. This is
+done dynamically to ensure it keeps in sync with the definitions in nrcif.py
+and nrcif_fields.py'''
+
+from ..records import layouts
+
+
+def gen_sql(DDL, CONS):
+
+    SCHEMA = "hist"
+
+    DDL.write('-- SQL DDL for an archive of data extracted from ATOC .MCA\n'
+              '-- timetable files in NR CIF format. Auto-generated by\n'
+              '-- schemagen_hist.py\n\n')
+
+    CONS.write('-- SQL constraints & indexes definitions for an archive of\n'
+               '-- data extracted from ATOC .MCA timetable files in NR CIF\n'
+               '-- format. Auto-generated by schemagen_hist.py\n\n')
+
+    DDL.write("CREATE SCHEMA {0};\nSET search_path TO {0},public;\n\n"
+              .format(SCHEMA))
+    CONS.write("SET search_path TO {0},public;\n\n".format(SCHEMA))
+
+    DDL.write('''-- Each release loaded into the archive, with its period
+CREATE TABLE release (
+\trelease_id\t\tINTEGER,
+\trelease_name\tVARCHAR,
+\tloaded\t\t\tTIMESTAMP,
+\tperiod_start\tDATE,
+\tperiod_end\t\tDATE
+\t);
+
+-- Each distinct schedule block (the BS, BX and TN records of a schedule and
+-- its locations) is stored once, identified by the SHA-1 hash of its text
+CREATE TABLE schedule_block (
+\tblock_id\t\tINTEGER,
+\tblock_hash\t\tCHAR(40),
+\ttrain_uid\t\tCHAR(6),
+\tdate_runs_from\tDATE,
+\tstp_indicator\tCHAR(1)
+\t);
+
+-- The schedule blocks that make up each release
+CREATE TABLE release_block (
+\trelease_id\t\tINTEGER,
+\tblock_id\t\tINTEGER
+\t);
+
+''')
+
+    CONS.write('''ALTER TABLE release ADD PRIMARY KEY (release_id);
+ALTER TABLE release ADD UNIQUE (release_name);
+
+ALTER TABLE schedule_block ADD PRIMARY KEY (block_id);
+ALTER TABLE schedule_block ADD UNIQUE (block_hash);
+CREATE INDEX idx_schedule_block_schedule ON schedule_block (train_uid,
+    date_runs_from, stp_indicator);
+
+ALTER TABLE release_block ADD PRIMARY KEY (release_id, block_id);
+CREATE INDEX idx_release_block_block ON release_block (block_id);
+
+''')
+
+    # The remaining tables are laid out as in the mca schema, with the block
+    # or release that each row belongs to added at the start
+    DDL.write('-- The BS, BX and TN records are stored in the same table. '
+              'The day bitmaps\n-- depend on the timetable period so are '
+              'only built when a release is\n-- materialised.\n')
+    DDL.write("CREATE TABLE basic_schedule (\n")
+    DDL.write("\tblock_id\t\tINTEGER,\n")
+
+    DDL.write(layouts['BS'].generate_sql_ddl()+",\n")
+    DDL.write(layouts['BX'].generate_sql_ddl()+",\n")
+    DDL.write(layouts['TN'].generate_sql_ddl()+",\n")
+    DDL.write("\tdays_bitmap\t\tBIT VARYING")
+
+    DDL.write("\n\t);\n\n")
+
+    CONS.write("CREATE INDEX idx_basic_schedule_block ON basic_schedule "
+               "(block_id);\n")
+
+    DDL.write('''-- The LO, LI, CR, LT and LN tables all have a header added to
+-- relate them to the relevant block and train\n''')
+
+    route_template = '''CREATE TABLE {} (
+\tblock_id\t\tINTEGER,
+\ttrain_uid\t\tCHAR(6),
+\tdate_runs_from\tDATE,
+\tstp_indicator\tCHAR(1),
+\tloc_order\t\tINTEGER,
+\txmidnight\t\tBOOLEAN,
+'''
+    route_index = ("CREATE INDEX idx_{0}_block ON {0} "
+                   "(block_id, loc_order);\n")
+
+    # The LO, LI and LT tables also have the times in minutes after the
+    # midnight at the start of the train's journey
+    minutes_columns = ''',
+\tarrival_min\t\tINTEGER,
+\tdeparture_min\tINTEGER,
+\tpass_min\t\tINTEGER'''
+
+    for i in ('LO', 'LI', 'CR', 'LT', 'LN'):
+        tablename = layouts[i].name.lower().replace(" ", "_")
+        DDL.write(route_template.format(tablename))
+        DDL.write(layouts[i].generate_sql_ddl())
+        if i in ('LO', 'LI', 'LT'):
+            DDL.write(minutes_columns)
+        DDL.write("\n\t);\n\n")
+        CONS.write(route_index.format(tablename))
+
+    DDL.write('-- The associations and TIPLOC records are stored for each '
+              'release\n')
+
+    normal_template = "CREATE TABLE {} (\n\trelease_id\t\tINTEGER,\n"
+    release_index = "CREATE INDEX idx_{0}_release ON {0} (release_id);\n"
+
+    for i in ('AA', 'TI', 'TA', 'TD'):
+        tablename = layouts[i].name.lower().replace(" ", "_")
+        DDL.write(normal_template.format(tablename))
+        DDL.write(layouts[i].generate_sql_ddl())
+        DDL.write("\n\t);\n\n")
+        CONS.write(release_index.format(tablename))
+
+    CONS.write("\n")
+
+    DDL.write('''SET search_path TO "$user",public;\n\n''')
+    CONS.write('''SET search_path TO "$user",public;\n\n''')
@@ -23,12 +23,134 @@ from ATOC .MCA timetable files. This is done dynamically to ensure it
 keeps in sync with the definitions in nrcif.py and nrcif_fields.py'''
 
 from ..records import layouts
+from ..mca_reader import MCA
 
 
-def gen_sql(DDL, CONS):
+# In the stopping pattern layout the scheduled times are stored as
+# half-minutes and the public times as minutes after midnight, so the
+# location views have to convert them back into times.
+pattern_columns = {
+    "scheduled_arrival": "'00:00'::time + l.arrival_hm * interval '30s'",
+    "scheduled_departure": "'00:00'::time + l.departure_hm * interval '30s'",
+    "scheduled_pass": "'00:00'::time + l.pass_hm * interval '30s'",
+    "public_arrival": "'00:00'::time + l.public_arrival * interval '1m'",
+    "public_departure": "'00:00'::time + l.public_departure * interval '1m'",
+    "activity": "ARRAY[substr(l.activity, 1, 2), substr(l.activity, 3, 2),\n"
+                "\t\tsubstr(l.activity, 5, 2), substr(l.activity, 7, 2),\n"
+                "\t\tsubstr(l.activity, 9, 2), substr(l.activity, 11, 2)"
+                "]::CHAR(2)[]"
+    }
+
+pattern_filters = {
+    "LO": "l.n = 1",
+    "LI": "l.n > 1 AND l.n < cardinality(p.locations)",
+    "LT": "l.n = cardinality(p.locations)"
+    }
+
+
+def gen_stopping_pattern_sql(DDL, CONS):
+    '''Generate the normalised layout for the LO, LI and LT records, with
+    views that present the data in the same form as the usual tables.'''
+
+    DDL.write('''-- Each distinct sequence of locations is stored only once
+CREATE TABLE stopping_pattern (
+\tpattern_id\t\tINTEGER,
+\tlocations\t\tCHAR(7)[],
+\tlocation_suffixes\tCHAR(1)[]
+\t);
+
+-- The details of each location of a schedule are stored in arrays in the
+-- same order as the locations of its stopping pattern. Scheduled times are
+-- given in half-minutes and public times in minutes after midnight at the
+-- start of the train's journey or day respectively.
+CREATE TABLE schedule_location (
+\ttrain_uid\t\tCHAR(6),
+\tdate_runs_from\tDATE,
+\tstp_indicator\tCHAR(1),
+\tpattern_id\t\tINTEGER,
+\tarrival_hm\t\tSMALLINT[],
+\tdeparture_hm\tSMALLINT[],
+\tpass_hm\t\t\tSMALLINT[],
+\tpublic_arrival\tSMALLINT[],
+\tpublic_departure\tSMALLINT[],
+\tplatform\t\tCHAR(3)[],
+\tline\t\t\tCHAR(3)[],
+\t_path\t\t\tCHAR(3)[],
+\tactivity\t\tCHAR(12)[],
+\tengineering_allowance\tCHAR(2)[],
+\tpathing_allowance\tCHAR(2)[],
+\tperformance_allowance\tCHAR(2)[]
+\t);
+
+''')
+
+    view_template = '''CREATE VIEW {0} AS
+SELECT s.train_uid, s.date_runs_from, s.stp_indicator,
+\t(l.n - 1)::integer AS loc_order,
+\tCOALESCE(l.arrival_hm, l.departure_hm, l.pass_hm) >= 2880 AS xmidnight,
+{1},
+\t(l.arrival_hm + 1) / 2 AS arrival_min,
+\tl.departure_hm / 2 AS departure_min,
+\tl.pass_hm / 2 AS pass_min
+FROM schedule_location AS s
+\tINNER JOIN stopping_pattern AS p USING (pattern_id)
+\tCROSS JOIN LATERAL unnest(p.locations, p.location_suffixes,
+\t\ts.arrival_hm, s.departure_hm, s.pass_hm,
+\t\ts.public_arrival, s.public_departure,
+\t\ts.platform, s.line, s._path, s.activity,
+\t\ts.engineering_allowance, s.pathing_allowance,
+\t\ts.performance_allowance)
+\tWITH ORDINALITY AS l(location, location_suffix,
+\t\tarrival_hm, departure_hm, pass_hm,
+\t\tpublic_arrival, public_departure,
+\t\tplatform, line, _path, activity,
+\t\tengineering_allowance, pathing_allowance,
+\t\tperformance_allowance, n)
+WHERE {2};
+
+'''
+
+    for i in ('LO', 'LI', 'LT'):
+        viewname = layouts[i].name.lower().replace(" ", "_")
+        columns = []
+        for field in layouts[i].fields:
+            if field.sql_type:
+                name = field.name.replace(" ", "_").replace("-", "_").lower()
+                if name in pattern_columns:
+                    columns.append("\t{} AS {}".format(pattern_columns[name],
+                                                       name))
+                else:
+                    columns.append("\tl." + name)
+        DDL.write(view_template.format(viewname, ",\n".join(columns),
+                                       pattern_filters[i]))
+
+    CONS.write('''
+ALTER TABLE stopping_pattern ADD PRIMARY KEY (pattern_id);
+
+ALTER TABLE schedule_location ADD PRIMARY KEY (train_uid, date_runs_from,
+                                               stp_indicator);
+
+ALTER TABLE schedule_location ADD FOREIGN KEY (train_uid, date_runs_from,
+                                               stp_indicator)
+REFERENCES basic_schedule (train_uid, date_runs_from,
+                           stp_indicator) DEFERRABLE;
+
+ALTER TABLE schedule_location ADD FOREIGN KEY (pattern_id)
+REFERENCES stopping_pattern (pattern_id) DEFERRABLE;
+
+CREATE INDEX idx_schedule_location_pattern ON schedule_location (pattern_id);
+
+''')
+
+
+def gen_sql(DDL, CONS, stopping_patterns=False, projection=None):
 
     SCHEMA = "mca"
 
+    # The tables of record types left out by a projection are not created,
+    # and the fields it leaves out have no columns
+    layouts, skipped = MCA.project_layouts(projection, stopping_patterns)
+
     DDL.write('-- SQL DDL for data extracted from ATOC .MCA timetable files\n'
               '-- in NR CIF format. Auto-generated by schemagen_mca.py\n\n')
 
@@ -43,14 +165,35 @@ def gen_sql(DDL, CONS):
     DDL.write('-- The BS, BX and TN records are stored in the same table\n')
     DDL.write("CREATE TABLE basic_schedule (\n")
 
-    DDL.write(layouts['BS'].generate_sql_ddl()+",\n")
-    DDL.write(layouts['BX'].generate_sql_ddl()+",\n")
-    DDL.write(layouts['TN'].generate_sql_ddl())
+    columns = [layouts[i].generate_sql_ddl() for i in ('BS', 'BX', 'TN')]
+    columns.append("\tdays_bitmap\t\tBIT VARYING")
+    DDL.write(",\n".join(x for x in columns if x))
 
     DDL.write("\n\t);\n\n")
 
+    DDL.write('''-- The period covered by the day bitmaps in basic_schedule
+CREATE TABLE calendar_period (
+\tperiod_start\tDATE,
+\tperiod_end\t\tDATE
+\t);
+
+''')
+
+    DDL.write('''-- The effective schedule is derived from the basic schedule
+CREATE TABLE effective_schedule (
+\ttrain_uid\t\tCHAR(6),
+\tdate_runs_from\tDATE,
+\tstp_indicator\tCHAR(1),
+\tday_of_week\t\tSMALLINT,
+\tvalid_dates\t\tDATERANGE
+\t);
+
+''')
+
     CONS.write("ALTER TABLE basic_schedule ADD PRIMARY KEY(train_uid, "
                "date_runs_from, stp_indicator);\n")
+    CONS.write("CREATE INDEX idx_effective_schedule ON effective_schedule "
+               "USING GIST (valid_dates);\n")
 
     DDL.write('''-- The LO, LI, CR, LT and LN tables all have a header added to relate
 -- them to the relevant train\n''')
@@ -71,17 +214,38 @@ REFERENCES basic_schedule (train_uid, date_runs_from,
                            stp_indicator) DEFERRABLE;
 '''
 
-    for i in ('LO', 'LI', 'CR', 'LT', 'LN'):
+    # The LO, LI and LT tables also have the times in minutes after the
+    # midnight at the start of the train's journey
+    minutes_columns = ''',
+\tarrival_min\t\tINTEGER,
+\tdeparture_min\tINTEGER,
+\tpass_min\t\tINTEGER'''
+
+    if stopping_patterns:
+        route_types = ('CR', 'LN')
+    else:
+        route_types = ('LO', 'LI', 'CR', 'LT', 'LN')
+
+    for i in route_types:
+        if i in skipped:
+            continue
         tablename = layouts[i].name.lower().replace(" ", "_")
         DDL.write(route_template.format(tablename))
         DDL.write(layouts[i].generate_sql_ddl())
+        if i in ('LO', 'LI', 'LT'):
+            DDL.write(minutes_columns)
         DDL.write("\n\t);\n\n")
         CONS.write(route_pk.format(tablename))
 
+    if stopping_patterns:
+        gen_stopping_pattern_sql(DDL, CONS)
+
     normal_template = "CREATE TABLE {} (\n"
     tiploc_pk = "ALTER TABLE {} ADD PRIMARY KEY (tiploc_code);\n\n"
 
     for i in ('AA', 'TI', 'TA', 'TD'):
+        if i in skipped:
+            continue
         tablename = layouts[i].name.lower().replace(" ", "_")
         DDL.write(normal_template.format(tablename))
         DDL.write(layouts[i].generate_sql_ddl())
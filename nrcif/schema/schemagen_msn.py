@@ -46,6 +46,9 @@ def gen_sql(DDL, CONS):
         tablename = layouts[i].name.lower().replace(" ", "_")
         DDL.write(normal_template.format(tablename))
         DDL.write(layouts[i].generate_sql_ddl())
+        if i == 'A':
+            DDL.write(",\n\tlatitude\t\tDOUBLE PRECISION"
+                      ",\n\tlongitude\t\tDOUBLE PRECISION")
         DDL.write("\n\t);\n\n")
 
     CONS.write('ALTER TABLE station_detail ADD PRIMARY KEY(tiploc_code);\n')
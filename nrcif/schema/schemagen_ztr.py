@@ -23,18 +23,16 @@ from ATOC .ZTR timetable files. This is done dynamically to ensure it
 keeps in sync with the definitions in nrcif.py, ztr_reader.py and
 nrcif_fields.py'''
 
-from ..records import layouts as mca_layouts
+from ..ztr_reader import ZTR
 
-from ..ztr_reader import reduced_hd, corrected_bx
 
-
-def gen_sql(DDL, CONS):
+def gen_sql(DDL, CONS, projection=None):
 
     SCHEMA = "ztr"
 
-    layouts = mca_layouts.copy()
-    layouts["HD"] = reduced_hd
-    layouts["BX"] = corrected_bx
+    # The tables of record types left out by a projection are not created,
+    # and the fields it leaves out have no columns
+    layouts, skipped = ZTR.project_layouts(projection)
 
     DDL.write('''-- SQL DDL for data extracted from ATOC .ZTR timetable files in
 -- NR CIF format. Auto-generated by schemagen_ztr.py\n\n''')
@@ -50,16 +48,37 @@ def gen_sql(DDL, CONS):
     DDL.write("-- The BS, BX and TN records are stored in the same table\n")
     DDL.write("CREATE TABLE basic_schedule (\n")
 
-    DDL.write(layouts['BS'].generate_sql_ddl()+",\n")
-    DDL.write(layouts['BX'].generate_sql_ddl()+",\n")
-    DDL.write(layouts['TN'].generate_sql_ddl())
+    columns = [layouts[i].generate_sql_ddl() for i in ('BS', 'BX', 'TN')]
+    columns.append("\tdays_bitmap\t\tBIT VARYING")
+    DDL.write(",\n".join(x for x in columns if x))
 
     DDL.write("\n\t);\n\n")
 
+    DDL.write('''-- The period covered by the day bitmaps in basic_schedule
+CREATE TABLE calendar_period (
+\tperiod_start\tDATE,
+\tperiod_end\t\tDATE
+\t);
+
+''')
+
+    DDL.write('''-- The effective schedule is derived from the basic schedule
+CREATE TABLE effective_schedule (
+\ttrain_uid\t\tCHAR(6),
+\tdate_runs_from\tDATE,
+\tstp_indicator\tCHAR(1),
+\tday_of_week\t\tSMALLINT,
+\tvalid_dates\t\tDATERANGE
+\t);
+
+''')
+
     CONS.write("-- ***The Z-Trains data appears to contain duplicates, "
                "so primary keys cannot be used***\n\n")
     CONS.write("CREATE INDEX idx_ztr_basic_schedule ON basic_schedule "
                "(train_uid, date_runs_from, stp_indicator);\n")
+    CONS.write("CREATE INDEX idx_ztr_effective_schedule ON effective_schedule "
+               "USING GIST (valid_dates);\n")
 
     DDL.write('''-- The LO, LI, CR, LT and LN tables all have a header added to relate
 -- them to the relevant train\n''')
@@ -81,10 +100,21 @@ CREATE INDEX idx_ztr_{0} ON ztr.{0} (train_uid, date_runs_from,
 
 '''
 
+    # The LO, LI and LT tables also have the times in minutes after the
+    # midnight at the start of the train's journey
+    minutes_columns = ''',
+\tarrival_min\t\tINTEGER,
+\tdeparture_min\tINTEGER,
+\tpass_min\t\tINTEGER'''
+
     for i in ('LO', 'LI', 'CR', 'LT', 'LN'):
+        if i in skipped:
+            continue
         tablename = layouts[i].name.lower().replace(" ", "_")
         DDL.write(route_template.format(tablename))
         DDL.write(layouts[i].generate_sql_ddl())
+        if i in ('LO', 'LI', 'LT'):
+            DDL.write(minutes_columns)
         DDL.write("\n\t);\n\n")
         CONS.write(route_pk.format(tablename))
 
@@ -92,6 +122,8 @@ CREATE INDEX idx_ztr_{0} ON ztr.{0} (train_uid, date_runs_from,
     tiploc_pk = "ALTER TABLE {} ADD PRIMARY KEY (tiploc_code);\n\n"
 
     for i in ('AA', 'TI', 'TA', 'TD'):
+        if i in skipped:
+            continue
         tablename = layouts[i].name.lower().replace(" ", "_")
         DDL.write(normal_template.format(tablename))
         DDL.write(layouts[i].generate_sql_ddl())
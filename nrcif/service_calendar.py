@@ -0,0 +1,252 @@
+# service_calendar.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+'''service_calendar - Day bitmaps giving the dates on which schedules run
+
+The dates on which a basic schedule runs are given by the Date Runs From,
+Date Runs To, Days Run and Bank Holiday Running fields. This module expands
+them into a bitmap with one bit for each day of the timetable period, where
+bit i represents the i'th day after the start of the period. The bitmaps are
+held as Python integers while loading and are stored in the database as a
+BIT VARYING column, where the first (leftmost) bit is day 0.
+
+Only the England & Wales bank holiday Mondays are used for the Bank Holiday
+Running field, so schedules marked as not running on the Edinburgh or Glasgow
+bank holidays are treated as running on all their normal days.'''
+
+import datetime
+
+import numpy as np
+
+# Timetable periods are never more than a year or so, but some files give
+# the end date as 999999, so the period is limited to avoid huge bitmaps.
+MAX_PERIOD = datetime.timedelta(days=731)
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def easter_sunday(year):
+    '''Return the date of Easter Sunday using the anonymous Gregorian
+    algorithm'''
+
+    a = year % 19
+    b, c = divmod(year, 100)
+    d, e = divmod(b, 4)
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = divmod(c, 4)
+    L = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * L) // 451
+    month, day = divmod(h + L - 7 * m + 114, 31)
+    return datetime.date(year, month, day + 1)
+
+
+def _first_monday(year, month):
+    d = datetime.date(year, month, 1)
+    return d + datetime.timedelta(days=(7 - d.weekday()) % 7)
+
+
+def _last_monday(year, month):
+    if month == 12:
+        d = datetime.date(year, 12, 31)
+    else:
+        d = datetime.date(year, month + 1, 1) - ONE_DAY
+    return d - datetime.timedelta(days=d.weekday())
+
+
+def bank_holiday_mondays(year):
+    '''Return the set of England & Wales bank holidays in the year that fall
+    on a Monday, including any substitute days for holidays that fall at the
+    weekend'''
+
+    result = set((easter_sunday(year) + datetime.timedelta(days=1),
+                  _first_monday(year, 5),
+                  _last_monday(year, 5),
+                  _last_monday(year, 8)))
+
+    # New Year's Day, or the substitute day if it falls at the weekend
+    new_year = datetime.date(year, 1, 1)
+    if new_year.weekday() >= 5:
+        new_year = _first_monday(year, 1)
+    result.add(new_year)
+
+    # Christmas Day and Boxing Day, or the substitute days
+    christmas = datetime.date(year, 12, 25)
+    if christmas.weekday() == 5:
+        result.add(datetime.date(year, 12, 27))
+    elif christmas.weekday() == 6:
+        result.add(datetime.date(year, 12, 26))
+    elif christmas.weekday() == 4:
+        result.add(datetime.date(year, 12, 28))
+    else:
+        result.add(christmas)
+        result.add(christmas + ONE_DAY)
+
+    return frozenset(x for x in result if x.weekday() == 0)
+
+
+def clip_period(period_start, period_end):
+    '''Limit the length of a timetable period to MAX_PERIOD'''
+
+    if period_end - period_start > MAX_PERIOD:
+        period_end = period_start + MAX_PERIOD
+    return period_start, period_end
+
+
+def schedule_bitmap(period_start, period_end, date_runs_from, date_runs_to,
+                    days_run, bank_holiday_running=" "):
+    '''Return the bitmap of the days in the period on which a schedule runs,
+    given the fields from the BS record. days_run is the list of seven
+    booleans from the Days Run field, starting on Monday.'''
+
+    first = max(date_runs_from, period_start)
+    last = min(date_runs_to, period_end)
+    if first > last:
+        return 0
+
+    lo = (first - period_start).days
+    hi = (last - period_start).days
+
+    # Build the seven-bit pattern for the week starting at the first day of
+    # the period, then repeat it over the whole period in one go.
+    start_dow = period_start.weekday()
+    week = 0
+    for i in range(0, 7):
+        if days_run[(start_dow + i) % 7]:
+            week |= 1 << i
+    weeks = (hi + 7) // 7 + 1
+    repeated = week * (((1 << (7 * weeks)) - 1) // 127)
+
+    result = repeated & ((1 << (hi + 1)) - (1 << lo))
+
+    if bank_holiday_running == "X":
+        for year in range(first.year, last.year + 1):
+            for d in bank_holiday_mondays(year):
+                if first <= d <= last:
+                    result &= ~(1 << (d - period_start).days)
+
+    return result
+
+
+def bitmap_to_sql(bitmap, period_start, period_end):
+    '''Convert a bitmap to the text form of an SQL BIT VARYING value covering
+    the whole period'''
+
+    width = (period_end - period_start).days + 1
+    return format(bitmap, "0{}b".format(width))[::-1]
+
+
+def bitmap_from_sql(text):
+    '''Convert the text form of an SQL BIT VARYING value back to a bitmap'''
+
+    return int(text[::-1], 2) if text else 0
+
+
+class ServiceCalendar(object):
+    '''An in-memory index of the day bitmaps for a set of schedules. The
+    bitmaps are held in a two-dimensional array of bytes, so finding all the
+    schedules that run on a date is a vectorised bit test and multi-date
+    queries are bitwise operations on the results.'''
+
+    def __init__(self, period_start, period_end, keys, bitmaps):
+        '''keys and bitmaps are sequences of the same length, with the
+        keys typically being (train_uid, date_runs_from, stp_indicator)
+        tuples.'''
+
+        self.period_start = period_start
+        self.period_end = period_end
+        self.days = (period_end - period_start).days + 1
+        self.keys = list(keys)
+
+        width = (self.days + 7) // 8
+        self.bits = np.frombuffer(b"".join(x.to_bytes(width, "little")
+                                           for x in bitmaps),
+                                  dtype=np.uint8).reshape(len(self.keys),
+                                                          width)
+
+    @classmethod
+    def from_database(cls, cur, schema="mca"):
+        '''Build the index from the basic_schedule table in the schema given,
+        using a DB API cursor. Raises ValueError if no header record has been
+        loaded to give the period the day bitmaps cover.'''
+
+        cur.execute("SELECT period_start, period_end "
+                    "FROM {}.calendar_period;".format(schema))
+        period = cur.fetchone()
+        if period is None:
+            raise ValueError("No timetable period has been stored in "
+                             "{}.calendar_period".format(schema))
+        period_start, period_end = period
+
+        cur.execute("SELECT train_uid, date_runs_from, stp_indicator, "
+                    "days_bitmap::text FROM {}.basic_schedule "
+                    "WHERE days_bitmap IS NOT NULL;".format(schema))
+        keys = []
+        bitmaps = []
+        for row in cur:
+            keys.append(tuple(row[0:3]))
+            bitmaps.append(bitmap_from_sql(row[3]))
+
+        return cls(period_start, period_end, keys, bitmaps)
+
+    def day_index(self, date):
+        '''Return the bit position of a date, which must be in the period'''
+
+        result = (date - self.period_start).days
+        if not 0 <= result < self.days:
+            raise ValueError("{} is not within the timetable period {} to {}"
+                             .format(date, self.period_start,
+                                     self.period_end))
+        return result
+
+    def mask(self, date):
+        '''Return a boolean array showing which schedules run on the date'''
+
+        i = self.day_index(date)
+        return ((self.bits[:, i >> 3] >> (i & 7)) & 1).astype(bool)
+
+    def mask_all(self, dates):
+        '''Return a boolean array showing which schedules run on all of the
+        dates'''
+
+        result = np.ones(len(self.keys), dtype=bool)
+        for d in dates:
+            result &= self.mask(d)
+        return result
+
+    def mask_any(self, dates):
+        '''Return a boolean array showing which schedules run on any of the
+        dates'''
+
+        result = np.zeros(len(self.keys), dtype=bool)
+        for d in dates:
+            result |= self.mask(d)
+        return result
+
+    def select(self, mask):
+        '''Return the keys of the schedules selected by a boolean array'''
+
+        return [self.keys[i] for i in np.flatnonzero(mask)]
+
+    def running_on(self, date):
+        '''Return the keys of the schedules that run on the date'''
+
+        return self.select(self.mask(date))
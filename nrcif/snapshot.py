@@ -0,0 +1,484 @@
+# snapshot.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''snapshot - Save parsed TTIS releases as columnar snapshots
+
+A snapshot holds the rows that the readers would insert into the database as
+one NumPy .npy file for each column of each table, so a release can be
+loaded, reloaded or analysed without parsing the text files again. The
+Writer class stands in for a database connection: its cursors take the
+INSERT statements prepared and executed by the readers and add the values to
+the columns, which are written to disk in blocks so the whole release is
+never held in memory.
+
+The manifest.json file records the format version, the source of the data,
+any projection used and the tables, with the name and SQL type of each column
+in the order used by the schema, as generated from the CIFRecord layouts by
+the schemagen modules. Text columns, including arrays and bit strings, are
+dictionary-encoded, with each distinct value stored once in a .dict.npy file
+and the column holding int32 codes (TEXT_NULL for NULL). Dates and times are
+stored as datetime64[D] and timedelta64[s] values with NaT for NULL,
+integers as int32 with INT_NULL for NULL, booleans as int8 with BOOL_NULL for
+NULL and floats as float64 with NaN for NULL.
+
+The Snapshot class opens a snapshot with the columns memory-mapped, and can
+load it into PostgreSQL with COPY.'''
+
+import array
+import collections
+import datetime
+import io
+import json
+import os
+import re
+import shutil
+
+import numpy as np
+
+import nrcif.schema.schemagen_mca
+import nrcif.schema.schemagen_ztr
+import nrcif.schema.schemagen_msn
+import nrcif.schema.schemagen_tsi
+import nrcif.schema.schemagen_alf
+
+from nrcif.fields import array_literal
+
+SNAPSHOT_FORMAT = "nrcif-snapshot"
+SNAPSHOT_VERSION = 1
+MANIFEST = "manifest.json"
+
+TEXT_NULL = -1
+INT_NULL = np.iinfo(np.int32).min
+BOOL_NULL = -1
+_NAT = np.iinfo(np.int64).min
+
+# The number of values buffered for each column before they are written
+BLOCK_SIZE = 65536
+
+# The number of rows formatted at once when loading a snapshot
+COPY_ROWS = 10000
+
+_EPOCH = datetime.date(1970, 1, 1).toordinal()
+
+_generators = {"mca": nrcif.schema.schemagen_mca,
+               "ztr": nrcif.schema.schemagen_ztr,
+               "msn": nrcif.schema.schemagen_msn,
+               "tsi": nrcif.schema.schemagen_tsi,
+               "alf": nrcif.schema.schemagen_alf}
+
+# The array typecode used while writing each kind of column and the dtype of
+# the .npy file
+_kinds = {"text": ("i", np.int32),
+          "integer": ("i", np.int32),
+          "float": ("d", np.float64),
+          "date": ("q", np.dtype("datetime64[D]")),
+          "time": ("q", np.dtype("timedelta64[s]")),
+          "boolean": ("b", np.int8)}
+
+_create_table = re.compile(r"CREATE TABLE (\w+) \(\n(.*?)\n\t\);", re.S)
+
+
+def table_columns(schema, **options):
+    '''Return the tables of a schema as an OrderedDict of lists of (column
+    name, SQL type) tuples, taken from the DDL generated by the schemagen
+    module for the schema with the given options'''
+
+    DDL = io.StringIO()
+    _generators[schema].gen_sql(DDL, io.StringIO(), **options)
+
+    result = collections.OrderedDict()
+    for match in _create_table.finditer(DDL.getvalue()):
+        result[match.group(1)] = [tuple(line.split(None, 1))
+                                  for line in match.group(2).split(",\n")]
+    return result
+
+
+def column_kind(sql_type):
+    '''Return the kind of column used in a snapshot for an SQL type'''
+
+    sql_type = sql_type.upper()
+    if sql_type in ("INTEGER", "SMALLINT"):
+        return "integer"
+    elif sql_type == "DOUBLE PRECISION":
+        return "float"
+    elif sql_type == "DATE":
+        return "date"
+    elif sql_type.startswith("TIME") and "ARRAY" not in sql_type:
+        return "time"
+    elif sql_type == "BOOLEAN":
+        return "boolean"
+    else:
+        return "text"
+
+
+class _ColumnWriter(object):
+    '''Writes the values of a column to a .npy file in blocks'''
+
+    def __init__(self, path, kind):
+        self.path = path
+        self.kind = kind
+        self.typecode, self.dtype = _kinds[kind]
+        self.buffer = array.array(self.typecode)
+        self.length = 0
+        self.values = dict() if kind == "text" else None
+        self.tmp = open(path + ".tmp", "wb")
+        self.append = getattr(self, "_append_" + kind)
+
+    def _append_text(self, value):
+        if value is None:
+            self.buffer.append(TEXT_NULL)
+        else:
+            if isinstance(value, list):
+                value = array_literal(value)
+            code = self.values.get(value)
+            if code is None:
+                code = len(self.values)
+                self.values[value] = code
+            self.buffer.append(code)
+        self._check()
+
+    def _append_integer(self, value):
+        self.buffer.append(INT_NULL if value is None else value)
+        self._check()
+
+    def _append_float(self, value):
+        self.buffer.append(np.nan if value is None else value)
+        self._check()
+
+    def _append_date(self, value):
+        self.buffer.append(_NAT if value is None else
+                           value.toordinal() - _EPOCH)
+        self._check()
+
+    def _append_time(self, value):
+        self.buffer.append(_NAT if value is None else
+                           value.hour * 3600 + value.minute * 60 +
+                           value.second)
+        self._check()
+
+    def _append_boolean(self, value):
+        self.buffer.append(BOOL_NULL if value is None else int(value))
+        self._check()
+
+    def _check(self):
+        if len(self.buffer) >= BLOCK_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.length += len(self.buffer)
+        self.buffer.tofile(self.tmp)
+        self.buffer = array.array(self.typecode)
+
+    def close(self):
+        '''Write the .npy file, and the dictionary for a text column'''
+
+        self.flush()
+        self.tmp.close()
+        header = {"descr": np.lib.format.dtype_to_descr(np.dtype(self.dtype)),
+                  "fortran_order": False,
+                  "shape": (self.length,)}
+        with open(self.path, "wb") as f, open(self.path + ".tmp", "rb") as t:
+            np.lib.format.write_array_header_1_0(f, header)
+            shutil.copyfileobj(t, f)
+        os.remove(self.path + ".tmp")
+
+        if self.values is not None:
+            dictionary = np.array(sorted(self.values, key=self.values.get),
+                                  dtype=str)
+            np.save(self.path[:-len(".npy")] + ".dict.npy", dictionary)
+
+
+class _TableWriter(object):
+    '''Writes the columns of a table'''
+
+    def __init__(self, directory, name, columns):
+        self.name = name
+        self.columns = columns
+        self.rows = 0
+        self.writers = [_ColumnWriter(os.path.join(directory, "{}.{}.npy"
+                                                   .format(name, column)),
+                                      column_kind(sql_type))
+                        for column, sql_type in columns]
+
+    def append(self, row):
+        if len(row) != len(self.writers):
+            raise ValueError("{} values given for {}, which has {} columns"
+                             .format(len(row), self.name, len(self.writers)))
+        for writer, value in zip(self.writers, row):
+            writer.append(value)
+        self.rows += 1
+
+    def close(self):
+        for writer in self.writers:
+            writer.close()
+        return {"rows": self.rows,
+                "columns": [{"name": column, "sql_type": sql_type,
+                             "kind": writer.kind}
+                            for (column, sql_type), writer
+                            in zip(self.columns, self.writers)]}
+
+
+class Cursor(object):
+    '''A DB API cursor that adds the rows inserted by the readers to a
+    snapshot. Only the statements the readers use to insert data are
+    understood: INSERTs prepared with PREPARE, the EXECUTE statements that use
+    them and plain INSERTs. Any other statements are ignored.'''
+
+    _prepare = re.compile(r"\s*PREPARE (\w+) AS\s+INSERT INTO (\w+)\.(\w+) ")
+    _execute = re.compile(r"EXECUTE (\w+) ")
+    _insert = re.compile(r"\s*INSERT INTO (\w+)\.(\w+) ")
+
+    def __init__(self, writer):
+        self.writer = writer
+        # The table for each prepared statement, and for each SQL string
+        # seen, so that each distinct statement is only matched once
+        self.prepared = dict()
+        self.targets = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False  # Don't suppress exceptions
+
+    def execute(self, sql, params=None):
+        '''Add the row inserted by the SQL to the snapshot'''
+
+        table = self.targets.get(sql)
+        if table is None:
+            match = self._prepare.match(sql)
+            if match:
+                self.prepared[match.group(1)] = (match.group(2),
+                                                 match.group(3))
+                return
+            match = self._execute.match(sql)
+            if match and match.group(1) in self.prepared:
+                table = self.writer.table(*self.prepared[match.group(1)])
+            else:
+                match = self._insert.match(sql)
+                if not match:
+                    return
+                table = self.writer.table(match.group(1), match.group(2))
+            self.targets[sql] = table
+        table.append(params)
+
+    def callproc(self, procname, params=None):
+        '''Routines are not run on snapshots'''
+
+        pass
+
+    def fetchone(self):
+        '''The snapshot cursor never has any results to return'''
+
+        return None
+
+    def close(self):
+        pass
+
+
+class Writer(object):
+    '''Stands in for a DB API connection and writes a snapshot of the data
+    inserted through its cursors to a directory. The tables are laid out as
+    in a schema generated with the given schemagen options and projection.'''
+
+    def __init__(self, directory, source=None, projection=None, **options):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.source = source
+        self.projection = projection
+        self.options = options
+        self.schemas = dict()
+        self.tables = collections.OrderedDict()
+
+    def table(self, schema, name):
+        '''Return the writer for a table, starting it if necessary'''
+
+        key = "{}.{}".format(schema, name)
+        if key not in self.tables:
+            if schema not in self.schemas:
+                options = self.options if schema == "mca" else {}
+                if schema in ("mca", "ztr") and self.projection is not None:
+                    options = dict(options, projection=self.projection)
+                self.schemas[schema] = table_columns(schema, **options)
+            self.tables[key] = _TableWriter(self.directory, key,
+                                            self.schemas[schema][name])
+        return self.tables[key]
+
+    def cursor(self):
+        return Cursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        '''Finish writing the columns and write the manifest'''
+
+        manifest = {"format": SNAPSHOT_FORMAT,
+                    "version": SNAPSHOT_VERSION,
+                    "created": datetime.datetime.now().isoformat(),
+                    "source": self.source,
+                    "options": self.options,
+                    "projection": (self.projection.as_dict()
+                                   if self.projection is not None else None),
+                    "tables": collections.OrderedDict(
+                        (key, table.close())
+                        for key, table in self.tables.items())}
+        with open(os.path.join(self.directory, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=1)
+
+
+def _copy_escape(value):
+    '''Escape a value for the COPY text format'''
+
+    return value.replace("\\", "\\\\").replace("\t", "\\t") \
+        .replace("\n", "\\n").replace("\r", "\\r")
+
+
+class _CopyStream(object):
+    '''A file-like object that gives the text produced by a generator to
+    cursor.copy_expert'''
+
+    def __init__(self, name, chunks):
+        self.name = name
+        self.chunks = chunks
+        self.buffer = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self.buffer) < size:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                break
+            self.buffer += chunk.encode("UTF-8")
+        if size < 0:
+            size = len(self.buffer)
+        result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+    def readline(self, size=-1):
+        return self.read(size)
+
+
+class Snapshot(object):
+    '''A snapshot written by Writer, with the columns memory-mapped'''
+
+    def __init__(self, directory, mmap_mode="r"):
+        self.directory = directory
+        self.mmap_mode = mmap_mode
+        with open(os.path.join(directory, MANIFEST)) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("format") != SNAPSHOT_FORMAT:
+            raise ValueError("{} is not a snapshot".format(directory))
+        if self.manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError("Snapshot version {} is not supported"
+                             .format(self.manifest.get("version")))
+        self.tables = self.manifest["tables"]
+        self.copy_dictionaries = dict()
+
+    def schemas(self):
+        '''Return the set of schemas with tables in the snapshot'''
+
+        return set(key.split(".")[0] for key in self.tables)
+
+    def _path(self, table, column, suffix=".npy"):
+        return os.path.join(self.directory,
+                            "{}.{}{}".format(table, column, suffix))
+
+    def column(self, table, column):
+        '''Return a column of a table, with text columns given as codes'''
+
+        return np.load(self._path(table, column), mmap_mode=self.mmap_mode)
+
+    def dictionary(self, table, column):
+        '''Return the distinct values of a text column, indexed by code'''
+
+        return np.load(self._path(table, column, ".dict.npy"))
+
+    def text(self, table, column):
+        '''Return a text column decoded into strings, with '' for NULL'''
+
+        dictionary = np.append(self.dictionary(table, column), "")
+        return dictionary[self.column(table, column)]
+
+    def _copy_dictionary(self, table, column):
+        '''Return the distinct values of a text column escaped for the COPY
+        text format, with a last entry of NULL for the code of -1. They are
+        escaped once for each column and kept for the later blocks.'''
+
+        key = (table, column)
+        if key not in self.copy_dictionaries:
+            formatted = [_copy_escape(x)
+                         for x in self.dictionary(table, column)]
+            self.copy_dictionaries[key] = np.array(formatted + ["\\N"],
+                                                   dtype=object)
+        return self.copy_dictionaries[key]
+
+    def _copy_column(self, table, column, kind, start, end):
+        '''Format part of a column as strings for the COPY text format'''
+
+        values = self.column(table, column)[start:end]
+        if kind == "text":
+            return self._copy_dictionary(table, column)[values]
+        elif kind == "integer":
+            return np.where(values == INT_NULL, "\\N", values.astype(str))
+        elif kind == "float":
+            return np.where(np.isnan(values), "\\N", values.astype(str))
+        elif kind == "date":
+            return np.where(np.isnat(values), "\\N",
+                            np.datetime_as_string(values))
+        elif kind == "time":
+            seconds = values.astype(np.int64)
+            return np.array(["\\N" if s == _NAT else
+                             "{:02d}:{:02d}:{:02d}".format(s // 3600,
+                                                           s // 60 % 60,
+                                                           s % 60)
+                             for s in seconds.tolist()], dtype=object)
+        else:
+            return np.array(["f", "t", "\\N"], dtype=object)[
+                np.where(values < 0, 2, values)]
+
+    def copy_text(self, table, rows=COPY_ROWS):
+        '''Yield the rows of a table in COPY text format, in chunks'''
+
+        columns = self.tables[table]["columns"]
+        total = self.tables[table]["rows"]
+        for start in range(0, total, rows):
+            end = min(start + rows, total)
+            formatted = [self._copy_column(table, c["name"], c["kind"],
+                                           start, end)
+                         for c in columns]
+            yield "".join("\t".join(row) + "\n" for row in zip(*formatted))
+
+        # The escaped dictionaries are only needed while the table is copied
+        for c in columns:
+            self.copy_dictionaries.pop((table, c["name"]), None)
+
+    def load(self, cur, tables=None):
+        '''Load the tables of the snapshot into the database using COPY,
+        returning a dict of the number of rows loaded into each table'''
+
+        result = dict()
+        for table in tables or self.tables:
+            columns = ", ".join(c["name"]
+                                for c in self.tables[table]["columns"])
+            cur.copy_expert("COPY {} ({}) FROM STDIN".format(table, columns),
+                            _CopyStream(table, self.copy_text(table)))
+            result[table] = self.tables[table]["rows"]
+        return result
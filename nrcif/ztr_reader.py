@@ -60,11 +60,18 @@ class ZTR(nrcif.mca_reader.MCA):
     layouts["BS"] = corrected_bs
     layouts["BX"] = corrected_bx
 
-    def __init__(self, cur):
+    def __init__(self, cur, projection=None):
         '''Requires a DB API cursor to the database that will contain the
-        data'''
+        data, and optionally a projection giving the records and fields to be
+        loaded'''
 
-        super().__init__(cur)
+        super().__init__(cur, projection=projection)
+
+    def process_HD(self):
+        '''The ZTR header does not give the timetable period, so it has to be
+        supplied by calling set_period before processing the file if the day
+        bitmaps are required.'''
+        pass
 
 
 if __name__ == "__main__":
@@ -29,9 +29,12 @@ import datetime
 import psycopg2
 
 import numpy as np
-from mpl_toolkits.basemap import Basemap
 import matplotlib.pyplot as plt
 
+from nrcif.fetch import fetch_arrays
+from nrcif.mapping import DEFAULT_CACHE_DIR, get_basemap, label_cities, \
+    triangulate, draw_isochron
+
 
 def read_departure(date_argument):
     '''Convert the date_argument string to a datetime object'''
@@ -45,6 +48,19 @@ parser.add_argument("DEPARTURE", help="The departure time and date in the "
                     type=read_departure)
 parser.add_argument("--no-labels", help="Do not add city labels",
                     action="store_true", default=False)
+parser.add_argument("--no-cache", help="Do not use the isochron cache",
+                    action="store_true", default=False)
+parser.add_argument("--map-cache", help="Directory to keep the prepared map "
+                                        "background in (default {})"
+                                        .format(DEFAULT_CACHE_DIR),
+                    action="store", default=DEFAULT_CACHE_DIR)
+parser.add_argument("--no-map-cache", help="Do not keep the prepared map "
+                                           "background on disk",
+                    action="store_true", default=False)
+parser.add_argument("--output", help="Write the map to this file (for "
+                                     "example a .png or .svg file) rather "
+                                     "than showing it",
+                    action="store", default=None)
 
 parser_db = parser.add_argument_group("database arguments")
 parser_db.add_argument("--database",
@@ -66,6 +82,10 @@ parser_db.add_argument("--max-parallel", "-j",
                        action="store", type=int, default=0)                       
 args = parser.parse_args()
 
+# No display is needed to write the map to a file
+if args.output:
+    plt.switch_backend("Agg")
+
 if args.host:
     connection = psycopg2.connect(database=args.database,
                                   user=args.user,
@@ -77,18 +97,8 @@ else:
                                   user=args.user,
                                   password=args.password)
 
-lat = []
-lon = []
-delay = []
-
-label_cities = set(('CAMBDGE', 'EDINBUR', 'KNGX   ',
-                    'EXETERC', 'CRDFCEN', 'BHAMNWS',
-                    'MNCRPIC', 'SOTON  ', 'ABRDEEN',
-                    'DRHM   ', 'BANGOR ', 'OBAN   ',
-                    'BLFSTCL', 'DUBLINC', 'PENZNCE',
-                    'LOWSTFT', 'CATZTUS', 'CARLILE',
-                    'SCRBSTR', 'NEWQUAY', 'DOVERP '))
-cities = dict()
+# The columns returned by util.isochron_latlon and util.isochron_cache_lookup
+isochron_dtypes = (object, np.float64, np.float64, np.float64)
 
 with connection.cursor() as cur:
     
@@ -105,45 +115,47 @@ with connection.cursor() as cur:
         print("Station cannot be identified")
         sys.exit(1)
 
-    label_cities.add(station)
-
-    cur.callproc('util.isochron_latlon', (station,
-                                          args.DEPARTURE.time(),
-                                          args.DEPARTURE.date()))
-    row = cur.fetchone()
-    while row:
-        locd, delayd, yd, xd = row
-        if locd in label_cities:
-            cities[locd] = (xd, yd)
-        lat.append(yd)
-        lon.append(xd)
-        delay.append(delayd)
-        row = cur.fetchone()
-
-m = Basemap(llcrnrlon=-10.5, llcrnrlat=49.5, urcrnrlon=3.5, urcrnrlat=59.5,
-            resolution='h', projection='tmerc', lon_0=-4.36, lat_0=54.7)
-
-x, y = m(np.asarray(lon), np.asarray(lat))
-delay = np.asarray(delay)
-
-m.drawmapboundary(fill_color='white')
-m.drawcoastlines()
-m.drawcountries()
-
-m.drawparallels(np.arange(-40., 61., 2.))
-m.drawmeridians(np.arange(-20., 21., 2.))
-
-m.contourf(x=x, y=y, data=delay, tri=True)
-
-m.colorbar()
-m.drawmapboundary(fill_color=None)
-
-if not args.no_labels:
-    for j in cities:
-        x, y = m(cities[j][0], cities[j][1])
-        m.plot(x, y, 'kx')
-        plt.text(x-8000, y+3500, j, size='small', color='k')
-
-plt.title("Isochron map of UK rail journeys from {} {}"
-          .format(station, args.DEPARTURE.strftime('%Y-%m-%d %H:%M')))
-plt.show()
+    # The isochron is taken from the cache if it has already been computed
+    # for the current data.
+    isochron_args = (station, args.DEPARTURE.time(), args.DEPARTURE.date())
+    lookup_sql = "SELECT * FROM util.isochron_cache_lookup(%s, %s, %s);"
+    latlon_sql = "SELECT * FROM util.isochron_latlon(%s, %s, %s);"
+    location = []
+    if not args.no_cache:
+        location, delay, lat, lon = fetch_arrays(connection, lookup_sql,
+                                                 isochron_args,
+                                                 isochron_dtypes)
+
+    if len(location):
+        print("Isochron cache hit ({} locations)".format(len(location)))
+    else:
+        if not args.no_cache:
+            print("Isochron cache miss")
+
+        # The isochron only reads the stored connections, so they are created
+        # here if necessary, and the result is cached, unless this is a
+        # read-only standby server.
+        cur.execute("SELECT pg_is_in_recovery();")
+        query = latlon_sql
+        if not cur.fetchone()[0]:
+            cur.callproc('util.ensure_connections', (args.DEPARTURE.date(),))
+            if not args.no_cache:
+                cur.callproc('util.isochron_cache_store', isochron_args)
+                query = lookup_sql
+            connection.commit()
+        location, delay, lat, lon = fetch_arrays(connection, query,
+                                                 isochron_args,
+                                                 isochron_dtypes)
+
+m = get_basemap(None if args.no_map_cache else args.map_cache)
+
+cities = None if args.no_labels else label_cities(location, lat, lon,
+                                                  station)
+title = ("Isochron map of UK rail journeys from {} {}"
+         .format(station, args.DEPARTURE.strftime('%Y-%m-%d %H:%M')))
+fig = draw_isochron(m, triangulate(m, lat, lon), delay, cities, title)
+
+if args.output:
+    fig.savefig(args.output)
+else:
+    plt.show()
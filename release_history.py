@@ -0,0 +1,153 @@
+# release_history.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+''' release_history.py - List the releases in the archive of past main
+    timetables, materialise one of them in the mca schema or show the
+    schedules that changed between two of them'''
+
+import os
+import argparse
+import collections
+import datetime
+import time
+
+import psycopg2
+
+import nrcif.history
+import nrcif.postload
+
+
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
+parser = argparse.ArgumentParser()
+
+parser_db = parser.add_argument_group("database arguments")
+parser_db.add_argument("--database",
+                       help="PostgreSQL database to use (default ukraildata)",
+                       action="store", default="ukraildata")
+parser_db.add_argument("--user", help="PostgreSQL user for upload",
+                       action="store",
+                       default=os.environ.get("USER", "postgres"))
+parser_db.add_argument("--password", help="PostgreSQL user password",
+                       action="store", default="")
+parser_db.add_argument("--host", help="PostgreSQL host (if using TCP/IP)",
+                       action="store", default=None)
+parser_db.add_argument("--port", help="PostgreSQL port (if required)",
+                       action="store", type=int, default=5432)
+
+commands = parser.add_subparsers(dest="command", metavar="COMMAND")
+commands.required = True
+
+commands.add_parser("list", help="List the releases in the archive")
+
+parser_mat = commands.add_parser("materialise",
+                                 help="Replace the main timetable in the mca "
+                                      "schema with a release from the "
+                                      "archive")
+parser_mat.add_argument("RELEASE", help="The name of the release")
+parser_mat.add_argument("--connections-horizon",
+                        help="Number of days of connections to store for "
+                             "routing (default 0, don't store any)",
+                        metavar="DAYS", action="store", type=int, default=0)
+parser_mat.add_argument("--connections-start",
+                        help="The first date to store connections for in "
+                             "the format '2015-01-01' (default today)",
+                        metavar="DATE", action="store", type=read_date,
+                        default=datetime.date.today())
+
+parser_diff = commands.add_parser("diff",
+                                  help="Show the schedules that were added, "
+                                       "deleted or modified between two "
+                                       "releases")
+parser_diff.add_argument("RELEASE_A", help="The name of the earlier release")
+parser_diff.add_argument("RELEASE_B", help="The name of the later release")
+parser_diff.add_argument("--summary", help="Only show the number of "
+                                           "schedules with each change",
+                         action="store_true", default=False)
+
+args = parser.parse_args()
+
+if args.host:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password,
+                                  host=args.host,
+                                  port=args.port)
+else:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password)
+
+with connection.cursor() as cur:
+
+    if args.command == "list":
+        cur.execute('''SELECT r.release_name, r.loaded, r.period_start,
+                r.period_end, count(rb.block_id),
+                count(rb.block_id) FILTER (WHERE NOT EXISTS (
+                    SELECT 1 FROM hist.release_block AS e
+                    WHERE e.block_id = rb.block_id
+                        AND e.release_id < r.release_id))
+            FROM hist.release AS r
+                LEFT JOIN hist.release_block AS rb USING (release_id)
+            GROUP BY r.release_id
+            ORDER BY r.release_id;''')
+        print("{:20} {:19} {:10} {:10} {:>9} {:>9}"
+              .format("Release", "Loaded", "Start", "End", "Schedules",
+                      "New"))
+        for name, loaded, start, end, blocks, new in cur.fetchall():
+            print("{:20} {:19} {:10} {:10} {:9} {:9}"
+                  .format(name, loaded.strftime("%Y-%m-%d %H:%M:%S"),
+                          str(start), str(end), blocks, new))
+
+    elif args.command == "materialise":
+        start = time.perf_counter()
+        try:
+            blocks = nrcif.history.materialise_release(cur, args.RELEASE)
+        except ValueError as err:
+            parser.error(str(err))
+        print("Materialised {} schedules from {} in {:.1f}s"
+              .format(blocks, args.RELEASE, time.perf_counter() - start))
+        nrcif.postload.refresh_all(cur, {"mca"}, args.connections_start,
+                                   args.connections_horizon)
+        connection.commit()
+
+    elif args.command == "diff":
+        for release in (args.RELEASE_A, args.RELEASE_B):
+            try:
+                nrcif.history.find_release(cur, release)
+            except ValueError as err:
+                parser.error(str(err))
+        cur.execute("SELECT change, train_uid, date_runs_from, "
+                    "stp_indicator FROM hist.release_diff(%s, %s);",
+                    (args.RELEASE_A, args.RELEASE_B))
+        counts = collections.Counter()
+        for change, train_uid, date_runs_from, stp_indicator in cur:
+            counts[change] += 1
+            if not args.summary:
+                print("{} {} {} {}".format(change, train_uid, date_runs_from,
+                                           stp_indicator))
+        print("{} added, {} deleted, {} modified"
+              .format(counts["A"], counts["D"], counts["M"]))
+
+connection.close()
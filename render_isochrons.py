@@ -0,0 +1,213 @@
+# render_isochrons.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+''' render_isochrons.py - Draw the isochron maps for many stations and
+    departure times on a date to image files, without needing a display.'''
+
+import os
+import sys
+import argparse
+import datetime
+import csv
+import time
+
+import psycopg2
+
+import nrcif.routing.service
+from nrcif.routing.batch import select_origins, select_near
+from nrcif.render import RenderBatch, RenderTimes
+from nrcif.mapping import DEFAULT_CACHE_DIR, get_basemap
+
+from nrcif.fields import time_to_minutes
+
+
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
+
+def read_time(time_argument):
+    '''Convert the time_argument string to a time object'''
+
+    return datetime.datetime.strptime(time_argument, '%H:%M').time()
+
+parser = argparse.ArgumentParser()
+parser.add_argument("OUTPUT_DIR", help="The directory to write the maps to")
+parser.add_argument("DATE", help="The timetable date in the format "
+                                 "'2015-01-01'",
+                    type=read_date)
+parser.add_argument("TIME", help="Departure times in the format '15:45'",
+                    type=read_time, nargs="+")
+
+parser_origins = parser.add_argument_group("origin stations")
+parser_origins.add_argument("--station", help="A TIPLOC code, 3-alpha code or "
+                                              "station name (may be repeated)",
+                            action="append", default=[])
+parser_origins.add_argument("--max-cate", help="Use all the stations with a "
+                                               "CATE interchange type up to "
+                                               "this value",
+                            action="store", type=int, default=None)
+parser_origins.add_argument("--near", help="Use all the stations within a "
+                                           "distance of a station, given as "
+                                           "the station and the distance in "
+                                           "km",
+                            nargs=2, metavar=("STATION", "KM"), default=None)
+
+parser_output = parser.add_argument_group("output options")
+parser_output.add_argument("--format", help="The image file format "
+                                            "(default png)",
+                           action="store", choices=("png", "svg"),
+                           default="png")
+parser_output.add_argument("--no-labels", help="Do not add city labels",
+                           action="store_true", default=False)
+parser_output.add_argument("--map-cache", help="Directory to keep the "
+                                               "prepared map background in "
+                                               "(default {})"
+                                               .format(DEFAULT_CACHE_DIR),
+                           action="store", default=DEFAULT_CACHE_DIR)
+parser_output.add_argument("--workers", help="Number of worker processes "
+                                             "(default one per CPU)",
+                           action="store", type=int, default=None)
+parser_output.add_argument("--slowest", help="Number of the slowest maps to "
+                                             "report (default 5)",
+                           action="store", type=int, default=5)
+
+parser_db = parser.add_argument_group("database arguments")
+parser_db.add_argument("--database",
+                       help="PostgreSQL database to use (default ukraildata)",
+                       action="store", default="ukraildata")
+parser_db.add_argument("--user", help="PostgreSQL user for upload",
+                       action="store",
+                       default=os.environ.get("USER", "postgres"))
+parser_db.add_argument("--password", help="PostgreSQL user password",
+                       action="store", default="")
+parser_db.add_argument("--host", help="PostgreSQL host (if using TCP/IP)",
+                       action="store", default=None)
+parser_db.add_argument("--port", help="PostgreSQL port (if required)",
+                       action="store", type=int, default=5432)
+args = parser.parse_args()
+
+if not args.station and args.max_cate is None and args.near is None:
+    parser.error("Give the origin stations with --station, --max-cate or "
+                 "--near")
+
+if args.host:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password,
+                                  host=args.host,
+                                  port=args.port)
+else:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password)
+
+with connection.cursor() as cur:
+
+    print("Loading timetable for {}".format(args.DATE), flush=True)
+    start = time.perf_counter()
+    timetable = nrcif.routing.service.load_timetables(cur, args.DATE,
+                                                      1)[args.DATE]
+    print("Loaded {} connections in {:.1f}s"
+          .format(len(timetable), time.perf_counter() - start))
+
+    origins = []
+    for station in args.station:
+        location_id = timetable.find_station(station)
+        if location_id is None:
+            print("Station {} cannot be identified".format(station))
+            sys.exit(1)
+        origins.append(location_id)
+    if args.max_cate is not None:
+        origins.extend(select_origins(timetable, args.max_cate))
+    if args.near is not None:
+        location_id = timetable.find_station(args.near[0])
+        if location_id is None:
+            print("Station {} cannot be identified".format(args.near[0]))
+            sys.exit(1)
+        try:
+            origins.extend(select_near(timetable, location_id,
+                                       float(args.near[1]) * 1000.0))
+        except ValueError as err:
+            print(err)
+            sys.exit(1)
+    origins = sorted(set(origins))
+
+connection.close()
+
+os.makedirs(args.OUTPUT_DIR, exist_ok=True)
+
+print("Preparing the map", flush=True)
+start = time.perf_counter()
+basemap = get_basemap(args.map_cache)
+print("Prepared the map in {:.1f}s".format(time.perf_counter() - start))
+
+departures = sorted(set(time_to_minutes(t) for t in args.TIME))
+total = len(origins) * len(departures)
+print("Drawing {} maps".format(total), flush=True)
+
+batch = RenderBatch(timetable, basemap, args.OUTPUT_DIR, args.format,
+                    not args.no_labels, args.workers)
+results = []
+done = 0
+start = time.perf_counter()
+try:
+    with open(os.path.join(args.OUTPUT_DIR, "timings.csv"), "w",
+              newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(("filename",) + RenderTimes._fields)
+        for result in batch.run(origins, departures):
+            done += 1
+            if done % 100 == 0:
+                print("{} of {} maps drawn".format(done, total), flush=True)
+            if result.error:
+                print("Skipping {} at {:02d}:{:02d}: {}"
+                      .format(timetable.locations[result.origin].strip(),
+                              result.depart // 60, result.depart % 60,
+                              result.error))
+                continue
+            results.append(result)
+            writer.writerow((result.filename,) +
+                            tuple("{:.3f}".format(x) for x in result.times))
+finally:
+    batch.close()
+elapsed = time.perf_counter() - start
+
+print("Drew {} maps in {:.1f}s ({:.1f} per second)"
+      .format(len(results), elapsed, len(results) / elapsed
+              if elapsed else 0.0))
+if results:
+    for i, stage in enumerate(RenderTimes._fields):
+        print("{}: {:.3f}s per map".format(stage.capitalize(),
+                                           sum(x.times[i] for x in results) /
+                                           len(results)))
+    print("Slowest maps:")
+    for result in sorted(results, key=lambda x: sum(x.times),
+                         reverse=True)[:args.slowest]:
+        print("{} ({})".format(result.filename,
+                               ", ".join("{} {:.2f}s".format(stage, x)
+                                         for stage, x in
+                                         zip(RenderTimes._fields,
+                                             result.times))))
+for w in batch.worker_stats():
+    print("Worker {}: {} maps in {:.1f}s ({:.1f} per second)"
+          .format(w.pid, w.jobs, w.seconds,
+                  w.jobs / w.seconds if w.seconds else 0.0))
@@ -0,0 +1,276 @@
+# routing_daemon.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+''' routing_daemon.py - a local HTTP service that answers isochron and journey
+    queries from timetables held in memory'''
+
+import os
+import argparse
+import datetime
+import json
+import urllib.parse
+import http.server
+import socketserver
+
+import psycopg2
+
+import nrcif.routing.service
+
+from nrcif.fields import time_to_minutes
+
+
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
+
+def read_time(time_argument):
+    '''Convert the time_argument string to minutes after midnight'''
+
+    return time_to_minutes(datetime.datetime.strptime(time_argument,
+                                                      '%H:%M').time())
+
+parser = argparse.ArgumentParser()
+
+parser_tt = parser.add_argument_group("timetable options")
+parser_tt.add_argument("--start", help="The first date to load in the format "
+                                       "'2015-01-01' (default today)",
+                       metavar="DATE", action="store", type=read_date,
+                       default=datetime.date.today())
+parser_tt.add_argument("--days", help="Number of days to load (default 1)",
+                       action="store", type=int, default=1)
+parser_tt.add_argument("--workers", help="Number of worker processes "
+                                         "(default one per CPU)",
+                       action="store", type=int, default=None)
+
+parser_http = parser.add_argument_group("server options")
+parser_http.add_argument("--listen", help="Address to listen on "
+                                          "(default 127.0.0.1)",
+                         action="store", default="127.0.0.1")
+parser_http.add_argument("--listen-port", help="Port to listen on "
+                                               "(default 8642)",
+                         action="store", type=int, default=8642)
+parser_http.add_argument("--raster-dir", help="Serve isochron map tiles, "
+                                              "keeping the isochron rasters "
+                                              "in this directory",
+                         action="store", default=None)
+
+parser_db = parser.add_argument_group("database arguments")
+parser_db.add_argument("--database",
+                       help="PostgreSQL database to use (default ukraildata)",
+                       action="store", default="ukraildata")
+parser_db.add_argument("--user", help="PostgreSQL user for upload",
+                       action="store",
+                       default=os.environ.get("USER", "postgres"))
+parser_db.add_argument("--password", help="PostgreSQL user password",
+                       action="store", default="")
+parser_db.add_argument("--host", help="PostgreSQL host (if using TCP/IP)",
+                       action="store", default=None)
+parser_db.add_argument("--port", help="PostgreSQL port (if required)",
+                       action="store", type=int, default=5432)
+
+args = None
+
+
+def connect():
+    '''Open a new connection to the database'''
+
+    if args.host:
+        return psycopg2.connect(database=args.database,
+                                user=args.user,
+                                password=args.password,
+                                host=args.host,
+                                port=args.port)
+    else:
+        return psycopg2.connect(database=args.database,
+                                user=args.user,
+                                password=args.password)
+
+
+class RoutingHandler(http.server.BaseHTTPRequestHandler):
+    '''Handles the HTTP requests. The queries are:
+
+    GET /status
+    GET /stations?name=cambridge&limit=10
+    GET /isochron?station=CAMBDGE&date=2015-01-01&time=08:00
+    GET /journey?from=CAMBDGE&to=EDINBUR&date=2015-01-01&time=08:00
+    GET /reverse_isochron?station=CAMBDGE&date=2015-01-01&time=18:00
+    GET /arrive_by?from=CAMBDGE&to=EDINBUR&date=2015-01-01&time=18:00
+    GET /tile?station=CAMBDGE&date=2015-01-01&time=08:00&z=0&x=0&y=0
+    POST /reload?start=2015-01-01&days=1
+
+    Stations can be given as TIPLOC codes, 3-alpha codes or the start of the
+    station name.'''
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode("UTF-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_png(self, body):
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def parse_query(self):
+        url = urllib.parse.urlparse(self.path)
+        query = {k: v[0] for k, v in urllib.parse.parse_qs(url.query).items()}
+        return url.path, query
+
+    def do_GET(self):
+        path, query = self.parse_query()
+        try:
+            if path == "/status":
+                self.send_json(200, service.status())
+            elif path == "/stations":
+                self.send_json(200, service.search_stations(
+                    query["name"], int(query.get("limit", 10))))
+            elif path == "/isochron":
+                rows = service.isochron(read_date(query["date"]),
+                                        query["station"],
+                                        read_time(query["time"]))
+                self.send_json(200, rows)
+            elif path == "/journey":
+                legs = service.journey(read_date(query["date"]),
+                                       query["from"], query["to"],
+                                       read_time(query["time"]))
+                self.send_json(200, legs)
+            elif path == "/reverse_isochron":
+                rows = service.reverse_isochron(read_date(query["date"]),
+                                                query["station"],
+                                                read_time(query["time"]))
+                self.send_json(200, rows)
+            elif path == "/arrive_by":
+                legs = service.arrive_by(read_date(query["date"]),
+                                         query["from"], query["to"],
+                                         read_time(query["time"]))
+                self.send_json(200, legs)
+            elif path == "/tile" and tiles is not None:
+                self.send_png(tile(read_date(query["date"]), query["station"],
+                                   read_time(query["time"]), int(query["z"]),
+                                   int(query["x"]), int(query["y"])))
+            else:
+                self.send_json(404, {"error": "Unknown query"})
+        except (KeyError, ValueError) as err:
+            self.send_json(400, {"error": str(err)})
+        except Exception as err:
+            # Anything else is a fault in the service rather than the query,
+            # but the client is still sent an answer
+            self.log_error("%s failed: %r", self.path, err)
+            self.send_json(500, {"error": str(err)})
+
+    def do_POST(self):
+        path, query = self.parse_query()
+        if path != "/reload":
+            self.send_json(404, {"error": "Unknown query"})
+            return
+        try:
+            start = read_date(query["start"]) if "start" in query \
+                else args.start
+            days = int(query.get("days", args.days))
+        except ValueError as err:
+            self.send_json(400, {"error": str(err)})
+            return
+        try:
+            service.reload(start, days)
+        except Exception as err:
+            self.log_error("%s failed: %r", self.path, err)
+            self.send_json(500, {"error": str(err)})
+            return
+        if tiles is not None:
+            rasterisers.clear()
+            tiles.clear()
+        self.send_json(200, service.status())
+
+
+def tile(timetable_date, station, depart, zoom, x, y):
+    '''Return a map tile of the isochron for a station as a PNG image. The
+    isochron is computed and stored as a raster the first time it is
+    asked for with the timetable that is currently loaded.'''
+
+    tt = service.timetable(timetable_date)
+    tiles.store.set_timetable(tt)
+    location_id = tt.find_station(station)
+    if location_id is None:
+        raise KeyError("Station {} cannot be identified".format(station))
+    tiploc = tt.locations[location_id]
+
+    if tiles.raster(tiploc, timetable_date, depart) is None:
+        rows = service.isochron(timetable_date, tiploc, depart)
+        if timetable_date not in rasterisers:
+            rasterisers[timetable_date] = \
+                nrcif.raster.Rasteriser.from_timetable(tt)
+        minutes = nrcif.raster.isochron_minutes(tt, rows)
+        tiles.put_raster(tiploc, timetable_date, depart,
+                         rasterisers[timetable_date].rasterise(minutes))
+
+    return tiles.png(tiploc, timetable_date, depart, zoom, x, y)
+
+
+class RoutingServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+tiles = None
+rasterisers = dict()
+service = None
+
+
+def open_tiles(raster_dir):
+    '''Return a TileCache keeping the isochron rasters in raster_dir'''
+
+    # Matplotlib is only needed to serve map tiles
+    import nrcif.raster
+    return nrcif.raster.TileCache(nrcif.raster.RasterStore(raster_dir))
+
+
+def main():
+    '''Load the timetables and serve queries until interrupted. The worker
+    processes are started by a fork server, which imports this script again,
+    so nothing is done unless it is run as the main program.'''
+
+    global args, tiles, service
+
+    args = parser.parse_args()
+    if args.raster_dir:
+        tiles = open_tiles(args.raster_dir)
+
+    print("Loading timetables", flush=True)
+    service = nrcif.routing.service.RoutingService(connect, args.start,
+                                                   args.days, args.workers)
+    print("Listening on {}:{}".format(args.listen, args.listen_port),
+          flush=True)
+
+    server = RoutingServer((args.listen, args.listen_port), RoutingHandler)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+if __name__ == "__main__":
+    main()
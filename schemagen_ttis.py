@@ -24,11 +24,14 @@ with the definitions in the nrcif package.'''
 
 import argparse
 
+import nrcif.mca_reader
+import nrcif.projection
 import nrcif.schema.schemagen_mca
 import nrcif.schema.schemagen_ztr
 import nrcif.schema.schemagen_msn
 import nrcif.schema.schemagen_tsi
 import nrcif.schema.schemagen_alf
+import nrcif.schema.schemagen_hist
 
 parser = argparse.ArgumentParser()
 
@@ -58,16 +61,74 @@ parser_no.add_argument("--no-tsi", help="Don't generate for the TOC specific "
 parser_no.add_argument("--no-alf", help="Don't generate for the Additional "
                                         "Fixed Link data",
                        action="store_true", default=False)
+parser_no.add_argument("--no-hist", help="Don't generate for the archive of "
+                                         "past releases of the main "
+                                         "timetable data",
+                       action="store_true", default=False)
+
+parser_layout = parser.add_argument_group("layout options")
+parser_layout.add_argument("--stopping-patterns",
+                           help="Store the main timetable locations in the "
+                                "normalised stopping pattern layout",
+                           action="store_true", default=False)
+
+parser_proj = parser.add_argument_group("projection options")
+parser_proj.add_argument("--include-records",
+                         help="Only generate tables for these optional record "
+                              "types of the main timetable and Z-Trains data, "
+                              "as a comma separated list such as 'TI,AA'",
+                         metavar="LIST", action="store",
+                         type=nrcif.projection.name_list, default=None)
+parser_proj.add_argument("--exclude-records",
+                         help="Don't generate tables for these optional "
+                              "record types, as a comma separated list such "
+                              "as 'CR,LN,TN'",
+                         metavar="LIST", action="store",
+                         type=nrcif.projection.name_list, default=[])
+parser_proj.add_argument("--include-fields",
+                         help="Only generate columns for these fields of the "
+                              "record types named, as a comma separated list "
+                              "such as 'BX.atoc_code,BX.rsid'",
+                         metavar="LIST", action="store",
+                         type=nrcif.projection.name_list, default=[])
+parser_proj.add_argument("--exclude-fields",
+                         help="Don't generate columns for these fields, as a "
+                              "comma separated list such as "
+                              "'BS.headcode,LI.line'",
+                         metavar="LIST", action="store",
+                         type=nrcif.projection.name_list, default=[])
 
 args = parser.parse_args()
 
+if (args.include_records is not None or args.exclude_records or
+        args.include_fields or args.exclude_fields):
+    try:
+        projection = nrcif.projection.Projection(args.include_records,
+                                                 args.exclude_records,
+                                                 args.include_fields,
+                                                 args.exclude_fields)
+        nrcif.mca_reader.MCA.project_layouts(projection,
+                                             args.stopping_patterns)
+    except ValueError as err:
+        parser.error(str(err))
+else:
+    projection = None
+
 jobs = ((args.no_mca, nrcif.schema.schemagen_mca),
         (args.no_ztr, nrcif.schema.schemagen_ztr),
         (args.no_msn, nrcif.schema.schemagen_msn),
         (args.no_tsi, nrcif.schema.schemagen_tsi),
-        (args.no_alf, nrcif.schema.schemagen_alf))
+        (args.no_alf, nrcif.schema.schemagen_alf),
+        (args.no_hist, nrcif.schema.schemagen_hist))
+
+# Any extra options for the schema generators
+job_options = {nrcif.schema.schemagen_mca:
+               {"stopping_patterns": args.stopping_patterns,
+                "projection": projection},
+               nrcif.schema.schemagen_ztr:
+               {"projection": projection}}
 
 with args.DDL as DDL, args.CONS as CONS:
     for job in jobs:
         if not job[0]:
-            job[1].gen_sql(DDL, CONS)
+            job[1].gen_sql(DDL, CONS, **job_options.get(job[1], {}))
@@ -10,7 +10,8 @@
 -- link between two places of a given type, and another given for a particular span
 -- of dates I have assumed that the longer is appropriate. I have assumed that all
 -- fixed links should be symmetrical, although they are not specified that way in
--- the data.
+-- the data. The links are read from alf.links, where they have already been
+-- made symmetrical and resolved to TIPLOCs by alf.refresh_links.
 
 CREATE FUNCTION alf.get_direct_connections(
 			station char(7),
@@ -24,45 +25,23 @@ RETURNS TABLE (
 		)
 AS $B$
 DECLARE
-    dow Integer;
-    origin_3alpha CHAR(3);
+    dow_bit smallint;
 BEGIN
 
-    SELECT _3_alpha_code INTO origin_3alpha
-	FROM msn.station_detail
-	WHERE tiploc_code = station;
-
-    IF origin_3alpha IS NULL THEN
-	RAISE NOTICE 'Could not find 3alpha for: %', station;
-	RETURN;
-    END IF;
-
-    SELECT EXTRACT(isodow FROM timetable_date) INTO STRICT dow;
+    SELECT (1 << (EXTRACT(isodow FROM timetable_date)::integer - 1))::smallint
+	INTO STRICT dow_bit;
 
     RETURN QUERY
-    SELECT tiploc_code AS location,
-    MAX((depart + link_time * '1 minute'::interval)) AS earliest_arrival,
-    LEFT(mode, 6)::char(6) AS train_uid
-    FROM    (
-	SELECT  mode, destination, link_time,
-	    start_time, end_time, start_date,
-	    end_date, days_of_week
-	FROM alf.alf
-	WHERE origin = origin_3alpha
-	UNION
-	SELECT  mode, origin AS destination, link_time,
-	    start_time, end_time, start_date,
-	    end_date, days_of_week
-	FROM alf.alf
-	WHERE destination = origin_3alpha
-	) AS a
-	INNER JOIN msn.station_detail AS sd
-	ON (a.destination = sd._3_alpha_code)
-    WHERE   a.days_of_week[dow] AND
-	COALESCE(timetable_date BETWEEN a.start_date AND a.end_date, TRUE) AND
-	depart BETWEEN a.start_time AND a.end_time AND
-	(depart + a.link_time * '1 minute'::interval)::time > depart
-    GROUP BY location, train_uid;
+    SELECT l.to_tiploc AS location,
+    MAX((depart + l.link_time * '1 minute'::interval)) AS earliest_arrival,
+    l.mode AS train_uid
+    FROM alf.links AS l
+    WHERE   l.from_tiploc = station AND
+	l.days_mask & dow_bit <> 0 AND
+	l.valid_dates @> timetable_date AND
+	depart BETWEEN l.start_time AND l.end_time AND
+	(depart + l.link_time * '1 minute'::interval)::time > depart
+    GROUP BY l.to_tiploc, l.mode;
 END;
 $B$
 STABLE
@@ -0,0 +1,74 @@
+﻿DROP TABLE IF EXISTS alf.links CASCADE;
+
+-- The links table holds the Additional Fixed Links between TIPLOCs rather
+-- than 3-alpha codes. Each link is given in both directions, as the links are
+-- assumed to be symmetrical, and for every TIPLOC of the stations at each
+-- end. The days of the week are given as a bitmask with bit 0 for Monday and
+-- the dates as a range, which is unbounded where the dates are not given, so
+-- that the links for a location, date and time can be found with a single
+-- scan of the covering index on from_tiploc.
+
+CREATE TABLE alf.links (
+        from_tiploc char(7),
+        to_tiploc char(7),
+        mode char(6),
+        link_time integer,
+        start_time time,
+        end_time time,
+        valid_dates daterange,
+        days_mask smallint
+        );
+
+CREATE INDEX idx_alf_links ON alf.links (from_tiploc)
+    INCLUDE (to_tiploc, mode, link_time, start_time, end_time, valid_dates,
+             days_mask);
+
+DROP FUNCTION IF EXISTS alf.refresh_links();
+
+-- Rebuilds the links table after the ALF or MSN data has been loaded. Returns
+-- the number of links stored.
+
+CREATE FUNCTION alf.refresh_links()
+RETURNS bigint
+AS $RL$
+DECLARE
+    n bigint;
+BEGIN
+    TRUNCATE alf.links;
+
+    INSERT INTO alf.links
+    SELECT DISTINCT fs.tiploc_code, ts.tiploc_code, LEFT(al.mode, 6),
+        al.link_time, al.start_time, al.end_time,
+        daterange(al.start_date, al.end_date, '[]'),
+        (SELECT COALESCE(SUM(1 << (i - 1)), 0)
+         FROM generate_subscripts(al.days_of_week, 1) AS i
+         WHERE al.days_of_week[i])::smallint
+    FROM (
+        SELECT a1.mode, a1.origin, a1.destination, a1.link_time,
+            a1.start_time, a1.end_time, a1.start_date, a1.end_date,
+            a1.days_of_week
+        FROM alf.alf AS a1
+        UNION
+        SELECT a2.mode, a2.destination, a2.origin, a2.link_time,
+            a2.start_time, a2.end_time, a2.start_date, a2.end_date,
+            a2.days_of_week
+        FROM alf.alf AS a2
+        ) AS al
+        INNER JOIN msn.station_detail AS fs
+            ON (al.origin = fs._3_alpha_code)
+        INNER JOIN msn.station_detail AS ts
+            ON (al.destination = ts._3_alpha_code);
+    GET DIAGNOSTICS n = ROW_COUNT;
+
+    ANALYZE alf.links;
+    RETURN n;
+END;
+$RL$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+
+-- The table is filled in straight away if the ALF and MSN data have already
+-- been loaded.
+
+SELECT alf.refresh_links()
+    WHERE to_regclass('alf.alf') IS NOT NULL
+        AND to_regclass('msn.station_detail') IS NOT NULL;
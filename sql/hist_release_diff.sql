@@ -0,0 +1,51 @@
+﻿DROP FUNCTION IF EXISTS hist.release_diff(release_a varchar,
+                                       release_b varchar);
+
+-- Returns the schedules that differ between two releases in the archive,
+-- found by comparing the hashes of their schedule blocks without looking at
+-- the blocks themselves. The change is 'A' for a schedule that was added in
+-- release_b, 'D' for one that was deleted and 'M' for one that was modified,
+-- with the hashes of the blocks in each release. For example:
+--
+-- SELECT change, count(*)
+-- FROM hist.release_diff('ttisf123', 'ttisf124')
+-- GROUP BY change;
+
+CREATE FUNCTION hist.release_diff(release_a varchar, release_b varchar)
+RETURNS TABLE (
+        change char(1),
+        train_uid char(6),
+        date_runs_from date,
+        stp_indicator char(1),
+        block_hash_a char(40),
+        block_hash_b char(40)
+        )
+AS $$
+    WITH a AS (
+        SELECT sb.*
+        FROM hist.schedule_block AS sb
+            INNER JOIN hist.release_block AS rb USING (block_id)
+            INNER JOIN hist.release AS r USING (release_id)
+        WHERE r.release_name = $1
+    ), b AS (
+        SELECT sb.*
+        FROM hist.schedule_block AS sb
+            INNER JOIN hist.release_block AS rb USING (block_id)
+            INNER JOIN hist.release AS r USING (release_id)
+        WHERE r.release_name = $2
+    )
+    SELECT (CASE WHEN a.block_id IS NULL THEN 'A'
+                 WHEN b.block_id IS NULL THEN 'D'
+                 ELSE 'M' END)::char(1),
+        COALESCE(a.train_uid, b.train_uid),
+        COALESCE(a.date_runs_from, b.date_runs_from),
+        COALESCE(a.stp_indicator, b.stp_indicator),
+        a.block_hash,
+        b.block_hash
+    FROM a
+        FULL OUTER JOIN b ON (a.train_uid = b.train_uid
+                              AND a.date_runs_from = b.date_runs_from
+                              AND a.stp_indicator = b.stp_indicator)
+    WHERE a.block_id IS DISTINCT FROM b.block_id
+    ORDER BY 2, 3, 4;
+$$ STABLE LANGUAGE SQL PARALLEL SAFE;
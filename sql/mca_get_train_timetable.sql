@@ -14,11 +14,10 @@ RETURNS TABLE ( train_uid character(6),
 
     WITH bs AS (
         SELECT train_uid, date_runs_from, stp_indicator
-        FROM mca.basic_schedule
+        FROM mca.effective_schedule
         WHERE   train_uid = $1 AND
-            date_runs_from <= $2 AND
-            date_runs_to >= $2 AND
-            days_run[EXTRACT(ISODOW FROM $2)]
+            valid_dates @> $2 AND
+            day_of_week = EXTRACT(ISODOW FROM $2)
         ORDER BY (stp_indicator COLLATE "C") ASC
         LIMIT 1
         ), locations AS (
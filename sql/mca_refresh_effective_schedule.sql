@@ -0,0 +1,71 @@
+﻿DROP FUNCTION IF EXISTS mca.refresh_effective_schedule();
+
+-- The effective schedule records which basic schedule is in force for each
+-- train on each date, after the STP (short-term plan) overlays and
+-- cancellations have been applied. For each train and day of the week the
+-- candidate dates are ranked by the stp_indicator as in the timetable
+-- functions, and runs of consecutive candidate dates won by the same schedule
+-- are collapsed into a single date range. This is exact, as every candidate
+-- date for the train within the range on that day of the week was won by the
+-- schedule.
+--
+-- Schedules that run indefinitely are expanded only until a week after the
+-- last date mentioned in the table. After that date the set of schedules that
+-- apply can no longer change, so the final range for such a schedule is left
+-- unbounded.
+
+CREATE FUNCTION mca.refresh_effective_schedule()
+RETURNS bigint
+AS $RE$
+DECLARE
+    horizon date;
+    n bigint;
+BEGIN
+    SELECT GREATEST(MAX(date_runs_from),
+                    MAX(date_runs_to) FILTER (WHERE date_runs_to < '9999-12-31'))
+        INTO horizon
+        FROM mca.basic_schedule;
+
+    TRUNCATE mca.effective_schedule;
+
+    INSERT INTO mca.effective_schedule
+    SELECT train_uid, date_runs_from, stp_indicator, day_of_week,
+        daterange(MIN(d),
+                  CASE WHEN MAX(d) > horizon AND MAX(date_runs_to) > horizon + 7
+                    THEN NULL
+                    ELSE MAX(d) + 1
+                  END)
+    FROM (
+        SELECT train_uid, date_runs_from, stp_indicator, date_runs_to,
+            day_of_week, d,
+            dense_rank() OVER (PARTITION BY train_uid, day_of_week ORDER BY d) -
+            row_number() OVER (PARTITION BY train_uid, day_of_week,
+                                            date_runs_from, stp_indicator
+                               ORDER BY d) AS island
+        FROM (
+            SELECT train_uid, date_runs_from, stp_indicator, date_runs_to,
+                day_of_week, d,
+                RANK() OVER (PARTITION BY train_uid, d ORDER BY (stp_indicator COLLATE "C") ASC) AS pos
+            FROM (
+                SELECT DISTINCT train_uid, date_runs_from, stp_indicator,
+                    date_runs_to, days_run,
+                    d::date AS d,
+                    EXTRACT(ISODOW FROM d)::smallint AS day_of_week
+                FROM mca.basic_schedule,
+                    generate_series(date_runs_from,
+                                    LEAST(date_runs_to, horizon + 7),
+                                    '1 day'::interval) AS d
+                ) AS candidates
+            WHERE days_run[day_of_week]
+            ) AS ranked
+        WHERE pos = 1
+        ) AS winners
+    GROUP BY train_uid, date_runs_from, stp_indicator, day_of_week, island;
+    GET DIAGNOSTICS n = ROW_COUNT;
+
+    ANALYZE mca.effective_schedule;
+
+    RETURN n;
+END;
+$RE$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
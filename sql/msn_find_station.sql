@@ -18,20 +18,10 @@ BEGIN
 		RETURN d;
 	END IF;
 	
-	EXECUTE $$
-		SELECT tiploc_code
-		FROM (
-		SELECT station_name, cate_type, tiploc_code
-		FROM msn.station_detail
-		UNION
-		SELECT alias_name AS station_name, cate_type, tiploc_code
-		FROM msn.station_detail
-			INNER JOIN msn.station_alias USING (station_name)
-		) AS foo
-		WHERE station_name LIKE '%' || $1 || '%'
-		ORDER BY (CASE WHEN cate_type = 9 THEN -1 ELSE cate_type END) DESC
-		LIMIT 1;
-	$$ INTO d USING upper(station);
+	-- Otherwise the name is looked up in msn.station_names, preferring the
+	-- largest interchanges
+	SELECT s.tiploc_code INTO d
+	FROM msn.search_stations(station, 1) AS s;
 
 	RETURN d;
 END
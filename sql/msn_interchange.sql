@@ -0,0 +1,89 @@
+﻿DROP TABLE IF EXISTS msn.interchange CASCADE;
+
+-- The interchange table gives the minimum connection time at each location
+-- for each pair of arriving and departing train operators. It combines the
+-- standard interchange time of each station from the MSN data, given with
+-- '**' for both operators, with the TOC specific interchange times from the
+-- TSI data. The TSI data is keyed by 3-alpha code, so its times apply to all
+-- the TIPLOCs of the station.
+
+CREATE TABLE msn.interchange (
+        tiploc_code char(7),
+        arriving_toc char(2),
+        departing_toc char(2),
+        change_time integer,
+        PRIMARY KEY (tiploc_code, arriving_toc, departing_toc)
+        );
+
+DROP FUNCTION IF EXISTS msn.refresh_interchange();
+
+-- Rebuilds the interchange table after the MSN or TSI data has been loaded.
+-- Returns the number of rows stored.
+
+CREATE FUNCTION msn.refresh_interchange()
+RETURNS bigint
+AS $RI$
+DECLARE
+    n bigint;
+BEGIN
+    TRUNCATE msn.interchange;
+
+    INSERT INTO msn.interchange
+    SELECT tiploc_code, '**', '**', MAX(COALESCE(change_time, 0))
+    FROM msn.station_detail
+    GROUP BY tiploc_code;
+
+    INSERT INTO msn.interchange
+    SELECT sd.tiploc_code, t.arriving_train_toc, t.departing_train_toc,
+        MAX(t.minimum_interchange_time)
+    FROM tsi.tsi AS t
+        INNER JOIN msn.station_detail AS sd
+            ON (sd._3_alpha_code = t.station_code)
+    WHERE t.arriving_train_toc <> '**' OR t.departing_train_toc <> '**'
+    GROUP BY 1, 2, 3;
+
+    SELECT count(*) INTO n FROM msn.interchange;
+    ANALYZE msn.interchange;
+    RETURN n;
+END;
+$RI$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+
+-- The table is filled in straight away if the MSN and TSI data have already
+-- been loaded.
+
+SELECT msn.refresh_interchange()
+    WHERE to_regclass('msn.station_detail') IS NOT NULL
+        AND to_regclass('tsi.tsi') IS NOT NULL;
+
+DROP FUNCTION IF EXISTS msn.interchange_time(station char(7),
+                                             arriving_toc char(2),
+                                             departing_toc char(2));
+
+-- Returns the minimum connection time at a station between trains of the
+-- given operators, falling back to the standard interchange time of the
+-- station and then to no time at all.
+
+CREATE FUNCTION msn.interchange_time(station char(7),
+                                     arriving_toc char(2),
+                                     departing_toc char(2))
+RETURNS integer
+AS $IT$
+BEGIN
+    RETURN COALESCE(
+        (SELECT i.change_time
+         FROM msn.interchange AS i
+         WHERE i.tiploc_code = station
+            AND i.arriving_toc = interchange_time.arriving_toc
+            AND i.departing_toc = interchange_time.departing_toc),
+        (SELECT i.change_time
+         FROM msn.interchange AS i
+         WHERE i.tiploc_code = station
+            AND i.arriving_toc = '**'
+            AND i.departing_toc = '**'),
+        0);
+END;
+$IT$
+STABLE
+LANGUAGE 'plpgsql'
+PARALLEL SAFE;
@@ -0,0 +1,111 @@
+﻿DROP TABLE IF EXISTS msn.station_locations CASCADE;
+
+-- The station_locations table gives the position of each station on the
+-- National Grid in metres, as a point with a GiST index so that the nearest
+-- stations to a point, or those within a distance of it, can be found without
+-- scanning all the stations. The positions are taken from the MSN data, with
+-- any stations that are only in the NaPTAN data added if it has been loaded.
+
+CREATE TABLE msn.station_locations (
+        tiploc_code char(7) PRIMARY KEY,
+        station_name varchar,
+        cate_type integer,
+        position point
+        );
+
+CREATE INDEX idx_station_locations_position ON msn.station_locations
+    USING gist (position);
+
+DROP FUNCTION IF EXISTS msn.refresh_station_locations();
+
+-- Rebuilds the station_locations table after the MSN or NaPTAN data has been
+-- loaded. Returns the number of stations stored.
+
+CREATE FUNCTION msn.refresh_station_locations()
+RETURNS bigint
+AS $RL$
+DECLARE
+    n bigint;
+BEGIN
+    TRUNCATE msn.station_locations;
+
+    -- The MSN co-ordinates are given in units of 100m with offsets, and
+    -- unknown positions are given as zero
+    INSERT INTO msn.station_locations
+    SELECT tiploc_code, trim(station_name), cate_type,
+        point(easting * 100 - 1000000, northing * 100 - 6000000)
+    FROM msn.station_detail
+    WHERE easting * 100 > 1000000 AND northing * 100 > 6000000;
+
+    IF to_regclass('naptan.railreferences') IS NOT NULL THEN
+        EXECUTE '
+            INSERT INTO msn.station_locations
+            SELECT DISTINCT ON (tiploc) tiploc, stationname, NULL,
+                point(easting, northing)
+            FROM naptan.railreferences
+            WHERE gridtype = ''U'' AND easting > 0 AND northing > 0
+                AND tiploc NOT IN (SELECT tiploc_code
+                                   FROM msn.station_locations)
+            ORDER BY tiploc';
+    END IF;
+
+    SELECT count(*) INTO n FROM msn.station_locations;
+    ANALYZE msn.station_locations;
+    RETURN n;
+END;
+$RL$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+
+-- The table is filled in straight away if the MSN data has already been
+-- loaded.
+
+SELECT msn.refresh_station_locations()
+    WHERE to_regclass('msn.station_detail') IS NOT NULL;
+
+DROP FUNCTION IF EXISTS msn.nearest_stations(easting double precision,
+                                             northing double precision,
+                                             k integer);
+
+-- Returns the k stations nearest to a point given as a National Grid easting
+-- and northing in metres, nearest first, with their distances in metres.
+
+CREATE FUNCTION msn.nearest_stations(easting double precision,
+                                     northing double precision,
+                                     k integer DEFAULT 10)
+RETURNS TABLE (
+        tiploc_code char(7),
+        station_name varchar,
+        cate_type integer,
+        distance double precision
+        )
+AS $$
+    SELECT sl.tiploc_code, sl.station_name, sl.cate_type,
+        sl.position <-> point($1, $2)
+    FROM msn.station_locations AS sl
+    ORDER BY sl.position <-> point($1, $2)
+    LIMIT $3;
+$$ STABLE LANGUAGE SQL PARALLEL SAFE;
+
+DROP FUNCTION IF EXISTS msn.stations_within(easting double precision,
+                                            northing double precision,
+                                            radius double precision);
+
+-- Returns the stations within a distance in metres of a point given as a
+-- National Grid easting and northing in metres, nearest first.
+
+CREATE FUNCTION msn.stations_within(easting double precision,
+                                    northing double precision,
+                                    radius double precision)
+RETURNS TABLE (
+        tiploc_code char(7),
+        station_name varchar,
+        cate_type integer,
+        distance double precision
+        )
+AS $$
+    SELECT sl.tiploc_code, sl.station_name, sl.cate_type,
+        sl.position <-> point($1, $2)
+    FROM msn.station_locations AS sl
+    WHERE sl.position <@ circle(point($1, $2), $3)
+    ORDER BY sl.position <-> point($1, $2);
+$$ STABLE LANGUAGE SQL PARALLEL SAFE;
@@ -0,0 +1,128 @@
+﻿DROP FUNCTION IF EXISTS msn.normalise_name(name text);
+
+-- Station names are compared in upper case, with apostrophes removed and any
+-- other punctuation or runs of spaces replaced by a single space, so that for
+-- example 'King's Cross' and 'KINGS  CROSS' are the same.
+
+CREATE FUNCTION msn.normalise_name(name text)
+RETURNS text
+AS $$
+    SELECT trim(regexp_replace(replace(upper(name), '''', ''),
+                               '[^A-Z0-9]+', ' ', 'g'));
+$$ IMMUTABLE LANGUAGE SQL PARALLEL SAFE;
+
+DROP TABLE IF EXISTS msn.station_names CASCADE;
+
+-- The station_names table holds every name a station is known by, from the
+-- MSN station details and aliases and from the NaPTAN data if it has been
+-- loaded, with the normalised form of each name as name_key.
+
+CREATE TABLE msn.station_names (
+        name_key text,
+        station_name varchar,
+        tiploc_code char(7),
+        cate_type integer
+        );
+
+CREATE INDEX idx_station_names_key ON msn.station_names
+    (name_key text_pattern_ops);
+
+-- Searches for text within the names can use a trigram index, if the pg_trgm
+-- extension can be installed.
+
+DO $TI$
+BEGIN
+    CREATE EXTENSION IF NOT EXISTS pg_trgm;
+    CREATE INDEX idx_station_names_trgm ON msn.station_names
+        USING gin (name_key gin_trgm_ops);
+EXCEPTION
+    WHEN insufficient_privilege OR undefined_file
+            OR feature_not_supported THEN
+        RAISE NOTICE 'pg_trgm is not available so station name searches '
+                     'will not be indexed';
+END;
+$TI$;
+
+DROP FUNCTION IF EXISTS msn.refresh_station_names();
+
+-- Rebuilds the station_names table after the MSN or NaPTAN data has been
+-- loaded. Returns the number of names stored.
+
+CREATE FUNCTION msn.refresh_station_names()
+RETURNS bigint
+AS $RS$
+DECLARE
+    n bigint;
+BEGIN
+    TRUNCATE msn.station_names;
+
+    INSERT INTO msn.station_names
+    SELECT msn.normalise_name(sd.station_name), trim(sd.station_name),
+        sd.tiploc_code, sd.cate_type
+    FROM msn.station_detail AS sd
+    UNION
+    SELECT msn.normalise_name(sa.alias_name), trim(sa.alias_name),
+        sd.tiploc_code, sd.cate_type
+    FROM msn.station_detail AS sd
+        INNER JOIN msn.station_alias AS sa USING (station_name);
+
+    IF to_regclass('naptan.railreferences') IS NOT NULL THEN
+        EXECUTE '
+            INSERT INTO msn.station_names
+            SELECT DISTINCT msn.normalise_name(r.stationname),
+                r.stationname, sd.tiploc_code, sd.cate_type
+            FROM naptan.railreferences AS r
+                INNER JOIN msn.station_detail AS sd
+                    ON (sd.tiploc_code = r.tiploc)
+            WHERE NOT EXISTS (
+                SELECT 1 FROM msn.station_names AS sn
+                WHERE sn.tiploc_code = sd.tiploc_code
+                    AND sn.name_key = msn.normalise_name(r.stationname))';
+    END IF;
+
+    SELECT count(*) INTO n FROM msn.station_names;
+    ANALYZE msn.station_names;
+    RETURN n;
+END;
+$RS$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+
+-- The table is filled in straight away if the MSN data has already been
+-- loaded.
+
+SELECT msn.refresh_station_names()
+    WHERE to_regclass('msn.station_detail') IS NOT NULL;
+
+DROP FUNCTION IF EXISTS msn.search_stations(name varchar, k integer);
+
+-- Returns up to k stations with a name containing the given text. The largest
+-- interchanges come first, as given by the cate_type, and subsidiary TIPLOCs
+-- (cate_type 9) last. Then names starting with the text come before those
+-- that only contain it.
+
+CREATE FUNCTION msn.search_stations(name varchar, k integer DEFAULT 10)
+RETURNS TABLE (
+        tiploc_code char(7),
+        station_name varchar,
+        cate_type integer
+        )
+AS $$
+    SELECT m.tiploc_code, m.station_name, m.cate_type
+    FROM (
+        SELECT DISTINCT ON (sn.tiploc_code)
+            sn.tiploc_code, sn.station_name, sn.cate_type,
+            sn.name_key LIKE q.name_key || '%' AS prefix
+        FROM msn.station_names AS sn,
+            (SELECT msn.normalise_name($1) AS name_key) AS q
+        WHERE q.name_key <> ''
+            AND sn.name_key LIKE '%' || q.name_key || '%'
+        ORDER BY sn.tiploc_code,
+            sn.name_key LIKE q.name_key || '%' DESC,
+            length(sn.name_key)
+        ) AS m
+    ORDER BY (CASE WHEN m.cate_type = 9 THEN -1 ELSE m.cate_type END) DESC,
+        m.prefix DESC,
+        length(m.station_name),
+        m.station_name
+    LIMIT k;
+$$ STABLE LANGUAGE SQL PARALLEL SAFE;
@@ -0,0 +1,244 @@
+﻿DROP FUNCTION IF EXISTS util.connection_scan(station char(7),
+                                             depart time,
+                                             timetable_date date);
+
+-- This finds the earliest arrival at every location reachable from a station
+-- after the given time, using the Connection Scan Algorithm over the stored
+-- connections for the date. The connections are read once in order of
+-- departure, and the best known arrival at each location and the location
+-- where each train was boarded are held in arrays indexed by the ids from
+-- util.locations. A fixed link can only be taken straight after arriving by
+-- train within its hours of operation, so the links are followed after every
+-- train that is caught, even if it does not improve the arrival. It gives
+-- the same columns as util.iterate_reachable but does not create any tables,
+-- so it can be used on a read-only standby and in parallel queries. As with
+-- util.iterate_reachable, journeys do not continue past midnight, the
+-- station-specific interchange times are used and the fixed links are assumed
+-- to be symmetrical. Where more than one fixed link between the same places
+-- applies on the date, the longest is used. When changing between trains at a
+-- station with TOC specific interchange times in msn.interchange, the time
+-- for the two operators is used instead of the standard time for the station.
+
+CREATE FUNCTION util.connection_scan(station char(7),
+                                     depart time,
+                                     timetable_date date)
+RETURNS TABLE (
+        location char(7),
+        earliest_arrival time,
+        earliest_departure time,
+        path char(6)[]
+        )
+AS $CS$
+DECLARE
+    t0 integer := util.time_to_minutes(depart);
+    dow integer := EXTRACT(ISODOW FROM timetable_date);
+    n integer;
+    origin_id integer;
+    change integer[];
+    toc_change jsonb;
+    has_toc_change boolean[];
+    arrived_toc char(2)[];
+    arrival integer[];
+    ready integer[];
+    via_from integer[];
+    via_uid char(6)[];
+    link_train_from integer[];
+    link_train_uid char(6)[];
+    boarded_at integer[];
+    link_from integer[];
+    link_to integer[];
+    link_minutes integer[];
+    link_start integer[];
+    link_end integer[];
+    link_mode char(6)[];
+    link_first integer[];
+    link_last integer[];
+    c record;
+    a integer;
+    k integer;
+    x integer;
+    r integer;
+    link_at integer;
+    link_ready integer;
+    link_via_from integer;
+    link_via_uid char(6);
+BEGIN
+    IF to_regclass(format('util.%I', 'connections_' ||
+                          to_char(timetable_date, 'YYYYMMDD'))) IS NULL THEN
+        RAISE EXCEPTION 'No connections have been stored for %', timetable_date
+            USING HINT = 'Call util.refresh_connections on the primary server';
+    END IF;
+
+    SELECT l.location_id INTO origin_id
+        FROM util.locations AS l
+        WHERE l.location = station;
+
+    IF origin_id IS NULL THEN
+        RETURN QUERY SELECT station, depart, depart, NULL::char(6)[];
+        RETURN;
+    END IF;
+
+    -- The interchange time at each location, with gaps in the ids filled in
+    SELECT MAX(l.location_id) INTO n FROM util.locations AS l;
+
+    SELECT array_agg(COALESCE(sd.change_time, 0) ORDER BY i)
+        INTO change
+        FROM generate_series(1, n) AS i
+            LEFT JOIN util.locations AS l ON (l.location_id = i)
+            LEFT JOIN msn.station_detail AS sd ON (sd.tiploc_code = l.location);
+
+    -- The TOC specific interchange times, keyed by location id and the
+    -- arriving and departing operators
+    SELECT jsonb_object_agg(format('%s:%s:%s', l.location_id, i.arriving_toc,
+                                   i.departing_toc), i.change_time)
+        INTO toc_change
+        FROM msn.interchange AS i
+            INNER JOIN util.locations AS l ON (l.location = i.tiploc_code)
+        WHERE i.arriving_toc <> '**' OR i.departing_toc <> '**';
+
+    FOR x IN (SELECT DISTINCT l.location_id
+              FROM msn.interchange AS i
+                  INNER JOIN util.locations AS l
+                      ON (l.location = i.tiploc_code)
+              WHERE i.arriving_toc <> '**' OR i.departing_toc <> '**') LOOP
+        has_toc_change[x] := TRUE;
+    END LOOP;
+
+    -- The fixed links that apply on the date, sorted by origin so that the
+    -- links from each location are a contiguous slice of the arrays
+    SELECT array_agg(fl.from_id ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.to_id ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.link_minutes ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.start_min ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.end_min ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.mode ORDER BY fl.from_id, fl.to_id)
+        INTO link_from, link_to, link_minutes, link_start, link_end, link_mode
+        FROM (
+            SELECT f.location_id AS from_id, t.location_id AS to_id,
+                al.mode,
+                util.time_to_minutes(al.start_time) AS start_min,
+                util.time_to_minutes(al.end_time) AS end_min,
+                MAX(al.link_time) AS link_minutes
+            FROM alf.links AS al
+                INNER JOIN util.locations AS f
+                    ON (f.location = al.from_tiploc)
+                INNER JOIN util.locations AS t
+                    ON (t.location = al.to_tiploc)
+            WHERE al.days_mask & (1 << (dow - 1)) <> 0 AND
+                al.valid_dates @> timetable_date
+            GROUP BY 1, 2, 3, 4, 5
+            ) AS fl;
+
+    FOR k IN 1 .. COALESCE(array_length(link_from, 1), 0) LOOP
+        IF link_first[link_from[k]] IS NULL THEN
+            link_first[link_from[k]] := k;
+        END IF;
+        link_last[link_from[k]] := k;
+    END LOOP;
+
+    arrival[origin_id] := t0;
+    ready[origin_id] := t0;
+    link_at := origin_id;
+    link_ready := t0;
+
+    -- A final row of NULLs is added to the connections so that the fixed
+    -- links from the location reached by the last connection are followed.
+    <<over_connections>>
+    FOR c IN EXECUTE format('
+        SELECT trip_id, train_uid, toc, from_id, departure_min, to_id,
+            arrival_min
+        FROM util.connections
+        WHERE timetable_date = %L
+            AND departure_min > $1
+            AND arrival_min < 1440
+        UNION ALL
+        SELECT NULL, NULL, NULL, NULL, NULL, NULL, NULL
+        ORDER BY departure_min NULLS LAST', timetable_date) USING t0 LOOP
+
+        -- Follow the fixed links from the location reached by the previous
+        -- connection, recording the train taken to the start of each link.
+        -- Links only depart within their hours of operation and are not
+        -- followed on from the far end.
+        IF link_first[link_at] IS NOT NULL THEN
+            FOR k IN link_first[link_at] .. link_last[link_at] LOOP
+                CONTINUE WHEN link_ready NOT BETWEEN link_start[k]
+                                                 AND link_end[k];
+                a := link_ready + link_minutes[k];
+                IF a < 1440 AND (arrival[link_to[k]] IS NULL OR
+                                 a < arrival[link_to[k]]) THEN
+                    arrival[link_to[k]] := a;
+                    ready[link_to[k]] := a + change[link_to[k]];
+                    via_from[link_to[k]] := link_at;
+                    via_uid[link_to[k]] := link_mode[k];
+                    link_train_from[link_to[k]] := link_via_from;
+                    link_train_uid[link_to[k]] := link_via_uid;
+                    arrived_toc[link_to[k]] := NULL;
+                END IF;
+            END LOOP;
+        END IF;
+        link_at := NULL;
+
+        EXIT over_connections WHEN c.trip_id IS NULL;
+
+        IF boarded_at[c.trip_id] IS NULL THEN
+            r := ready[c.from_id];
+            IF has_toc_change[c.from_id] AND
+                    arrived_toc[c.from_id] IS NOT NULL THEN
+                r := COALESCE(arrival[c.from_id] +
+                              (toc_change ->> format('%s:%s:%s', c.from_id,
+                                                     arrived_toc[c.from_id],
+                                                     c.toc))::integer,
+                              r);
+            END IF;
+            CONTINUE over_connections WHEN r IS NULL OR r >= c.departure_min;
+            boarded_at[c.trip_id] := c.from_id;
+        END IF;
+
+        IF arrival[c.to_id] IS NULL OR c.arrival_min < arrival[c.to_id] THEN
+            arrival[c.to_id] := c.arrival_min;
+            ready[c.to_id] := c.arrival_min + change[c.to_id];
+            via_from[c.to_id] := boarded_at[c.trip_id];
+            via_uid[c.to_id] := c.train_uid;
+            link_train_from[c.to_id] := NULL;
+            arrived_toc[c.to_id] := c.toc;
+        END IF;
+
+        link_at := c.to_id;
+        link_ready := c.arrival_min + change[c.to_id];
+        link_via_from := boarded_at[c.trip_id];
+        link_via_uid := c.train_uid;
+    END LOOP over_connections;
+
+    -- The paths are built up by following the chain of locations where each
+    -- train or link was boarded back to the starting station. The train taken
+    -- to the start of a link need not be the best arrival there, so it is
+    -- added to the path with the link. The arrays are read by subscript as
+    -- they are assigned sparsely and so need not start at 1.
+    RETURN QUERY
+    WITH RECURSIVE steps AS (
+        SELECT i AS id,
+            COALESCE(link_train_from[i], via_from[i]) AS prev_id,
+            (CASE WHEN link_train_from[i] IS NULL THEN ARRAY[via_uid[i]]
+                  ELSE ARRAY[link_train_uid[i], via_uid[i]]
+             END)::bpchar[] AS uids
+        FROM generate_series(1, n) AS i
+        WHERE via_from[i] IS NOT NULL
+        ),
+    paths AS (
+        SELECT origin_id AS id, NULL::bpchar[] AS train_path
+        UNION ALL
+        SELECT s.id, p.train_path || s.uids
+        FROM steps AS s
+            INNER JOIN paths AS p ON (p.id = s.prev_id)
+        WHERE s.id <> origin_id
+        )
+    SELECT l.location,
+        util.minutes_to_time(arrival[p.id]),
+        util.minutes_to_time(LEAST(ready[p.id], 1439)),
+        p.train_path::char(6)[]
+    FROM paths AS p
+        INNER JOIN util.locations AS l ON (l.location_id = p.id);
+END;
+$CS$
+STABLE
+LANGUAGE 'plpgsql' PARALLEL SAFE;
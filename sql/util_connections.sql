@@ -0,0 +1,274 @@
+﻿DROP TABLE IF EXISTS util.locations CASCADE;
+
+-- Each location that appears in the stored connections is given a small
+-- integer id, so that the connection scan can keep its working state in
+-- arrays indexed by location. The ids are never reused, so they stay valid
+-- for all the stored dates.
+
+CREATE TABLE util.locations (
+        location_id serial PRIMARY KEY,
+        location char(7) UNIQUE
+        );
+
+DROP TABLE IF EXISTS util.connections CASCADE;
+
+-- The connections table holds the elementary connections for each date, that
+-- is the hops between each calling point of a train and the next calling point
+-- of the same train. It is partitioned by date so that a day's connections can
+-- be replaced without disturbing the others, and so that queries for a single
+-- date only have to look at one small, well-indexed table. Trains that started
+-- on the previous day and continue past midnight are distinguished by the
+-- xmidnight flag, exactly as in the output of the get_full_timetable functions.
+-- The times are given in minutes after the start of the day. Each train on
+-- the date is also given a trip id, and the locations are given as ids from
+-- util.locations as well as TIPLOC codes. The toc column gives the ATOC code
+-- of the train operator, for the TOC specific interchange times.
+
+CREATE TABLE util.connections (
+        timetable_date date,
+        train_uid char(6),
+        xmidnight boolean,
+        from_location char(7),
+        from_order integer,
+        departure_min integer,
+        to_location char(7),
+        to_order integer,
+        arrival_min integer,
+        trip_id integer,
+        from_id integer,
+        to_id integer,
+        toc char(2)
+        ) PARTITION BY RANGE (timetable_date);
+
+DROP FUNCTION IF EXISTS util.refresh_connections(start_date date,
+                                                 horizon integer);
+
+CREATE FUNCTION util.refresh_connections(start_date date,
+                                         horizon integer DEFAULT 1)
+RETURNS bigint
+AS $RC$
+DECLARE
+    d date;
+    part text;
+    n bigint;
+    total bigint := 0;
+BEGIN
+    FOR i IN 0 .. horizon - 1 LOOP
+        d := start_date + i;
+        part := 'connections_' || to_char(d, 'YYYYMMDD');
+
+        EXECUTE format('DROP TABLE IF EXISTS util.%I', part);
+        EXECUTE format('CREATE TABLE util.%I PARTITION OF util.connections
+                            FOR VALUES FROM (%L) TO (%L)', part, d, d + 1);
+
+        -- Only calling points are of interest, so passing points are
+        -- discarded before each stop is paired with the next stop of the
+        -- same train. Any locations that have not been seen before are
+        -- given ids as part of the same statement. The stations are included
+        -- even if no trains call there, as they can still be reached by the
+        -- fixed links. The operator of each train is taken from the schedule
+        -- in force for the run, which is the previous day's run for the
+        -- calling points after midnight.
+        EXECUTE format('
+            WITH hops AS (
+                SELECT train_uid, xmidnight,
+                    location, loc_order, departure_min,
+                    next_location, next_order, next_arrival,
+                    dense_rank() OVER (ORDER BY train_uid, xmidnight) AS trip_id
+                FROM (
+                    SELECT train_uid, xmidnight, location,
+                        loc_order, departure_min,
+                        LEAD(location) OVER w AS next_location,
+                        LEAD(loc_order) OVER w AS next_order,
+                        LEAD(arrival_min) OVER w AS next_arrival
+                    FROM (  SELECT * FROM mca.get_full_timetable($1)
+                            UNION ALL
+                            SELECT * FROM ztr.get_full_timetable($1)
+                        ) AS tt
+                    WHERE arrival_min IS NOT NULL
+                        OR departure_min IS NOT NULL
+                    WINDOW w AS (PARTITION BY train_uid, xmidnight
+                                 ORDER BY loc_order)
+                    ) AS calling_points
+                WHERE departure_min IS NOT NULL
+                    AND next_arrival IS NOT NULL
+                    AND next_order > loc_order
+                ),
+            tocs AS (
+                SELECT DISTINCT ON (train_uid, xmidnight)
+                    train_uid, xmidnight, atoc_code
+                FROM (  SELECT train_uid, date_runs_from, stp_indicator,
+                            FALSE AS xmidnight
+                        FROM mca.effective_schedule
+                        WHERE valid_dates @> $1
+                            AND day_of_week = EXTRACT(ISODOW FROM $1)
+                        UNION ALL
+                        SELECT train_uid, date_runs_from, stp_indicator,
+                            TRUE AS xmidnight
+                        FROM mca.effective_schedule
+                        WHERE valid_dates @> ($1 - 1)
+                            AND day_of_week = EXTRACT(ISODOW FROM ($1 - 1))
+                    ) AS es
+                    INNER JOIN mca.basic_schedule AS bs
+                        USING (train_uid, date_runs_from, stp_indicator)
+                WHERE train_uid IN (SELECT train_uid FROM hops)
+                UNION ALL
+                SELECT DISTINCT ON (train_uid, xmidnight)
+                    train_uid, xmidnight, atoc_code
+                FROM (  SELECT train_uid, date_runs_from, stp_indicator,
+                            FALSE AS xmidnight
+                        FROM ztr.effective_schedule
+                        WHERE valid_dates @> $1
+                            AND day_of_week = EXTRACT(ISODOW FROM $1)
+                        UNION ALL
+                        SELECT train_uid, date_runs_from, stp_indicator,
+                            TRUE AS xmidnight
+                        FROM ztr.effective_schedule
+                        WHERE valid_dates @> ($1 - 1)
+                            AND day_of_week = EXTRACT(ISODOW FROM ($1 - 1))
+                    ) AS es
+                    INNER JOIN ztr.basic_schedule AS bs
+                        USING (train_uid, date_runs_from, stp_indicator)
+                WHERE train_uid IN (SELECT train_uid FROM hops)
+                ),
+            new_locations AS (
+                INSERT INTO util.locations (location)
+                SELECT DISTINCT x.location
+                FROM (  SELECT location FROM hops
+                        UNION
+                        SELECT next_location FROM hops
+                        UNION
+                        SELECT tiploc_code FROM msn.station_detail
+                    ) AS x
+                WHERE NOT EXISTS (SELECT 1 FROM util.locations AS l
+                                  WHERE l.location = x.location)
+                RETURNING location_id, location
+                ),
+            ids AS (
+                SELECT location_id, location FROM util.locations
+                UNION ALL
+                SELECT location_id, location FROM new_locations
+                )
+            INSERT INTO util.%I
+            SELECT $1, h.train_uid, h.xmidnight,
+                h.location, h.loc_order, h.departure_min,
+                h.next_location, h.next_order, h.next_arrival,
+                h.trip_id, f.location_id, t.location_id, o.atoc_code
+            FROM hops AS h
+                INNER JOIN ids AS f ON (f.location = h.location)
+                INNER JOIN ids AS t ON (t.location = h.next_location)
+                LEFT JOIN tocs AS o
+                    ON (o.train_uid = h.train_uid
+                        AND o.xmidnight = h.xmidnight)',
+            part) USING d;
+        GET DIAGNOSTICS n = ROW_COUNT;
+
+        EXECUTE format('CREATE INDEX ON util.%I (from_location, departure_min)',
+                       part);
+        EXECUTE format('CREATE INDEX ON util.%I (train_uid, xmidnight,
+                                                 from_order)', part);
+        EXECUTE format('CREATE INDEX ON util.%I (departure_min)', part);
+        EXECUTE format('ANALYZE util.%I', part);
+
+        RAISE NOTICE 'Stored % connections for %', n, d;
+        total := total + n;
+    END LOOP;
+
+    RETURN total;
+END;
+$RC$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+
+DROP FUNCTION IF EXISTS util.ensure_connections(timetable_date date);
+
+-- Creates the connections for a date if they have not already been stored
+
+CREATE FUNCTION util.ensure_connections(timetable_date date)
+RETURNS void
+AS $EC$
+BEGIN
+    IF to_regclass(format('util.%I', 'connections_' ||
+                          to_char(timetable_date, 'YYYYMMDD'))) IS NULL THEN
+        PERFORM util.refresh_connections(timetable_date, 1);
+    END IF;
+END;
+$EC$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+
+DROP FUNCTION IF EXISTS util.drop_connections(before date);
+
+-- Drops the connections for all dates before the given date, so that a
+-- scheduled job can keep a rolling horizon of dates. If the date is NULL the
+-- connections for every date are dropped, as is done when the data they are
+-- built from is reloaded.
+
+CREATE FUNCTION util.drop_connections(before date)
+RETURNS integer
+AS $DC$
+DECLARE
+    part record;
+    n integer := 0;
+BEGIN
+    FOR part IN (SELECT c.relname
+                 FROM pg_inherits AS i
+                     INNER JOIN pg_class AS c ON (i.inhrelid = c.oid)
+                 WHERE i.inhparent = 'util.connections'::regclass) LOOP
+        IF before IS NULL
+                OR to_date(right(part.relname, 8), 'YYYYMMDD') < before THEN
+            EXECUTE format('DROP TABLE util.%I', part.relname);
+            n := n + 1;
+        END IF;
+    END LOOP;
+    RETURN n;
+END;
+$DC$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+
+DROP FUNCTION IF EXISTS util.get_direct_connections(station char(7),
+                                                    depart time,
+                                                    timetable_date date);
+
+CREATE FUNCTION util.get_direct_connections(station char(7),
+                                            depart time,
+                                            timetable_date date)
+RETURNS TABLE (
+        location char(7),
+        earliest_arrival time,
+        train_uid char(6)
+        )
+AS $B$
+BEGIN
+
+-- This does the same job as the version of this function that takes the name
+-- of a timetable table, but reads from the stored connections instead. The
+-- trains boarded at the station are found from their first connection, and
+-- then all the later connections of the same trains give the reachable
+-- locations. The date is inlined into the query so that only the relevant
+-- partition is examined.
+
+RETURN QUERY EXECUTE format('
+    SELECT location, util.minutes_to_time(arrival_min), train_uid
+    FROM (
+        WITH boarded AS (
+            SELECT train_uid, xmidnight, from_order
+            FROM util.connections
+            WHERE timetable_date = %L
+            AND from_location = $1
+            AND departure_min > $2
+            )
+        SELECT  c.to_location AS location,
+            c.arrival_min,
+            c.train_uid,
+            rank() OVER (PARTITION BY c.to_location ORDER BY c.arrival_min ASC) AS foo
+        FROM util.connections AS c
+            INNER JOIN boarded
+                ON (c.train_uid = boarded.train_uid
+                    AND c.xmidnight = boarded.xmidnight
+                    AND c.from_order >= boarded.from_order)
+        WHERE c.timetable_date = %L ) AS valid_routes
+    WHERE foo = 1;', timetable_date, timetable_date)
+        USING station, util.time_to_minutes(depart);
+END;
+$B$
+STABLE
+LANGUAGE 'plpgsql' PARALLEL SAFE;
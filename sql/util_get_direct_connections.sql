@@ -11,9 +11,11 @@ BEGIN
 
 -- The CTE valid_trains identifies all the train schedules that depart from the given station
 -- after the given time. The query valid_routes then makes a list of all the subsequent
--- stations on those train schedules, but not wrapping round across midnight.
+-- stations on those train schedules. The xmidnight flag distinguishes between two runs of the
+-- same train on the same day, and the times in minutes are all relative to the start of the day,
+-- so the arrivals can be compared directly.
 -- The window function partitions the results by location and
--- ranks the results by arrival time, with before-midnight trains first.
+-- ranks the results by arrival time.
 -- The outer query then only selects the earliest train arrival time for each location.
 
 RETURN QUERY EXECUTE format('
@@ -23,20 +25,20 @@ RETURN QUERY EXECUTE format('
             SELECT train_uid, loc_order, xmidnight
             FROM %I
             WHERE location = $1
-            AND scheduled_departure > $2
+            AND departure_min > $2
             )
         SELECT  location,
             scheduled_arrival,
             valid_trains.train_uid,
-            rank() OVER (PARTITION BY location ORDER BY timetable.xmidnight, scheduled_arrival ASC) AS foo
+            rank() OVER (PARTITION BY location ORDER BY arrival_min ASC) AS foo
         FROM %I AS timetable
             INNER JOIN valid_trains
                 ON (timetable.train_uid = valid_trains.train_uid
                     AND timetable.loc_order > valid_trains.loc_order
                     AND timetable.xmidnight = valid_trains.xmidnight)
-        WHERE scheduled_arrival IS NOT NULL ) AS valid_routes
+        WHERE arrival_min IS NOT NULL ) AS valid_routes
     WHERE foo = 1;', timetable, timetable)
-        USING station, depart;
+        USING station, util.time_to_minutes(depart);
 END;
 $B$
 STABLE
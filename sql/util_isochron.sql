@@ -12,32 +12,22 @@ RETURNS TABLE (
         northing integer
         )
 AS $IC$
-DECLARE
-
 BEGIN
-    CREATE TEMP TABLE isochron_tt AS
-        SELECT * FROM mca.get_full_timetable(timetable_date);
-    INSERT INTO isochron_tt SELECT * FROM ztr.get_full_timetable(timetable_date);
 
-    CREATE INDEX idx_isochron_tt_loc ON isochron_tt (location);
-    CREATE INDEX idx_isochron_tt_uid ON isochron_tt (train_uid);
-    ANALYZE isochron_tt;
+-- The routes are found by util.connection_scan, which only reads from the
+-- stored connections. They must have been created for the date beforehand, by
+-- util.refresh_connections or util.ensure_connections.
 
     RETURN QUERY SELECT ir.location,
             date_part('hour', (ir.earliest_arrival - depart)) +
             date_part('minute', (ir.earliest_arrival - depart)) / 60.0 AS delay,
             sd.easting*100-1000000 AS easting,
             sd.northing*100-6000000 AS northing
-        FROM util.iterate_reachable('isochron_tt',
-                                    station,
-                                    depart,
-                                    timetable_date,
-                                    10) AS ir
+        FROM util.connection_scan(station, depart, timetable_date) AS ir
             INNER JOIN msn.station_detail AS sd
                 ON (ir.location = sd.tiploc_code)
         ORDER BY ir.earliest_arrival;
-
-    DROP TABLE isochron_tt;
 END;
 $IC$
-LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+STABLE
+LANGUAGE 'plpgsql' PARALLEL SAFE;
@@ -0,0 +1,103 @@
+﻿DROP SEQUENCE IF EXISTS util.load_generation CASCADE;
+
+-- The load generation is advanced each time new data is loaded, and any
+-- cached results from an earlier generation are discarded.
+
+CREATE SEQUENCE util.load_generation;
+SELECT nextval('util.load_generation');
+
+DROP TABLE IF EXISTS util.isochron_cache CASCADE;
+
+CREATE TABLE util.isochron_cache (
+        station char(7),
+        timetable_date date,
+        depart time,
+        generation bigint,
+        location char(7),
+        delay double precision,
+        latitude double precision,
+        longitude double precision
+        );
+
+CREATE INDEX idx_isochron_cache ON util.isochron_cache (station,
+                                                        timetable_date,
+                                                        depart);
+
+DROP FUNCTION IF EXISTS util.invalidate_isochron_cache();
+
+CREATE FUNCTION util.invalidate_isochron_cache()
+RETURNS bigint
+AS $IV$
+DECLARE
+    g bigint;
+BEGIN
+    g := nextval('util.load_generation');
+    DELETE FROM util.isochron_cache WHERE generation < g;
+    RETURN g;
+END;
+$IV$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+
+DROP FUNCTION IF EXISTS util.isochron_cache_lookup(station char(7),
+                                                   depart time,
+                                                   timetable_date date);
+
+-- Returns the cached rows of util.isochron_latlon for the current generation,
+-- or no rows if the isochron has not been cached. This only reads from the
+-- cache so it can be used on a standby server.
+
+CREATE FUNCTION util.isochron_cache_lookup(station char(7),
+                                           depart time,
+                                           timetable_date date)
+RETURNS TABLE (
+        location char(7),
+        delay double precision,
+        lattitude double precision,
+        longitude double precision
+        )
+AS $$
+    SELECT ic.location, ic.delay, ic.latitude, ic.longitude
+    FROM util.isochron_cache AS ic
+    WHERE ic.station = $1
+        AND ic.depart = $2
+        AND ic.timetable_date = $3
+        AND ic.generation = (SELECT last_value FROM util.load_generation)
+    ORDER BY ic.delay;
+$$ STABLE LANGUAGE SQL PARALLEL SAFE;
+
+DROP FUNCTION IF EXISTS util.isochron_cache_store(station char(7),
+                                                  depart time,
+                                                  timetable_date date);
+
+-- Computes an isochron with util.isochron_latlon and stores it in the cache,
+-- replacing any earlier result for the same station, time and date. Returns
+-- the number of rows stored.
+
+CREATE FUNCTION util.isochron_cache_store(station char(7),
+                                          depart time,
+                                          timetable_date date)
+RETURNS bigint
+AS $IS$
+DECLARE
+    n bigint;
+BEGIN
+    DELETE FROM util.isochron_cache AS ic
+        WHERE ic.station = isochron_cache_store.station
+            AND ic.depart = isochron_cache_store.depart
+            AND ic.timetable_date = isochron_cache_store.timetable_date;
+
+    INSERT INTO util.isochron_cache
+    SELECT isochron_cache_store.station,
+        isochron_cache_store.timetable_date,
+        isochron_cache_store.depart,
+        (SELECT last_value FROM util.load_generation),
+        il.location, il.delay, il.lattitude, il.longitude
+    FROM util.isochron_latlon(isochron_cache_store.station,
+                              isochron_cache_store.depart,
+                              isochron_cache_store.timetable_date) AS il;
+    GET DIAGNOSTICS n = ROW_COUNT;
+
+    RETURN n;
+END;
+$IS$
+LANGUAGE 'plpgsql' PARALLEL UNSAFE;
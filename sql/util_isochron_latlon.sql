@@ -14,16 +14,18 @@ RETURNS TABLE (
 		longitude double precision
 		)
 AS $IC$
-DECLARE
-	i RECORD;
-	latlon RECORD;
 BEGIN
-	FOR i IN (SELECT * FROM util.isochron(station, depart, timetable_date)) LOOP
-		IF i.easting > 0 AND i.northing > 0 THEN
-			latlon = util.natgrid_en_to_latlon(i.easting, i.northing);
-			RETURN QUERY SELECT i.location, i.delay, latlon.lat, latlon.lon;
-		END IF;
-	END LOOP;
+
+-- The latitudes and longitudes of the stations are calculated when the station
+-- data is loaded, so they only have to be looked up here.
+
+	RETURN QUERY SELECT i.location, i.delay, sd.latitude, sd.longitude
+		FROM util.isochron(station, depart, timetable_date) AS i
+			INNER JOIN msn.station_detail AS sd
+				ON (i.location = sd.tiploc_code)
+		WHERE sd.latitude IS NOT NULL
+		ORDER BY i.delay;
 END;
 $IC$
-LANGUAGE 'plpgsql' PARALLEL UNSAFE;
+STABLE
+LANGUAGE 'plpgsql' PARALLEL SAFE;
@@ -20,6 +20,7 @@ DECLARE
     start_station record;
     next_station record;
     current_arrival time;
+    candidates refcursor;
 BEGIN
     DROP TABLE IF EXISTS temp_i_r;
     CREATE TEMPORARY TABLE temp_i_r (
@@ -43,8 +44,22 @@ BEGIN
             UPDATE temp_i_r SET processed = TRUE
                 WHERE temp_i_r.location = start_station.location;
 
-            <<over_new_connections>>
-            FOR next_station IN (   SELECT *
+            -- If no timetable table is given, the stored connections for
+            -- the date are used instead
+            IF timetable IS NULL THEN
+                OPEN candidates FOR
+                    SELECT *
+                    FROM util.get_direct_connections(start_station.location,
+                    start_station.earliest_departure,
+                    timetable_date)
+                    UNION
+                    SELECT *
+                    FROM alf.get_direct_connections(start_station.location,
+                    start_station.earliest_departure,
+                    timetable_date);
+            ELSE
+                OPEN candidates FOR
+                    SELECT *
                     FROM util.get_direct_connections(timetable,
                     start_station.location,
                     start_station.earliest_departure)
@@ -52,7 +67,13 @@ BEGIN
                     SELECT *
                     FROM alf.get_direct_connections(start_station.location,
                     start_station.earliest_departure,
-                    timetable_date)) LOOP
+                    timetable_date);
+            END IF;
+
+            <<over_new_connections>>
+            LOOP
+                FETCH candidates INTO next_station;
+                EXIT WHEN NOT FOUND;
 
                 SELECT temp_i_r.earliest_arrival
                 INTO current_arrival
@@ -84,6 +105,7 @@ BEGIN
                         NULL;
                 END CASE;
             END LOOP over_new_connections;
+            CLOSE candidates;
         END LOOP over_unprocessed_starting_stations;
     END LOOP iterations;
 
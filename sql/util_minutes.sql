@@ -0,0 +1,19 @@
+﻿DROP FUNCTION IF EXISTS util.time_to_minutes(t time);
+
+-- The location tables and the timetable functions give times as integer
+-- minutes after midnight as well as TIME values. These functions convert
+-- between the two, rounding any half-minutes down.
+
+CREATE FUNCTION util.time_to_minutes(t time)
+RETURNS integer
+AS $$
+    SELECT floor(EXTRACT(EPOCH FROM $1) / 60)::integer;
+$$ IMMUTABLE LANGUAGE SQL PARALLEL SAFE;
+
+DROP FUNCTION IF EXISTS util.minutes_to_time(m integer);
+
+CREATE FUNCTION util.minutes_to_time(m integer)
+RETURNS time
+AS $$
+    SELECT '00:00'::time + $1 * '1 minute'::interval;
+$$ IMMUTABLE LANGUAGE SQL PARALLEL SAFE;
@@ -0,0 +1,348 @@
+﻿DROP FUNCTION IF EXISTS util.reverse_connection_scan(station char(7),
+                                                     arrive time,
+                                                     timetable_date date);
+
+-- This finds the latest time at which every location can be left to reach a
+-- station by the given time, by running the Connection Scan Algorithm in
+-- reverse over the stored connections for the date. The connections are read
+-- once in descending order of departure, keeping the latest time at which a
+-- traveller can be ready to leave each location, and the train or fixed link
+-- used from each location and where it is left are held in arrays indexed by
+-- the ids from util.locations. The same interchange times and fixed links are
+-- used as in util.connection_scan: a train can be boarded once the
+-- interchange time has passed since arriving at a location, using the TOC
+-- specific interchange time for the two operators where there is one, and the
+-- fixed links are not followed on from the far end. A link can only be taken
+-- straight after arriving at a location, or from the starting point, within
+-- its hours of operation, so a train is only left where another train or a
+-- link can be taken from there in time. Journeys do not start before
+-- midnight. For each location the departure of the first train or link and
+-- the path to the station are returned.
+
+CREATE FUNCTION util.reverse_connection_scan(station char(7),
+                                             arrive time,
+                                             timetable_date date)
+RETURNS TABLE (
+        location char(7),
+        latest_departure time,
+        path char(6)[]
+        )
+AS $RC$
+DECLARE
+    never CONSTANT integer := -1073741824;
+    ta integer := util.time_to_minutes(arrive);
+    dow integer := EXTRACT(ISODOW FROM timetable_date);
+    n integer;
+    dest_id integer;
+    change integer[];
+    toc_change jsonb;
+    has_toc_change boolean[];
+    latest integer[];
+    latest_train integer[];
+    via_departure integer[];
+    via_to integer[];
+    via_arrival integer[];
+    via_uid char(6)[];
+    via_toc char(2)[];
+    by_link boolean[];
+    train_via jsonb[];
+    toc_via jsonb := '{}';
+    alight_at integer[];
+    alight_arrival integer[];
+    link_from integer[];
+    link_to integer[];
+    link_minutes integer[];
+    link_start integer[];
+    link_end integer[];
+    link_mode char(6)[];
+    link_first integer[];
+    link_last integer[];
+    c record;
+    o record;
+    d integer;
+    k integer;
+    m integer;
+    r integer;
+    x integer;
+    y integer;
+    ok boolean;
+    pending integer;
+    pending_ready integer;
+    pending_change integer;
+    arrived integer;
+    arrived_toc char(2);
+    after_link boolean;
+    best integer;
+    leg jsonb;
+    train_path char(6)[];
+    first_departure integer;
+BEGIN
+    IF to_regclass(format('util.%I', 'connections_' ||
+                          to_char(timetable_date, 'YYYYMMDD'))) IS NULL THEN
+        RAISE EXCEPTION 'No connections have been stored for %', timetable_date
+            USING HINT = 'Call util.refresh_connections on the primary server';
+    END IF;
+
+    SELECT l.location_id INTO dest_id
+        FROM util.locations AS l
+        WHERE l.location = station;
+
+    IF dest_id IS NULL THEN
+        RETURN QUERY SELECT station, arrive, NULL::char(6)[];
+        RETURN;
+    END IF;
+
+    -- The interchange time at each location, with gaps in the ids filled in
+    SELECT MAX(l.location_id) INTO n FROM util.locations AS l;
+
+    SELECT array_agg(COALESCE(sd.change_time, 0) ORDER BY i)
+        INTO change
+        FROM generate_series(1, n) AS i
+            LEFT JOIN util.locations AS l ON (l.location_id = i)
+            LEFT JOIN msn.station_detail AS sd ON (sd.tiploc_code = l.location);
+
+    -- The TOC specific interchange times, keyed by location id and the
+    -- arriving and departing operators
+    SELECT jsonb_object_agg(format('%s:%s:%s', l.location_id, i.arriving_toc,
+                                   i.departing_toc), i.change_time)
+        INTO toc_change
+        FROM msn.interchange AS i
+            INNER JOIN util.locations AS l ON (l.location = i.tiploc_code)
+        WHERE i.arriving_toc <> '**' OR i.departing_toc <> '**';
+
+    FOR x IN (SELECT DISTINCT l.location_id
+              FROM msn.interchange AS i
+                  INNER JOIN util.locations AS l
+                      ON (l.location = i.tiploc_code)
+              WHERE i.arriving_toc <> '**' OR i.departing_toc <> '**') LOOP
+        has_toc_change[x] := TRUE;
+    END LOOP;
+
+    -- The fixed links that apply on the date, sorted by origin so that the
+    -- links from each location are a contiguous slice of the arrays. As the
+    -- links are symmetrical these are also the links to each location.
+    SELECT array_agg(fl.from_id ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.to_id ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.link_minutes ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.start_min ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.end_min ORDER BY fl.from_id, fl.to_id),
+           array_agg(fl.mode ORDER BY fl.from_id, fl.to_id)
+        INTO link_from, link_to, link_minutes, link_start, link_end, link_mode
+        FROM (
+            SELECT f.location_id AS from_id, t.location_id AS to_id,
+                al.mode,
+                util.time_to_minutes(al.start_time) AS start_min,
+                util.time_to_minutes(al.end_time) AS end_min,
+                MAX(al.link_time) AS link_minutes
+            FROM alf.links AS al
+                INNER JOIN util.locations AS f
+                    ON (f.location = al.from_tiploc)
+                INNER JOIN util.locations AS t
+                    ON (t.location = al.to_tiploc)
+            WHERE al.days_mask & (1 << (dow - 1)) <> 0 AND
+                al.valid_dates @> timetable_date
+            GROUP BY 1, 2, 3, 4, 5
+            ) AS fl;
+
+    FOR k IN 1 .. COALESCE(array_length(link_from, 1), 0) LOOP
+        IF link_first[link_from[k]] IS NULL THEN
+            link_first[link_from[k]] := k;
+        END IF;
+        link_last[link_from[k]] := k;
+    END LOOP;
+
+    -- The latest ready time at each location for leaving by any means and
+    -- for leaving by train (with the standard interchange time). The latest
+    -- ready time for leaving by train is one minute before it departs.
+    latest[dest_id] := ta;
+    latest_train[dest_id] := ta;
+    via_departure[dest_id] := ta;
+    pending := dest_id;
+    pending_ready := ta;
+    pending_change := 0;
+
+    -- A final row of NULLs is added to the connections so that the fixed
+    -- links to the location improved by the last connection are followed.
+    <<over_connections>>
+    FOR c IN EXECUTE format('
+        SELECT trip_id, train_uid, toc, from_id, departure_min, to_id,
+            arrival_min
+        FROM util.connections
+        WHERE timetable_date = %L
+            AND departure_min <= $1
+            AND arrival_min <= $1
+            AND arrival_min < 1440
+            AND from_id <> $2
+        UNION ALL
+        SELECT NULL, NULL, NULL, NULL, NULL, NULL, NULL
+        ORDER BY departure_min DESC NULLS LAST',
+        timetable_date) USING ta, dest_id LOOP
+
+        -- Follow the fixed links to the location that was improved by the
+        -- previous connection. A link must be left within its hours of
+        -- operation and in time to catch the train at the far end.
+        IF pending IS NOT NULL AND link_first[pending] IS NOT NULL THEN
+            FOR k IN link_first[pending] .. link_last[pending] LOOP
+                y := link_to[k];
+                d := LEAST(pending_ready - pending_change - link_minutes[k],
+                           link_end[k]);
+                CONTINUE WHEN d < link_start[k] OR
+                              d <= COALESCE(latest[y], never);
+                latest[y] := d;
+                via_departure[y] := d;
+                via_to[y] := pending;
+                via_arrival[y] := d + link_minutes[k];
+                via_uid[y] := link_mode[k];
+                via_toc[y] := NULL;
+                by_link[y] := TRUE;
+            END LOOP;
+        END IF;
+        pending := NULL;
+
+        EXIT over_connections WHEN c.trip_id IS NULL;
+
+        -- A train is only useful if it is stayed on to a later stop that is
+        -- useful, or if it reaches the station or a location where the
+        -- journey can be continued after the interchange time, by a train
+        -- or straight away by a fixed link.
+        IF alight_at[c.trip_id] IS NULL THEN
+            IF c.to_id <> dest_id THEN
+                r := c.arrival_min + change[c.to_id];
+                ok := FALSE;
+                IF has_toc_change[c.to_id] AND c.toc IS NOT NULL THEN
+                    FOR o IN SELECT * FROM jsonb_each(toc_via ->
+                                                      c.to_id::text) LOOP
+                        m := (toc_change ->> format('%s:%s:%s', c.to_id,
+                                                    c.toc, o.key))::integer;
+                        IF COALESCE(c.arrival_min + m, r) <
+                                (o.value ->> 0)::integer THEN
+                            ok := TRUE;
+                            EXIT;
+                        END IF;
+                    END LOOP;
+                ELSE
+                    ok := r <= COALESCE(latest_train[c.to_id], never);
+                END IF;
+                IF NOT ok AND link_first[c.to_id] IS NOT NULL THEN
+                    FOR k IN link_first[c.to_id] .. link_last[c.to_id] LOOP
+                        y := link_to[k];
+                        CONTINUE WHEN r NOT BETWEEN link_start[k]
+                                                AND link_end[k];
+                        IF r + link_minutes[k] +
+                                (CASE WHEN y = dest_id THEN 0
+                                      ELSE change[y] END) <=
+                                COALESCE(latest_train[y], never) THEN
+                            ok := TRUE;
+                            EXIT;
+                        END IF;
+                    END LOOP;
+                END IF;
+                CONTINUE over_connections WHEN NOT ok;
+            END IF;
+            alight_at[c.trip_id] := c.to_id;
+            alight_arrival[c.trip_id] := c.arrival_min;
+        END IF;
+
+        -- At locations with TOC specific interchange times, the latest train
+        -- of each operator is kept, as which trains can be caught depends on
+        -- the operator of the train arrived on.
+        IF has_toc_change[c.from_id] AND
+                COALESCE((toc_via #>> ARRAY[c.from_id::text,
+                                            COALESCE(c.toc, ''),
+                                            '0'])::integer,
+                         never) < c.departure_min THEN
+            toc_via := jsonb_set(toc_via, ARRAY[c.from_id::text],
+                COALESCE(toc_via -> c.from_id::text, '{}') ||
+                    jsonb_build_object(COALESCE(c.toc, ''),
+                        jsonb_build_array(c.departure_min,
+                                          alight_at[c.trip_id],
+                                          alight_arrival[c.trip_id],
+                                          c.train_uid, c.toc)));
+        END IF;
+
+        IF c.departure_min - 1 > COALESCE(latest_train[c.from_id], never) THEN
+            latest_train[c.from_id] := c.departure_min - 1;
+            train_via[c.from_id] := jsonb_build_array(
+                c.departure_min, alight_at[c.trip_id],
+                alight_arrival[c.trip_id], c.train_uid, c.toc);
+            IF c.departure_min - 1 > COALESCE(latest[c.from_id], never) THEN
+                latest[c.from_id] := c.departure_min - 1;
+                via_departure[c.from_id] := c.departure_min;
+                via_to[c.from_id] := alight_at[c.trip_id];
+                via_arrival[c.from_id] := alight_arrival[c.trip_id];
+                via_uid[c.from_id] := c.train_uid;
+                via_toc[c.from_id] := c.toc;
+                by_link[c.from_id] := FALSE;
+            END IF;
+            pending := c.from_id;
+            pending_ready := c.departure_min - 1;
+            pending_change := change[c.from_id];
+        END IF;
+    END LOOP over_connections;
+
+    -- The paths are built up by following the chain of locations where each
+    -- train or link is left on to the station. After arriving by train, the
+    -- latest train that can be caught is used, taking account of any TOC
+    -- specific interchange times, or if there is none a fixed link that can
+    -- be taken straight away.
+    FOR x IN 1 .. n LOOP
+        CONTINUE WHEN latest[x] IS NULL;
+        train_path := NULL;
+        first_departure := via_departure[x];
+        leg := jsonb_build_array(via_departure[x], via_to[x], via_arrival[x],
+                                 via_uid[x], via_toc[x]);
+        after_link := COALESCE(by_link[x], FALSE);
+        y := x;
+        WHILE y <> dest_id LOOP
+            train_path := train_path || (leg ->> 3)::char(6);
+            arrived := (leg ->> 2)::integer;
+            arrived_toc := leg ->> 4;
+            y := (leg ->> 1)::integer;
+            EXIT WHEN y = dest_id;
+
+            r := arrived + change[y];
+            leg := NULL;
+            IF arrived_toc IS NOT NULL AND has_toc_change[y] THEN
+                best := never;
+                FOR o IN SELECT * FROM jsonb_each(toc_via -> y::text) LOOP
+                    m := (toc_change ->> format('%s:%s:%s', y, arrived_toc,
+                                                o.key))::integer;
+                    IF COALESCE(arrived + m, r) < (o.value ->> 0)::integer AND
+                            (o.value ->> 0)::integer > best THEN
+                        leg := o.value;
+                        best := (o.value ->> 0)::integer;
+                    END IF;
+                END LOOP;
+            ELSIF r <= COALESCE(latest_train[y], never) THEN
+                leg := train_via[y];
+            END IF;
+            IF leg IS NOT NULL THEN
+                after_link := FALSE;
+            ELSIF NOT after_link AND link_first[y] IS NOT NULL THEN
+                FOR k IN link_first[y] .. link_last[y] LOOP
+                    CONTINUE WHEN r NOT BETWEEN link_start[k] AND link_end[k];
+                    IF r + link_minutes[k] +
+                            (CASE WHEN link_to[k] = dest_id THEN 0
+                                  ELSE change[link_to[k]] END) <=
+                            COALESCE(latest_train[link_to[k]], never) THEN
+                        leg := jsonb_build_array(r, link_to[k],
+                                                 r + link_minutes[k],
+                                                 link_mode[k], NULL);
+                        after_link := TRUE;
+                        EXIT;
+                    END IF;
+                END LOOP;
+            END IF;
+        END LOOP;
+
+        SELECT l.location INTO location
+            FROM util.locations AS l
+            WHERE l.location_id = x;
+        latest_departure := util.minutes_to_time(first_departure);
+        path := train_path;
+        RETURN NEXT;
+    END LOOP;
+END;
+$RC$
+STABLE
+LANGUAGE 'plpgsql' PARALLEL SAFE;
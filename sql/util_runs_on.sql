@@ -0,0 +1,23 @@
+﻿DROP FUNCTION IF EXISTS util.runs_on(days_bitmap bit varying,
+                                     period_start date,
+                                     timetable_date date);
+
+-- Tests the day bitmap of a schedule, as stored in the basic_schedule tables,
+-- to see if the schedule runs on the given date. The bitmap has one bit for
+-- each day of the timetable period, starting with period_start, and dates
+-- outside the period are treated as not running. For example:
+--
+-- SELECT train_uid, date_runs_from, stp_indicator
+-- FROM mca.basic_schedule, mca.calendar_period
+-- WHERE util.runs_on(days_bitmap, period_start, '2015-05-09');
+
+CREATE FUNCTION util.runs_on(days_bitmap bit varying,
+                             period_start date,
+                             timetable_date date)
+RETURNS boolean
+AS $$
+    SELECT CASE WHEN $3 >= $2 AND $3 - $2 < length($1)
+        THEN get_bit($1, $3 - $2) = 1
+        ELSE FALSE
+    END;
+$$ IMMUTABLE LANGUAGE SQL PARALLEL SAFE;
@@ -0,0 +1,78 @@
+﻿DROP FUNCTION IF EXISTS ztr.get_full_timetable_range (start_date date, end_date date);
+
+-- This returns the same rows as ztr.get_full_timetable for every date from start_date to end_date
+-- inclusive, with the date they apply to as the first column, in a single query. Each effective
+-- schedule is only expanded on the dates it runs in the range (and the day before the range, for
+-- the trains that continue past midnight into the first day), and the location tables are read
+-- once for the whole range rather than once for each date. A stop at a time of 1440 minutes or
+-- more after the midnight at the start of the train's journey belongs to the following day.
+
+CREATE OR REPLACE FUNCTION ztr.get_full_timetable_range (start_date date, end_date date)
+RETURNS TABLE ( timetable_date date,
+        train_uid character(6),
+        stp_indicator character(1),
+        loc_order integer,
+        xmidnight boolean,
+        location character(7),
+        scheduled_arrival time without time zone,
+        scheduled_departure time without time zone,
+        scheduled_pass time without time zone,
+        platform character(3),
+        arrival_min integer,
+        departure_min integer,
+        pass_min integer ) AS $$
+
+    WITH bs AS (
+    -- The dates on which each effective schedule runs within the range
+        SELECT es.train_uid, es.date_runs_from, es.stp_indicator, d::date AS run_date
+        FROM generate_series($1 - 1, $2, '1 day'::interval) AS d
+            INNER JOIN ztr.effective_schedule AS es
+                ON (es.valid_dates @> d::date AND
+                    es.day_of_week = EXTRACT(ISODOW FROM d))
+    ), locations AS (
+    -- The locations CTE just joins together the three location tables and fills in NULLs as appropriate
+    -- adding the WHERE condition in help significantly with the run-time.
+        SELECT train_uid, date_runs_from, stp_indicator,
+            loc_order, xmidnight, sd.tiploc_code AS location,
+            NULL::time AS scheduled_arrival, scheduled_departure, NULL::time AS scheduled_pass,
+            platform, arrival_min, departure_min, pass_min
+        FROM ztr.origin_location
+            INNER JOIN msn.station_detail AS sd ON (LEFT(location,3) = sd._3_alpha_code)
+        WHERE   date_runs_from <= $2
+        UNION ALL
+        SELECT train_uid, date_runs_from, stp_indicator,
+            loc_order, xmidnight, sd.tiploc_code AS location,
+            scheduled_arrival, scheduled_departure, scheduled_pass,
+            platform, arrival_min, departure_min, pass_min
+        FROM ztr.intermediate_location
+            INNER JOIN msn.station_detail AS sd ON (LEFT(location,3) = sd._3_alpha_code)
+        WHERE   date_runs_from <= $2
+        UNION ALL
+        SELECT train_uid, date_runs_from, stp_indicator,
+            loc_order, xmidnight, sd.tiploc_code AS location,
+            scheduled_arrival, NULL::time AS scheduled_departure, NULL::time AS scheduled_pass,
+            platform, arrival_min, departure_min, pass_min
+        FROM ztr.terminating_location
+            INNER JOIN msn.station_detail AS sd ON (LEFT(location,3) = sd._3_alpha_code)
+        WHERE   date_runs_from <= $2
+    ), stops AS (
+        SELECT run_date, train_uid, stp_indicator, loc_order,
+            xmidnight, location, scheduled_arrival,
+            scheduled_departure, scheduled_pass, platform,
+            arrival_min, departure_min, pass_min,
+            CASE WHEN COALESCE(arrival_min, departure_min, pass_min) >= 1440
+                THEN 1440 ELSE 0
+            END AS day_offset
+        FROM locations
+            INNER JOIN bs USING (train_uid, date_runs_from, stp_indicator)
+    )
+    SELECT run_date + day_offset / 1440, train_uid, stp_indicator, loc_order,
+        xmidnight, location, scheduled_arrival,
+        scheduled_departure, scheduled_pass, platform,
+        arrival_min - day_offset, departure_min - day_offset, pass_min - day_offset
+    FROM stops
+    WHERE COALESCE(arrival_min, departure_min, pass_min) - day_offset BETWEEN 0 AND 1439 AND
+        run_date + day_offset / 1440 BETWEEN $1 AND $2
+    ORDER BY 1, train_uid, loc_order
+
+$$ STABLE LANGUAGE SQL PARALLEL SAFE;
@@ -0,0 +1,121 @@
+# test_csa.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''test_csa - Tests for the Connection Scan Algorithm searches'''
+
+import datetime
+import random
+import unittest
+
+from nrcif.routing.timetable import Timetable
+import nrcif.routing.csa as csa
+
+
+def station(tiploc, change_time=0):
+    '''Return a station row for a Timetable with no name or position'''
+
+    return (tiploc, None, None, 2, change_time, None, None)
+
+
+class TestLinks(unittest.TestCase):
+    '''Tests of the fixed links in the forward scan'''
+
+    def setUp(self):
+        # ORIGIN can walk to MIDDLE sooner than the train gets there, but the
+        # link on to FINAL can only be taken after arriving by train
+        stations = [station(x) for x in ("ORIGIN", "MIDDLE", "FINAL")]
+        connections = [("T00001", False, "ORIGIN", 610, "MIDDLE", 620, "GW")]
+        links = [("ORIGIN", "MIDDLE", "WALK  ", 0, 1439, 5),
+                 ("MIDDLE", "FINAL", "WALK  ", 0, 1439, 5)]
+        self.tt = Timetable(datetime.date(2016, 1, 1), stations, connections,
+                            links)
+
+    def test_link_after_later_train(self):
+        result = csa.connection_scan(self.tt, self.tt.index["ORIGIN"], 600)
+        middle = self.tt.index["MIDDLE"]
+        final = self.tt.index["FINAL"]
+        self.assertEqual(result.arrival[middle], 605)
+        self.assertEqual(result.path(middle), ["WALK  "])
+        self.assertEqual(result.arrival[final], 625)
+        self.assertEqual(result.path(final), ["T00001", "WALK  "])
+        self.assertEqual(result.legs(final)[0],
+                         (self.tt.index["ORIGIN"], 610, middle, 620,
+                          "T00001"))
+
+
+def random_timetable(seed, size=30, trains=200, links=15):
+    '''Return a random Timetable, with fixed links that only operate for part
+    of the day'''
+
+    rng = random.Random(seed)
+    names = ["S{:06d}".format(i) for i in range(size)]
+    stations = [station(x, rng.choice((0, 2, 5))) for x in names]
+    connections = []
+    for k in range(trains):
+        stops = rng.sample(names, rng.randint(2, 5))
+        t = rng.randint(300, 1300)
+        for a, b in zip(stops, stops[1:]):
+            d = t
+            t += rng.randint(1, 40)
+            connections.append(("T{:05d}".format(k), False, a, d, b, t,
+                                rng.choice(("GW", "XC"))))
+            t += rng.randint(0, 3)
+    connections.sort(key=lambda x: x[3])
+    fixed = []
+    for k in range(links):
+        a, b = rng.sample(names, 2)
+        start = rng.choice((0, 0, 400, 700))
+        end = rng.choice((1439, 1439, 900, 1000))
+        minutes = rng.randint(3, 20)
+        fixed += [(a, b, "WALK  ", start, end, minutes),
+                  (b, a, "WALK  ", start, end, minutes)]
+    return Timetable(datetime.date(2016, 1, 1), stations, connections,
+                     fixed)
+
+
+class TestReverse(unittest.TestCase):
+    '''Tests that the reverse scan agrees with the forward scan'''
+
+    def test_forward_from_latest(self):
+        # Leaving at the latest departure arrives in time, and leaving a
+        # minute later does not
+        for seed in range(20):
+            tt = random_timetable(seed)
+            rng = random.Random(seed)
+            for destination in rng.sample(range(len(tt.locations)), 5):
+                arrive = rng.randint(600, 1439)
+                result = csa.reverse_connection_scan(tt, destination, arrive)
+                for x in result.reached():
+                    if x == destination:
+                        continue
+                    with self.subTest(seed=seed, destination=destination,
+                                      origin=x):
+                        forward = csa.connection_scan(tt, x,
+                                                      result.latest[x])
+                        self.assertLessEqual(forward.arrival[destination],
+                                             arrive)
+                        later = csa.connection_scan(tt, x,
+                                                    result.latest[x] + 1)
+                        self.assertGreater(later.arrival[destination],
+                                           arrive)
+                        legs = result.legs(x)
+                        self.assertEqual(legs[-1][2], destination)
+                        self.assertLessEqual(legs[-1][3], arrive)
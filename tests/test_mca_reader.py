@@ -0,0 +1,136 @@
+# test_mca_reader.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''test_mca_reader - Tests for the MCA timetable reader'''
+
+import re
+import unittest
+
+import nrcif.records
+import nrcif.mca_reader
+
+
+def record(rtype, **values):
+    '''Build a fixed-format record of the given type, with the fields given
+    by their names and any others left blank'''
+
+    result = ""
+    for field in nrcif.records.layouts[rtype].fields:
+        if field.name == "Record Identity":
+            value = rtype
+        else:
+            value = values.get(field.name, "")
+        result += value.ljust(field.width)[:field.width]
+    return result.ljust(80)
+
+
+class RecordingCursor(object):
+    '''A DB API cursor that keeps the rows executed with each prepared
+    statement, keyed on the table name'''
+
+    _prepare = re.compile(r"\s*PREPARE (\w+) AS\s+INSERT INTO \w+\.(\w+) ")
+    _execute = re.compile(r"EXECUTE (\w+) ")
+
+    def __init__(self):
+        self.statements = dict()
+        self.rows = dict()
+
+    def execute(self, sql, params=None):
+        match = self._prepare.match(sql)
+        if match:
+            self.statements[match.group(1)] = match.group(2)
+            return
+        match = self._execute.match(sql)
+        if match:
+            table = self.statements[match.group(1)]
+            self.rows.setdefault(table, []).append(list(params))
+
+
+# PADTON d23:40 -> READING a23:58 d00:02 -> BRSTLTM a01:00, so midnight falls
+# between the arrival and the departure at Reading
+OVERNIGHT = [
+    record("HD", **{"Date of Extract": "010120",
+                    "Time of Extract": "1200",
+                    "Bleed-off/Update Ind": "F",
+                    "User Extract Start Date": "010120",
+                    "User Extract End Date": "311220"}),
+    record("BS", **{"Transaction Type": "N", "Train UID": "C12345",
+                    "Date Runs From": "200106", "Date Runs To": "201218",
+                    "Days Run": "1111100", "STP Indicator": "P"}),
+    record("LO", **{"Location": "PADTON", "Scheduled Departure": "2340",
+                    "Public Departure": "2340"}),
+    record("LI", **{"Location": "READING", "Scheduled Arrival": "2358",
+                    "Scheduled Departure": "0002H",
+                    "Public Arrival": "2358", "Public Departure": "0002"}),
+    record("LT", **{"Location": "BRSTLTM", "Scheduled Arrival": "0100",
+                    "Public Arrival": "0100"}),
+    "ZZ".ljust(80)
+    ]
+
+
+class TestMidnight(unittest.TestCase):
+    '''Trains that cross midnight, including between the arrival and
+    departure at a stop'''
+
+    def load(self, stopping_patterns=False):
+        cur = RecordingCursor()
+        reader = nrcif.mca_reader.MCA(cur,
+                                      stopping_patterns=stopping_patterns)
+        for line in OVERNIGHT:
+            reader.process(line)
+        return cur.rows
+
+    def test_minutes(self):
+        rows = self.load()
+        origin = rows["origin_location"][0]
+        stop = rows["intermediate_location"][0]
+        terminus = rows["terminating_location"][0]
+
+        # arrival_min, departure_min, pass_min are the last three columns
+        self.assertEqual(origin[-3:], [None, 1420, None])
+        self.assertEqual(stop[-3:], [1438, 1442, None])
+        self.assertEqual(terminus[-3:], [1500, None, None])
+
+        # xmidnight is the fifth column, and is set by the first time given
+        self.assertEqual([origin[4], stop[4], terminus[4]],
+                         [False, False, True])
+
+    def test_half_minutes(self):
+        rows = self.load(stopping_patterns=True)
+        location = rows["schedule_location"][0]
+
+        # arrival_hm, departure_hm and pass_hm follow the pattern_id
+        self.assertEqual(location[4:7], ["{NULL,2876,3000}",
+                                         "{2840,2885,NULL}",
+                                         "{NULL,NULL,NULL}"])
+
+    def test_never_decrease(self):
+        rows = self.load()
+        times = []
+        for table in ("origin_location", "intermediate_location",
+                      "terminating_location"):
+            for row in rows[table]:
+                times.extend(x for x in row[-3:] if x is not None)
+        self.assertEqual(times, sorted(times))
+
+
+if __name__ == "__main__":
+    unittest.main()
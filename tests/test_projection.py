@@ -0,0 +1,105 @@
+# test_projection.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''test_projection - Tests for choosing the records and fields to load'''
+
+import datetime
+import unittest
+
+from nrcif.mca_reader import MCA
+from nrcif.projection import Projection
+
+from tests.test_mca_reader import OVERNIGHT, RecordingCursor
+
+
+class TestKeyFields(unittest.TestCase):
+    '''Tests that the fields other parts of the project need are kept'''
+
+    def test_needed_fields(self):
+        for field in ("BS.bank_holiday_running", "BX.atoc_code",
+                      "LO.platform", "LI.platform", "LT.platform"):
+            with self.subTest(field=field):
+                with self.assertRaises(ValueError):
+                    MCA.project_layouts(Projection(exclude_fields=[field]))
+
+    def test_needed_records(self):
+        with self.assertRaises(ValueError):
+            MCA.project_layouts(Projection(exclude_records=["BX"]))
+        layouts, skipped = MCA.project_layouts(
+            Projection(include_records=["TI"]))
+        self.assertNotIn("BX", skipped)
+
+    def test_include_fields(self):
+        layouts, skipped = MCA.project_layouts(
+            Projection(include_fields=["LI.public_arrival"]))
+        kept = [x.name for x in layouts["LI"].fields
+                if x.sql_type and not x.excluded]
+        self.assertIn("Platform", kept)
+        self.assertIn("Public Arrival", kept)
+        self.assertNotIn("Line", kept)
+
+
+class TestProjectedLoad(unittest.TestCase):
+    '''Tests that the fields left out by a projection are not loaded'''
+
+    def load(self, projection=None):
+        cur = RecordingCursor()
+        reader = MCA(cur, projection=projection)
+        for line in OVERNIGHT:
+            reader.process(line)
+        return reader, cur.rows
+
+    def test_rows(self):
+        full_reader, full = self.load()
+        reader, rows = self.load(Projection(
+            include_fields=["BS.train_status", "LI.public_arrival"]))
+
+        # The location rows start with the train UID, date runs from, STP
+        # indicator, loc_order and xmidnight before the record's fields
+        for table, rtype, offset in (("basic_schedule", "BS", 0),
+                                     ("origin_location", "LO", 5),
+                                     ("intermediate_location", "LI", 5),
+                                     ("terminating_location", "LT", 5)):
+            with self.subTest(table=table):
+                omitted = reader.layouts[rtype].omitted
+                self.assertEqual(len(rows[table][0]),
+                                 len(full[table][0]) - len(omitted))
+                self.assertEqual(rows[table][0],
+                                 [x for i, x in enumerate(full[table][0])
+                                  if i - offset not in omitted])
+
+        self.assertTrue(reader.layouts["BS"].omitted)
+        self.assertTrue(reader.layouts["LI"].omitted)
+        self.assertFalse(reader.layouts["LO"].omitted)
+
+        # The key fields and the kept fields still hold their values
+        schedule = rows["basic_schedule"][0]
+        self.assertEqual(schedule[:2], ["C12345", datetime.date(2020, 1, 6)])
+        self.assertIn("P", schedule)
+        stop = rows["intermediate_location"][0]
+        self.assertEqual(stop[5], "READING")
+        self.assertIn(datetime.time(23, 58), stop)
+        self.assertNotIn(datetime.time(0, 2), stop)
+        self.assertEqual(stop[-3:], [1438, 1442, None])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+# test_service.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+
+'''test_service - Tests for the routing service and daemon'''
+
+import datetime
+import os
+import runpy
+import unittest
+
+from nrcif.routing.timetable import Timetable
+import nrcif.routing.service
+
+
+class TestRoutingService(unittest.TestCase):
+    '''Tests of queries answered by the pool of worker processes'''
+
+    def setUp(self):
+        self.date = datetime.date(2016, 1, 1)
+        stations = [("ORIGIN", "Origin", "ORI", 2, 0, 52.0, 0.0),
+                    ("MIDDLE", "Middle", "MID", 2, 0, 52.5, 0.0),
+                    ("FINAL", "Final", "FIN", 2, 0, 53.0, 0.0)]
+        connections = [("T00001", False, "ORIGIN", 610, "MIDDLE", 620, "GW"),
+                       ("T00001", False, "MIDDLE", 621, "FINAL", 640, "GW")]
+        names = [("Origin", "ORIGIN", 2), ("Middle", "MIDDLE", 2),
+                 ("Midway Parkway", "MIDDLE", 2), ("Final", "FINAL", 2)]
+        tt = Timetable(self.date, stations, connections, [], names=names)
+        self.service = nrcif.routing.service.RoutingService(None, None, 0,
+                                                            workers=1)
+        self.service.set_timetables({self.date: tt})
+
+    def tearDown(self):
+        self.service.close()
+
+    def test_isochron(self):
+        rows = self.service.isochron(self.date, "ORIGIN", 600)
+        self.assertEqual([x[0] for x in rows], ["ORIGIN", "MIDDLE", "FINAL"])
+        self.assertAlmostEqual(rows[-1][1], 40 / 60.0)
+
+    def test_station_alias(self):
+        self.assertEqual(self.service.search_stations("parkway"),
+                         [("MIDDLE", "Midway Parkway", 2)])
+        legs = self.service.journey(self.date, "ORIGIN", "Midway", 600)
+        self.assertEqual(legs[-1][2:4], ("MIDDLE", 620))
+
+    def test_unknown_date(self):
+        with self.assertRaises(KeyError):
+            self.service.isochron(self.date + datetime.timedelta(days=1),
+                                  "ORIGIN", 600)
+
+
+class TestRoutingDaemon(unittest.TestCase):
+    '''Tests of the routing daemon script'''
+
+    def test_import_does_nothing(self):
+        # The fork server imports the script again in each worker process,
+        # which must not parse the arguments or start a service
+        path = os.path.join(os.path.dirname(os.path.dirname(__file__)),
+                            "routing_daemon.py")
+        daemon = runpy.run_path(path, run_name="__mp_main__")
+        self.assertIsNone(daemon["args"])
+        self.assertIsNone(daemon["service"])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,129 @@
+# travel_time_matrix.py
+
+# Copyright 2013 - 2016, James Humphry
+
+#  This program is free software; you can redistribute it and/or modify
+#  it under the terms of the GNU General Public License as published by
+#  the Free Software Foundation; either version 2 of the License, or
+#  (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software
+#  Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+#  MA 02110-1301, USA.
+#
+
+''' travel_time_matrix.py - Compute the shortest journey times between every
+    pair of stations for departures in a time band on a date, and store them
+    as a memory-mappable matrix.'''
+
+import os
+import argparse
+import datetime
+import time
+
+import psycopg2
+
+import nrcif.routing.service
+from nrcif.routing.batch import select_origins
+from nrcif.routing.matrix import MatrixBatch
+
+from nrcif.fields import time_to_minutes
+
+
+def read_date(date_argument):
+    '''Convert the date_argument string to a date object'''
+
+    return datetime.datetime.strptime(date_argument, '%Y-%m-%d').date()
+
+
+def read_time(time_argument):
+    '''Convert the time_argument string to minutes after midnight'''
+
+    return time_to_minutes(datetime.datetime.strptime(time_argument,
+                                                      '%H:%M').time())
+
+parser = argparse.ArgumentParser()
+parser.add_argument("DATE", help="The timetable date in the format "
+                                 "'2015-01-01'",
+                    type=read_date)
+parser.add_argument("FIRST", help="The first departure time in the format "
+                                  "'07:00'",
+                    type=read_time)
+parser.add_argument("LAST", help="The last departure time in the format "
+                                 "'10:00'",
+                    type=read_time)
+parser.add_argument("OUTPUT", help="The file name for the matrix, to which "
+                                   "'.npy' and '.json' are added")
+parser.add_argument("--step", help="Minutes between the departure times "
+                                   "tried (default 15)",
+                    action="store", type=int, default=15)
+parser.add_argument("--max-cate", help="Include the stations with a CATE "
+                                       "interchange type up to this value "
+                                       "(default 3)",
+                    action="store", type=int, default=3)
+parser.add_argument("--workers", help="Number of worker processes "
+                                      "(default one per CPU)",
+                    action="store", type=int, default=None)
+
+parser_db = parser.add_argument_group("database arguments")
+parser_db.add_argument("--database",
+                       help="PostgreSQL database to use (default ukraildata)",
+                       action="store", default="ukraildata")
+parser_db.add_argument("--user", help="PostgreSQL user for upload",
+                       action="store",
+                       default=os.environ.get("USER", "postgres"))
+parser_db.add_argument("--password", help="PostgreSQL user password",
+                       action="store", default="")
+parser_db.add_argument("--host", help="PostgreSQL host (if using TCP/IP)",
+                       action="store", default=None)
+parser_db.add_argument("--port", help="PostgreSQL port (if required)",
+                       action="store", type=int, default=5432)
+args = parser.parse_args()
+
+if args.LAST < args.FIRST:
+    parser.error("The last departure time is before the first")
+
+if args.host:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password,
+                                  host=args.host,
+                                  port=args.port)
+else:
+    connection = psycopg2.connect(database=args.database,
+                                  user=args.user,
+                                  password=args.password)
+
+with connection.cursor() as cur:
+    print("Loading timetable for {}".format(args.DATE), flush=True)
+    timetable = nrcif.routing.service.load_timetables(cur, args.DATE,
+                                                      1)[args.DATE]
+connection.close()
+
+stations = select_origins(timetable, args.max_cate)
+departures = list(range(args.FIRST, args.LAST + 1, max(1, args.step)))
+print("Computing journey times between {} stations for {} departure times"
+      .format(len(stations), len(departures)), flush=True)
+
+batch = MatrixBatch(timetable, stations, departures, args.workers)
+start = time.perf_counter()
+try:
+    for done in batch.run(args.OUTPUT):
+        if done % 100 == 0:
+            print("{} of {} stations done".format(done, len(stations)),
+                  flush=True)
+finally:
+    batch.close()
+elapsed = time.perf_counter() - start
+
+print("Computed {} rows in {:.1f}s".format(len(stations), elapsed))
+for w in batch.worker_stats():
+    print("Worker {}: {} rows in {:.1f}s ({:.2f} per second)"
+          .format(w.pid, w.jobs, w.seconds,
+                  w.jobs / w.seconds if w.seconds else 0.0))